@@ -28,10 +28,17 @@ Note:
 #%% imports and path handling
 
 import os
+import sys
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import rasterio
-import rasterstats
+from pathlib import Path
+
+#import the GIS functions of the meta data scripts
+main_repo_folder = (Path(__file__).resolve().parent.parent)
+sys.path.append(os.path.join(str(main_repo_folder), 'meta_data_scripts'))
+import gis_functions as gis
 
 
 data_import_file = "/home/thoverga/Desktop/vlinderdata.csv"
@@ -44,6 +51,7 @@ ESM_maps = ["N30E38", "N32E36", "N32E38", "N30E40", "N32E40"]
 bufferlist = [150, 250]
 aggregate_simplyfied = True
 only_simplyfied_landuse = False
+stack_layers = True #stack the class layers of each ESM map in one multi-band raster (created once, next to the layers)
 
 #%% interactive settings
 
@@ -57,6 +65,7 @@ print("..........parameters......... ")
 print("bufferlist (in meter): ", bufferlist)
 print("calculate the aggregated classes (water, green, pervious): ",aggregate_simplyfied)
 print ("return ONLY the aggregated classes? ", only_simplyfied_landuse)
+print ("stack the class layers of the ESM maps? ", stack_layers)
 
 
 _settings_var = input("Are these settings ok?  (y/n)")
@@ -120,8 +129,34 @@ if not stationdf['station'].is_unique:
 
 #%%
 
+def stack_ESM_map(ESM_folder, mapname, layer_files):
+    """ Stack the class layers of an ESM map into one multi-band raster, so all the layers around a station are read
+        with one windowed read. The stacked raster is written once in the folder of the map and rebuilt when a layer
+        is newer.
 
-def ESM_landuse(stationdf, bufferlist, ESM_folder, ESM_maps, aggregate_simplyfied = False, only_simplyfied_landuse = False):
+    Keyword arguments: \n
+        ESM_folder -- string
+                    a string that is the PATH TO THE FOLDER that contains the ESM maps \n
+        mapname -- string
+                    the name of the ESM map (ex. 'N30E38') \n
+        layer_files -- dict
+                    the layer number (string) --> path of the class layer, the bands are stacked in this order. \n
+    Return
+        the path of the stacked raster
+    """
+    
+    stacked_file = os.path.join(ESM_folder, mapname, '200km_10m_' + mapname + '_classes_stacked.tif')
+    if os.path.isfile(stacked_file):
+        if os.path.getmtime(stacked_file) >= max(os.path.getmtime(layer_file) for layer_file in layer_files.values()):
+            return stacked_file
+    print('Stacking the class layers of ESM map ', mapname, ' (only once) ...')
+    gis.stack_raster_bands(list(layer_files.values()), stacked_file, band_names=['class' + key for key in layer_files],
+                           resampling='average')
+    return stacked_file
+
+
+def ESM_landuse(stationdf, bufferlist, ESM_folder, ESM_maps, aggregate_simplyfied = False, only_simplyfied_landuse = False,
+                stack_layers = True):
     """ Get landcover fractions for locations and a buffer radius based on the ESM maps.
 
     Keyword arguments: \n
@@ -139,6 +174,9 @@ def ESM_landuse(stationdf, bufferlist, ESM_folder, ESM_maps, aggregate_simplyfie
                     if True, the aggregated landuseclasses 'green' and 'pervious' will be calculated. \n
         only_simplyfied_landuse -- Bool(default False)
                     if True, only the aggregated classes will be returned. \n
+        stack_layers -- Bool(default True)
+                    if True, the class layers of each map are stacked in one multi-band raster (see stack_ESM_map) and
+                    read at once for each station. \n
     Return
         stationdf with added columns for the landuseclasses as fractions
     """
@@ -237,64 +275,80 @@ def ESM_landuse(stationdf, bufferlist, ESM_folder, ESM_maps, aggregate_simplyfie
             tif_file_dict[key] =  esm_loc
         mapdict[mapname] = tif_file_dict
     
+    #stack the layers of each map in one raster
+    stackdict = {}
+    if stack_layers:
+        for mapname in ESM_maps:
+            stackdict[mapname] = stack_ESM_map(ESM_folder, mapname, mapdict[mapname])
     
-    def get_landuse(geo_df, buffer_radius, layerlist, layerdict, mapdict, aggregate_simplyfied=False, only_simplyfied_landuse=False):
-        #Create buffer, iterate over the layers and for each station the landuse is calculated. 
-        geo_df['buffer'] = geo_df['geometry'].buffer(buffer_radius, resolution=30)
-        for layer in layerlist:
-            columnname = layerdict[str(layer)] #landuse class for this layer
-            geo_df[columnname] = 0 #initiate landuse column
-            for index, row in geo_df.iterrows():
-                landuse_count = 0. #variable for count overloading in case of raster boundary overlap.
-                for mapdir in row['map_to_use']:
-                    layer_path = mapdict[mapdir][str(layer)] #directory of map
-                    zs = rasterstats.zonal_stats(row['buffer'], layer_path, band_num=1, 
-                                     all_touched= True, #if true, inclueds the cells at the boundaries of the polygon
-                                     categorical = False,
-                                     raster_out= True,
-                                     prefix=str(layer)+'_')
-                    
-                    if zs[0][str(layer) + '_mean'] is None:
+    
+    def get_landuse(geo_df, bufferlist, layerlist, layerdict, mapdict, stackdict, aggregate_simplyfied=False, only_simplyfied_landuse=False):
+        #For each station the landuse is calculated for all buffer radii. The window of the largest buffer is read once 
+        #per station (all the layers of the stacked map at once, or once per layer), the smaller buffers are taken from 
+        #the same window.
+        max_radius = max(bufferlist)
+        landuse_counts = np.zeros((geo_df.shape[0], len(bufferlist), len(layerlist))) #station x buffer x layer
+        if bool(stackdict):
+            for i, (index, row) in enumerate(geo_df.iterrows()):
+                x, y = row['geometry'].x, row['geometry'].y
+                for mapdir in row['map_to_use']: #add the counts of all maps to handle buffers that extends two rasters.
+                    bands = [list(mapdict[mapdir]).index(str(layer)) + 1 for layer in layerlist] #band order of the stack
+                    local_window = gis.read_disk_window(x, y, max_radius, stackdict[mapdir], band=bands)
+                    if local_window is None:
                         continue
-                    
-                    landuse_count += zs[0][str(layer) + '_mini_raster_array'].data.sum() #add to variable to handle buffers that extends two rasters.
-                geo_df.loc[index, columnname] = landuse_count #write to landuse column
-                
-        #normalize landuse as fractions
-        landusetypelist = list(layerdict.values())
-        for index, row in geo_df.iterrows():
-            landusesum = row[landusetypelist].sum()
-            for landusetype in landusetypelist:
-                geo_df.loc[index, landusetype] = (row[landusetype] / landusesum)
-                
-                
-                
-        #aggregate landuse to simplyfied classes
-        if aggregate_simplyfied:
-            pervious_list = ['railways', 'nbu_area-streets', 'bu-area-streets', 'bu_buildings']
-            green_list = ['nbu_area-open_space', 'nbu_area-green_ndvi', 'nbu_area-street_green_ndvi', 'bu_area-green_ndvi', 'bu_area-green_ua', 'bu_area-street_green_ndvi']
+                    for j, buffer_radius in enumerate(bufferlist):
+                        landuse_counts[i, j, :] += gis.disk_band_sums(local_window, x, y, buffer_radius)
+        else:
+            for k, layer in enumerate(layerlist):
+                for i, (index, row) in enumerate(geo_df.iterrows()):
+                    x, y = row['geometry'].x, row['geometry'].y
+                    for mapdir in row['map_to_use']:
+                        layer_path = mapdict[mapdir][str(layer)] #directory of map
+                        local_window = gis.read_disk_window(x, y, max_radius, layer_path)
+                        if local_window is None:
+                            continue
+                        for j, buffer_radius in enumerate(bufferlist):
+                            landuse_counts[i, j, k] += gis.disk_values(local_window, x, y, buffer_radius).sum()
+        
+        landuse_per_buffer = {}
+        for j, buffer_radius in enumerate(bufferlist):
+            buffer_df = geo_df.copy()
+            landusetypelist = [layerdict[str(layer)] for layer in layerlist]
             
-            geo_df['pervious'] = geo_df[pervious_list].sum(axis=1) + (0.5 * geo_df['bu_area-open_space'])
-            geo_df['green'] = geo_df[green_list].sum(axis=1) + (0.5 * geo_df['bu_area-open_space'])
-            if only_simplyfied_landuse:
+            #normalize landuse as fractions
+            fractions = landuse_counts[:, j, :] / landuse_counts[:, j, :].sum(axis=1, keepdims=True)
+            for k, landusetype in enumerate(landusetypelist):
+                buffer_df[landusetype] = fractions[:, k]
                 
-                landusetypelist.remove('water')
-                geo_df = geo_df.drop(landusetypelist, axis=1) #drop specific landuseclasses
-                landusetypelist = ['water', 'green', 'pervious']
-            else:
-                landusetypelist.extend(['green', 'pervious'])
-        return geo_df.drop(['buffer', 'map_to_use'], axis=1), landusetypelist
+            #aggregate landuse to simplyfied classes
+            if aggregate_simplyfied:
+                pervious_list = ['railways', 'nbu_area-streets', 'bu-area-streets', 'bu_buildings']
+                green_list = ['nbu_area-open_space', 'nbu_area-green_ndvi', 'nbu_area-street_green_ndvi', 'bu_area-green_ndvi', 'bu_area-green_ua', 'bu_area-street_green_ndvi']
+                
+                buffer_df['pervious'] = buffer_df[pervious_list].sum(axis=1) + (0.5 * buffer_df['bu_area-open_space'])
+                buffer_df['green'] = buffer_df[green_list].sum(axis=1) + (0.5 * buffer_df['bu_area-open_space'])
+                if only_simplyfied_landuse:
+                    
+                    landusetypelist.remove('water')
+                    buffer_df = buffer_df.drop(landusetypelist, axis=1) #drop specific landuseclasses
+                    landusetypelist = ['water', 'green', 'pervious']
+                else:
+                    landusetypelist.extend(['green', 'pervious'])
+            landuse_per_buffer[buffer_radius] = (buffer_df.drop(['map_to_use'], axis=1), landusetypelist)
+        return landuse_per_buffer
      
 
 
+    landuse_per_buffer = get_landuse(station_geo, bufferlist = bufferlist,
+                       layerlist = [0,1,2,10,15,20,25,30,35,40,41,45,50],
+                       layerdict=classes,
+                       mapdict = mapdict,
+                       stackdict = stackdict,
+                       aggregate_simplyfied = aggregate_simplyfied, #aggregate to water, impervious and pervious
+                       only_simplyfied_landuse=only_simplyfied_landuse) 
     returndf = pd.DataFrame()
     for buffer_radius in bufferlist:           
-        buffer_station_geo, landusecolumns = get_landuse(station_geo, buffer_radius = buffer_radius,
-                           layerlist = [0,1,2,10,15,20,25,30,35,40,41,45,50],
-                           layerdict=classes,
-                           mapdict = mapdict,
-                           aggregate_simplyfied = aggregate_simplyfied, #aggregate to water, impervious and pervious
-                           only_simplyfied_landuse=only_simplyfied_landuse) 
+        buffer_station_geo, landusecolumns = landuse_per_buffer[buffer_radius]
         buffer_station_geo['buffer'] = buffer_radius
         returndf = returndf.append(buffer_station_geo)
     
@@ -318,7 +372,8 @@ geo_data = ESM_landuse(stationdf,
                    ESM_folder = ESM_folder,
                    ESM_maps = ESM_maps,
                    aggregate_simplyfied = aggregate_simplyfied,
-                   only_simplyfied_landuse = only_simplyfied_landuse)
+                   only_simplyfied_landuse = only_simplyfied_landuse,
+                   stack_layers = stack_layers)
 
 #%%writing
 
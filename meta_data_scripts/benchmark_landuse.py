@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Benchmark of the landuse output of calculate_landuse() (from the class counts to the dataframe), for 70 up to 10000
+locations:
+    1) row by row: a row is built and appended for each station and buffer radius (the old implementation, with
+       pd.concat since DataFrame.append is removed from pandas)
+    2) columnar: get_all_meta_data.landuse_dataframe(), the columns are filled at once from the count arrays
+
+The class counts are random (no maps needed), half of the locations use a second map.
+
+Created on Sun Oct 18 2026
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+#%import path file
+file_folder = (Path(__file__).resolve().parent)
+sys.path.append(str(file_folder))
+import get_all_meta_data
+
+
+#%% settings
+
+location_numbers = [70, 1000, 10000]
+max_row_by_row = 1000 #the row by row output is quadratic, skip it for more locations
+bufferlist = [50, 100, 150, 250]
+
+raster_dict = {
+    'map_A': {'mapper': {c: 'A_class_' + str(c) for c in range(1, 15)},
+              'agg': {'green': ['A_class_' + str(c) for c in range(6, 15)],
+                      'impervious': ['A_class_' + str(c) for c in range(1, 5)]}},
+    'map_B': {'mapper': {c: 'B_class_' + str(c) for c in range(15)},
+              'agg': {'green': ['B_class_' + str(c) for c in range(2, 12)],
+                      'impervious': ['B_class_1']}}
+    }
+
+
+#%% benchmark
+
+def row_by_row_landuse_dataframe(stationdf, bufferlist, raster_dict, counts_per_map, used_map):
+    #the old output of calculate_landuse (with pd.concat instead of append)
+    total_geodf = pd.DataFrame()
+    for i, (_idx, row) in enumerate(stationdf.iterrows()):
+        for j, buffer_radius in enumerate(bufferlist):
+            append_row = row.copy()
+            append_row['buffer_radius'] = buffer_radius
+            raster = used_map[i, j]
+            append_row['used_map'] = raster
+            counts = counts_per_map[raster][i, j, :]
+            freq_table = pd.Series(data=counts / counts.sum(), index=list(raster_dict[raster]['mapper'].values()), name='fraction')
+            append_row = pd.concat([append_row, freq_table])
+            for agg_class in raster_dict[raster]['agg']:
+                append_row[agg_class] = append_row[raster_dict[raster]['agg'][agg_class]].sum()
+            total_geodf = pd.concat([total_geodf, append_row.to_frame().T], ignore_index=True)
+    return total_geodf
+
+
+def synthetic_landuse(n_locations):
+    rng = np.random.default_rng(0)
+    stationdf = pd.DataFrame({'station': ['station_' + str(i) for i in range(n_locations)],
+                              'lat': rng.uniform(50.7, 51.3, n_locations),
+                              'lon': rng.uniform(3.0, 5.5, n_locations)})
+    used_map = np.where(rng.random((n_locations, len(bufferlist))) < 0.5, 'map_A', 'map_B').astype(object)
+    used_map[0, :] = 'map_A'
+    counts_per_map = {raster: rng.integers(0, 1000, (n_locations, len(bufferlist), len(raster_dict[raster]['mapper']))).astype(float)
+                      for raster in raster_dict}
+    return stationdf, counts_per_map, used_map
+
+
+if __name__ == "__main__":
+    for n_locations in location_numbers:
+        stationdf, counts_per_map, used_map = synthetic_landuse(n_locations)
+
+        start = time.perf_counter()
+        columnar = get_all_meta_data.landuse_dataframe(stationdf, bufferlist, raster_dict, counts_per_map, used_map)
+        columnar_seconds = time.perf_counter() - start
+        print(n_locations, ' locations, columnar: ', round(columnar_seconds, 4), 's')
+
+        if n_locations <= max_row_by_row:
+            start = time.perf_counter()
+            row_by_row = row_by_row_landuse_dataframe(stationdf, bufferlist, raster_dict, counts_per_map, used_map)
+            row_by_row_seconds = time.perf_counter() - start
+            pd.testing.assert_frame_equal(row_by_row.infer_objects(), columnar, check_dtype=False)
+            print(n_locations, ' locations, row by row: ', round(row_by_row_seconds, 4), 's (equal output)')
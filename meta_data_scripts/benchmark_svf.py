@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Micro-benchmark of the SVF engines (numpy vs numba) of sky_view_factor.py:
+    1) the SVF of many locations (one local DEM array per location), for a 10m and a 1m DEM
+    2) the SVF of all the cells of a DEM tile (as in create_svf_map())
+
+The first numba call (JIT compilation) is not timed.
+
+Created on Sun Oct 18 2026
+"""
+
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+
+#%import path file
+file_folder = (Path(__file__).resolve().parent)
+sys.path.append(str(file_folder))
+import sky_view_factor
+
+
+#%% settings
+
+local_radius = 200 #meter
+loc_buffer = 20 #meter
+num_directions = 8
+num_locations = 200
+tile_size = 1024
+
+
+#%% benchmark
+
+def timeit(function, repeat=3):
+    #best time of repeat runs (in seconds)
+    times = []
+    for _i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def locations_benchmark(resolution, engine):
+    rng = np.random.default_rng(0)
+    size = 2 * int(local_radius / resolution) + 1
+    local_arrays = [(rng.random((size, size)) * 25.).astype('float32') for _i in range(num_locations)]
+    raster_info = {'resolution': resolution}
+
+    def run():
+        for local_array in local_arrays:
+            sky_view_factor.get_SVF_from_local_DEM(local_array, local_radius, raster_info,
+                                                   loc_buffer=loc_buffer, num_directions=num_directions)
+    sky_view_factor.set_svf_engine(engine)
+    run() #warm up (and JIT compilation)
+    return timeit(run)
+
+
+def tile_benchmark(resolution, engine):
+    rng = np.random.default_rng(0)
+    halo = sky_view_factor.svf_map_halo(local_radius, resolution, loc_buffer, num_directions)
+    block = rng.random((tile_size + 2 * halo, tile_size + 2 * halo)) * 25.
+
+    def run():
+        sky_view_factor.grid_svf(block, halo, local_radius, resolution, loc_buffer=loc_buffer, num_directions=num_directions)
+    sky_view_factor.set_svf_engine(engine)
+    #warm up (and JIT compilation, for a contiguous block as in run())
+    sky_view_factor.grid_svf(np.ascontiguousarray(block[:2 * halo + 8, :2 * halo + 8]), halo, local_radius, resolution,
+                             loc_buffer=loc_buffer, num_directions=num_directions)
+    return timeit(run, repeat=1)
+
+
+if __name__ == "__main__":
+    engines = ['numpy']
+    if sky_view_factor.numba is not None:
+        engines.append('numba')
+    else:
+        print('Numba is not installed, only the numpy engine is benchmarked.')
+
+    for resolution in [10., 1.]:
+        for engine in engines:
+            seconds = locations_benchmark(resolution, engine)
+            print(num_locations, ' locations, resolution ', resolution, 'm, engine ', engine, ': ',
+                  round(seconds, 4), 's (', round(1e3 * seconds / num_locations, 4), ' ms per location)')
+
+    for engine in engines:
+        seconds = tile_benchmark(10., engine)
+        print('tile of ', tile_size, 'x', tile_size, ' cells, resolution 10m, engine ', engine, ': ', round(seconds, 3), 's')
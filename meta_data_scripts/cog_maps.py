@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Maintenance script for the storage layout of the maps. The meta data is computed with windowed reads around the stations,
+so a striped (not internally tiled) raster decodes complete rows of the map for each window, which is slow for the
+pan-European maps (S2GLC, LCZ).
+
+This script inspects all the rasters used by get_all_meta_data.py (DEM, BBK, S2GLC, LCZ) and geo_maps_config.py, and
+prints their layout (tiled or striped, block shape, compression and overviews). With --convert the rasters that would
+benefit are rewritten as cloud optimized GeoTIFFs (internally tiled, compressed and with overviews, see
+gis_functions.write_cog()). The files are replaced in place, so all the paths stay valid. The layout of each raster is
+recorded in the tile catalog.
+
+Created on Sun Oct 18 2026
+"""
+
+import sys
+import os
+import argparse
+from pathlib import Path
+
+
+#%import path file
+file_folder = (Path(__file__).resolve().parent)
+sys.path.append(str(file_folder))
+import gis_functions as gis
+import geo_maps_config
+import get_all_meta_data
+
+
+#%% settings
+
+cog_settings = {
+    'blocksize': 512, #internal tiles of blocksize x blocksize cells
+    'compress': 'deflate'
+    }
+
+
+#%% functions
+
+def referenced_rasters(config=None):
+    """ This function returns the rasters that are used by get_all_meta_data.py (with the config) and geo_maps_config.py.
+
+        Return: a dictionary raster file --> resampling method for the overviews ('average' for the DEM, 'nearest' for
+        the categorical maps). Files that do not exist on this device are skipped. """
+
+    if config is None:
+        config = get_all_meta_data.default_config()
+    raster_dict = config['raster_dict']
+    if raster_dict is None:
+        raster_dict = get_all_meta_data.get_raster_dict()
+
+    rasters = {}
+    if os.path.isdir(config['DEM_folder']):
+        for DEM_file in get_all_meta_data.DEM_files(config['DEM_folder']):
+            rasters[DEM_file] = 'average'
+
+    categorical_files = [config['lcz_dict']['file'], geo_maps_config.s2glc_settings['file'], geo_maps_config.lcz_settings['file']]
+    for raster in raster_dict.values():
+        raster_files = raster['raster_files']
+        categorical_files.extend([raster_files] if isinstance(raster_files, str) else raster_files)
+
+    for raster_file in categorical_files:
+        if not os.path.isfile(raster_file):
+            print('The map ', raster_file, ' is not found on this device, it is skipped.')
+            continue
+        if not os.path.abspath(raster_file) in [os.path.abspath(f) for f in rasters]:
+            rasters[raster_file] = 'nearest'
+    return rasters
+
+
+def raster_report(raster_file, blocksize=cog_settings['blocksize']):
+    """ This function prints the layout of a raster (from the tile catalog) and returns True if it should be rewritten
+        as a cloud optimized GeoTIFF (see gis_functions.needs_cog()). """
+
+    layout = gis.get_tile_catalog(raster_file)['info'][0]['layout']
+    rewrite = gis.needs_cog(layout, blocksize)
+    print(raster_file)
+    print('    size: ', layout['width'], 'x', layout['height'], ', tiled: ', layout['tiled'], ', block shape: ', layout['block_shape'],
+          ', compression: ', layout['compress'], ', overviews: ', layout['overviews'], ', rewrite as COG: ', rewrite)
+    return rewrite
+
+
+def convert_to_cog(raster_file, resampling='nearest', blocksize=cog_settings['blocksize'], compress=cog_settings['compress']):
+    """ This function rewrites a raster (in place) as a cloud optimized GeoTIFF and records the new layout in the tile
+        catalog. The original file is replaced when the new file is completely written (see gis_functions.write_cog()), 
+        the intermediate files are written in the temporary folder of the system. """
+
+    gis.close_raster_pool() #do not keep the replaced file open
+    gis.write_cog(raster_file, raster_file, blocksize=blocksize, compress=compress, resampling=resampling)
+    gis.clear_tile_catalogs()
+    gis.get_tile_catalog(raster_file) #the new layout in the tile catalog
+
+
+def cog_all_rasters(config=None, convert=False, blocksize=cog_settings['blocksize'], compress=cog_settings['compress']):
+    """ This function inspects all the used rasters (see referenced_rasters()) and, if convert is True, rewrites the
+        rasters that would benefit as cloud optimized GeoTIFFs.
+
+        Return: list of the rasters that are (or should be) rewritten. """
+
+    if config is None:
+        config = get_all_meta_data.default_config()
+    gis.set_tile_catalog_file(config['tile_catalog_file'])
+
+    to_rewrite = []
+    for raster_file, resampling in referenced_rasters(config).items():
+        if raster_report(raster_file, blocksize):
+            to_rewrite.append(raster_file)
+            if convert:
+                print('    rewriting as COG (overviews: ', resampling, ') ...')
+                convert_to_cog(raster_file, resampling=resampling, blocksize=blocksize, compress=compress)
+                raster_report(raster_file, blocksize)
+
+    if not convert and to_rewrite:
+        print(len(to_rewrite), ' rasters can be rewritten as COG, run with --convert to rewrite them.')
+    gis.close_raster_pool()
+    return to_rewrite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect the layout of the maps and rewrite them as cloud optimized GeoTIFFs.')
+    parser.add_argument('--convert', action='store_true', help='rewrite the striped, uncompressed or overview-less rasters (in place)')
+    parser.add_argument('--blocksize', type=int, default=cog_settings['blocksize'], help='size of the internal tiles')
+    parser.add_argument('--compress', default=cog_settings['compress'], help='compression of the rewritten rasters')
+    args = parser.parse_args(argv)
+
+    cog_all_rasters(convert=args.convert, blocksize=args.blocksize, compress=args.compress)
+
+
+if __name__ == "__main__":
+    main()
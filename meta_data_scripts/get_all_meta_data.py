@@ -11,6 +11,19 @@ these columns can be specified when running the script.
 By default the file 'coordinates_file.csv' in the folder of this script is used as input, and the output will appear in this folder also. 
 The radii for the landcover buffers can changed in the settings cell. 
 
+The meta data can also be computed from other scripts (or a long running service), without reading or writing files:
+
+    import get_all_meta_data
+    config = get_all_meta_data.default_config()
+    meta_df = get_all_meta_data.compute_metadata(stations_df, config)
+
+Large coordinate files (sampling grids, citizen science locations, ...) can be computed in chunks with --chunk-size (or 
+compute_metadata_file()): the output is written chunk by chunk (csv, or parquet if the output name ends with .parquet)
+and a killed run continues from the last written chunk (checkpoint file).
+
+Nothing is computed when this module is imported, and the heavy modules (geopandas, rasterio, ...) are only
+loaded at the first computation.
+
 
 SPECIFIC TO USER: make shure the lu_lc_folder is on your device AND the path to this folder is in the path_handler. 
 
@@ -30,20 +43,21 @@ Created on Wed Sep 15 10:56:27 2021
 
 import sys 
 import os
+import json
+import shutil
+import tempfile
+import subprocess
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import math
 import numpy as np
-import geopandas as gpd
-import rasterio
-from shapely.geometry import box
-import rasterstats
 from pathlib import Path
 
 
-#%import path file
+#%import path file (the gis modules are imported in the functions)
 file_folder = (Path(__file__).resolve().parent)
 sys.path.append(str(file_folder))
-import gis_functions as gis
 
 
 main_repo_folder = (Path(__file__).resolve().parent.parent)
@@ -54,7 +68,6 @@ print('Path handling module loaded')
 #%settings
 
 location_file = os.path.join(path_handler.folders['meta_data_folder'], 'coordinates_file.csv')
-print('Meta data will be calculated for file ', location_file)
 
 output_file = os.path.join(path_handler.folders['meta_data_folder'], 'coordinates_file_with_meta_data.csv')
 
@@ -64,249 +77,254 @@ buffer_list = [50,100,150,250]
 
 #----------------------------------------------SVF------------------------------------------------------------
 
-local_radius_meter= 200 #the max distance of the surroundings to what the SVF is calculated (in meter)
+local_radius_meter= 200 #the max distance of the surroundings to what the SVF is calculated (in meter), a list (i.e. [100, 200, 500]) gives one SVF column per radius
 loc_buffer_meter=20 #estimate of the precision IN METER of the station and the buffer radius that is excluded from the svf calculation. 
 num_directions=8 #the number of directions to be considerd in the calculation of the SVF (i.e. 4 is only looking in the wind directions)
+use_svf_maps = False #if True, the SVF is sampled from the precomputed SVF maps of the DEM (see sky_view_factor.py), with the same settings
 
-#% Check data format
-
-df = pd.read_csv(location_file, sep=',')
-columnlist = list(df.columns)
-if not 'station' in df.columns:
-    print('The column: station, not found in the input file. These columnnames are found instead: ', columnlist)
-    station_identifier = input('Type the name of the unique station identifier: ')
-else:
-    station_identifier = 'station'
+#----------------------------------------------Raster IO-----------------------------------------------------
+raster_pool_size = 32 #max number of raster files (DEM/BBK tiles, ...) that are kept open at the same time
 
+tile_catalog_file = os.path.join(path_handler.folders['meta_data_folder'], 'raster_tile_catalog.json') #bounds, crs, ... of all used raster tiles
+temporary_raster_suffixes = ('.tmp.tif', '.cog.tif', '.stack.tif') #left over by interrupted COG conversions (older versions), never used as map tiles
 
-if not df[station_identifier].is_unique:
-    print('the column ', station_identifier, ' is not unique!! Stop script.')
-    sys.exit()
-
-if not 'lat' in df.columns:
-    print('the column: lat, not found in the input file. These columnnames are found instead: ', columnlist)
-    lat_identifier = input('Type the name of the latitude identifier: ')
-else:
-    lat_identifier = 'lat'
-    
-if not 'lon' in df.columns:
-    print('the column: lon, not found in the input file. These columnnames are found instead: ', columnlist)
-    lon_identifier = input('Type the name of the lon identifier: ')
-else:
-    lon_identifier = 'lon'
-    
-
+#----------------------------------------------Parallel engine-----------------------------------------------
+n_processes = 1 #number of worker processes (None is the number of cpus), the stations are partitioned by spatial tile
+partition_size = 10000 #size (in meter, EPSG:3035) of the spatial tiles to partition the stations
 
+#----------------------------------------------Result cache--------------------------------------------------
+metadata_cache_file = os.path.join(path_handler.folders['meta_data_folder'], 'meta_data_cache.sqlite') #computed meta data of previous runs (only new or moved stations and changed maps are computed), None to compute everything
+zonal_cache_file = os.path.join(path_handler.folders['meta_data_folder'], 'zonal_stats_cache.sqlite') #results of the buffer reads of gis_functions.ULTIMATE_read_from_rasterfile (the DEM arrays for the SVF, class counts in other scripts), None to disable
+zonal_cache_max_mb = 1024 #max size of the zonal_cache_file, the least recently used reads are removed
 
+#----------------------------------------------Streaming-----------------------------------------------------
+chunk_size = None #number of locations that are read, computed and written at once (for large coordinate files), None reads the whole file at once
 
 
 
 
 #%% Find height
-def find_height(stationdf, lat_identifier, lon_identifier, DEM_folder):
-    #create geo df
-    station_geo = gis.df_to_geodf(stationdf, "EPSG:3035", lat_identifier, lon_identifier)
+def DEM_files(DEM_folder):
+    """ This function returns the DEM tiles (.tif files) in the DEM folder. The SVF maps (see 
+        sky_view_factor.create_svf_map()) and temporary files in the DEM folder are skipped. """
+    
+    return sorted([os.path.join(DEM_folder, f) for f in os.listdir(DEM_folder) if os.path.isfile(os.path.join(DEM_folder, f))
+                   and f.lower().endswith('.tif') and not '_svf_' in f and not f.lower().endswith(temporary_raster_suffixes)])
 
 
+def find_height(stationdf, lat_identifier, lon_identifier, DEM_folder):
+    import gis_functions as gis
+    stationdf = stationdf.copy()
+    
     #make list of all DEM files in the DEM-folder
-    DEM_map_files = [os.path.join(DEM_folder,f) for f in os.listdir(DEM_folder) if os.path.isfile(os.path.join(DEM_folder, f))]
+    DEM_map_files = DEM_files(DEM_folder)
     
-    #calculate height
-    station_geo['height'] = station_geo['geometry'].apply(gis.ULTIMATE_read_from_rasterfile, raster_file_list = DEM_map_files)
-   
-    #remove geometry column
-    return station_geo.drop(columns=['geometry'])
-
-
+    #calculate height (all stations at once)
+    stationdf['height'] = gis.sample_points(lats = stationdf[lat_identifier],
+                                            lons = stationdf[lon_identifier],
+                                            raster_file_list = DEM_map_files)
+    if stationdf['height'].isnull().any():
+        print('No height found on the DEM maps for these locations: ')
+        print(stationdf.loc[stationdf['height'].isnull(), [lat_identifier, lon_identifier]])
+    
+    return stationdf
 
 
 
-df = find_height(df, lat_identifier, lon_identifier,
-                 os.path.join(path_handler.lu_lc_folder, 'DEM/'))
 
 #%% SVF
 
 
-def find_SVF(stationdf, station_identifier, lat_identifier, lon_identifier, DEM_folder, local_radius=200, loc_buffer=2, num_directions=8):    
+def find_SVF(stationdf, station_identifier, lat_identifier, lon_identifier, DEM_folder, local_radius=200, loc_buffer=2, num_directions=8, use_svf_maps=False):    
     """ This function makes an estimate on the SVF for the given locations. This estimate is done by using the DEM. 
+        If local_radius is a list, the SVF is estimated for each radius (one scan of the DEM for the largest radius),
+        the columns are svf_<radius>m. Else the column is svf.
+        If use_svf_maps is True, the SVF is sampled from the SVF maps of the DEM (see sky_view_factor.create_svf_map()).
         IMPORTANT: the resolution of the DEM model should be in meter!! """
     
-
-    print("Reading the DEM map and get SVF of stations ...")
-    #create geo df
-    station_geo = gis.df_to_geodf(stationdf, "EPSG:3035", lat_identifier, lon_identifier)
-    
+    import gis_functions as gis
+    import sky_view_factor
     
-    #point to square geometry
-    def point_to_square(point, dist_to_bounds_meter):
-        return box((point.x - dist_to_bounds_meter),
-                   (point.y - dist_to_bounds_meter),
-                   (point.x + dist_to_bounds_meter),
-                   (point.y + dist_to_bounds_meter))
-    
-    station_geo['polygon'] = station_geo['geometry'].apply(point_to_square, dist_to_bounds_meter = local_radius)
+    if isinstance(local_radius, (list, tuple)):
+        radii = list(local_radius)
+        svf_columns = ['svf_' + str(int(radius)) + 'm' for radius in radii]
+    else:
+        radii = [local_radius]
+        svf_columns = ['svf']
     
+    #make list of all DEM files in the DEM-folder
+    DEM_map_files = DEM_files(DEM_folder)
     
+    if use_svf_maps:
+        print("Sampling the SVF maps of the DEM at the stations ...")
+        stationdf = stationdf.copy()
+        for radius, column in zip(radii, svf_columns):
+            stationdf[column] = sky_view_factor.sample_svf_maps(lats = stationdf[lat_identifier],
+                                                                lons = stationdf[lon_identifier],
+                                                                dem_file_list = DEM_map_files,
+                                                                local_radius = radius)
+        return stationdf
 
-    
-    def get_SVF_from_local_DEM(local_array, local_radius, raster_info, loc_buffer=2, num_directions=8):
-        alpha = 360.0/(num_directions)
-        array_resolution = raster_info["resolution"]
-        
-        ref_index = int(local_array.shape[0]/2)
-        
-        buffer_index = math.ceil(loc_buffer/array_resolution)
-        
-        
-        # find lowes point in buffer of radius 2 (map units = meter)
-        ref_height = local_array[ref_index - buffer_index: ref_index + buffer_index,
-                                 ref_index - buffer_index: ref_index + buffer_index].min()
-        
-        
-        svf_df = pd.DataFrame()
-        svf_df['direction'] = list(range(num_directions))
-        svf_df['alpha'] = [x*alpha for x in svf_df['direction']]
-        
-        def max_phi_for_direction(row, local_array, ref_index, buffer_index, resolution):
-            dir_alpha = row['alpha']
-            phi_list = []
-            for i in range(math.floor(local_array.shape[0]/2)): #scan along a line
-                col_idx = round(i * math.sin(dir_alpha * (math.pi / 180.))) + ref_index
-                row_idx = ref_index - round(i * math.cos(dir_alpha * (math.pi / 180.)))
-                
-                #not to close to ref to avoid effect of the trotoir.
-                if ((ref_index - buffer_index <= col_idx) & (col_idx <= ref_index + buffer_index)) & \
-                    ((ref_index - buffer_index <= row_idx) & (row_idx <= ref_index + buffer_index)):
-                    continue
-                
-                
-                center_index = float(local_array.shape[0]/2.0) #can be different than ref_index if array shape is uneven
-                dist_gridspace = math.sqrt((abs(col_idx - center_index))**2 + (abs(row_idx - center_index))**2)
-                dist = float(dist_gridspace) * float(resolution)
-                
-                relative_height = local_array[row_idx, col_idx] - ref_height
-                
-                if relative_height < 0 : 
-                    relative_height = 0.
-                
-                
-                phi = math.atan(relative_height/dist) * (180. / math.pi)
-                phi_list.append(phi)     
-            return max(phi_list)
-        
-        svf_df['phi_max'] = svf_df.apply(max_phi_for_direction, axis=1,
-                                         local_array=local_array,
-                                         ref_index = ref_index,
-                                         buffer_index = buffer_index,
-                                         resolution = array_resolution)
-        
-        svf = 1 - ((svf_df['phi_max'].sum())/(90 * 360))
-        return svf
-    
-    
+    print("Reading the DEM map and get SVF of stations ...")
+    #create geo df
+    station_geo = gis.df_to_geodf(stationdf, "EPSG:3035", lat_identifier, lon_identifier)
     
     
-    #make list of all DEM files in the DEM-folder
-    DEM_map_files = [os.path.join(DEM_folder,f) for f in os.listdir(DEM_folder) if os.path.isfile(os.path.join(DEM_folder, f))]
+    #square geometries of all stations at once, the DEM is read once for the largest radius
+    squares = gis.buffer_geometries(lats = stationdf[lat_identifier].values,
+                                    lons = stationdf[lon_identifier].values,
+                                    radii = radii,
+                                    crs = "EPSG:3035",
+                                    shape = 'square')
+    station_geo['polygon'] = squares[:, radii.index(max(radii))]
     
-    station_geo['svf'] = np.nan
+    for column in svf_columns:
+        station_geo[column] = np.nan
     
-    for _idx, row in station_geo.iterrows():
+    for i, (_idx, row) in enumerate(station_geo.iterrows()):
         geometry = row['polygon']
         local_array, raster_info = gis.ULTIMATE_read_from_rasterfile(geometry, DEM_map_files, return_map_info=True)
-        svf = get_SVF_from_local_DEM(local_array,
-                                     local_radius,
-                                     raster_info,
-                                     loc_buffer=loc_buffer,
-                                     num_directions=num_directions)
+        if len(radii) == 1:
+            svf = [sky_view_factor.get_SVF_from_local_DEM(local_array,
+                                                          radii[0],
+                                                          raster_info,
+                                                          loc_buffer=loc_buffer,
+                                                          num_directions=num_directions)]
+        else:
+            #windows in the local DEM of the local DEMs that a run for each radius would read (in the grid of the first tile)
+            with gis.open_raster(gis.find_tiles(geometry, DEM_map_files)[0][0]) as src:
+                grid = src.transform
+            row_off, _row_stop, col_off, _col_stop = gis.bounds_cells(geometry.bounds, grid)
+            array_windows = []
+            for square in squares[i, :]:
+                row_start, row_stop, col_start, col_stop = gis.bounds_cells(square.bounds, grid)
+                array_windows.append((row_start - row_off, row_stop - row_off, col_start - col_off, col_stop - col_off))
+            svf = sky_view_factor.get_SVF_per_radius(local_array,
+                                                     radii,
+                                                     raster_info,
+                                                     loc_buffer=loc_buffer,
+                                                     num_directions=num_directions,
+                                                     array_windows=array_windows)
         
-        station_geo.loc[station_geo[station_identifier] == row[station_identifier], 'svf'] = svf
+        station_geo.loc[station_geo[station_identifier] == row[station_identifier], svf_columns] = svf
     
     return station_geo.drop(columns=['geometry', 'polygon'])
 
 
-df = find_SVF(stationdf = df,
-                   station_identifier = station_identifier,
-                   lat_identifier = lat_identifier,
-                   lon_identifier = lon_identifier,
-                   DEM_folder = os.path.join(path_handler.lu_lc_folder, 'DEM/'),
-                   local_radius=local_radius_meter,
-                   loc_buffer=loc_buffer_meter,
-                   num_directions=num_directions)
-
-
-
-#%%
+#%% Landuse
 
 #raster info
 
-BBK_folder = os.path.join(path_handler.lu_lc_folder,'Landuse', 'BBK2015')
-ESM_folder = os.path.join(path_handler.lu_lc_folder,'Landuse', 'ESM')
-
-raster_dict= {
-    'BBK':{
-        'raster_files': [os.path.join(BBK_folder, x) for x in os.listdir(BBK_folder) if x.endswith(".tif")],
-        'mapper': {
-            1: 'building',
-            2: 'road',
-            3: 'rest_impervious',
-            4: 'rail_road',
-            5: 'water',
-            6: 'rest_non_impervious',
-            7: 'crop_land',
-            8: 'gras_shrub',
-            9: 'tree',
-            10: 'gras_shrub_agriculture',
-            11: 'gras_shrub_road',
-            12: 'trees_road',
-            13: 'gras_shrub_water',
-            14: 'trees_water'
-            },
-        'agg':{
-            'green': ['tree', 'rest_non_impervious', 'gras_shrub', 'crop_land', 'gras_shrub_agriculture', 'gras_shrub_road', 
-                                         'gras_shrub_water', 'trees_water', 'trees_road'],
-            'impervious' : ['road', 'rest_impervious', 'rail_road', 'building']
-            },
-        'crs': "EPSG:31370"
-        },
-    'S2GLC':{
-        'raster_files': os.path.join(path_handler.lu_lc_folder,'Landuse', 'S2GLC_EUROPE_2017', 'S2GLC_Europe_2017_v1.2.tif'),
-        'mapper':  {
-            0:'clouds',
-            62: 'Artificial_surfaces_and_constructions',
-            73: 'Cultivated areas',
-            75: 'Vineyards',
-            82: 'Broadleaf tree cover',
-            83: 'Coniferious tree cover',
-            102: 'Herbaceous vegetation',
-            103: 'Moors and heathland',
-            104: 'Sclerophyllous vegetation',
-            105: 'Marshes',
-            106: 'Peatbogs',
-            121: 'Natural material surfaces',
-            123: 'Permanent snow covered surfaces',
-            162: 'Water',
-            255: 'No data'
-            },
-        'agg':{
-            'green': ['Cultivated areas', 'Vineyards', 'Broadleaf tree cover', 'Coniferious tree cover',
-                      'Herbaceous vegetation', 'Moors and heathland', 'Sclerophyllous vegetation',
-                      'Marshes', 'Peatbogs', 'Natural material surfaces', 'Permanent snow covered surfaces'],
-            'impervious' : ['Artificial_surfaces_and_constructions'],
+def get_raster_dict(lu_lc_folder=path_handler.lu_lc_folder):
+    """ This function returns the landuse maps (in order of preference) with their class mapper and aggregation. """
+    
+    BBK_folder = os.path.join(lu_lc_folder,'Landuse', 'BBK2015')
+
+    raster_dict= {
+        'BBK':{
+            'raster_files': sorted([os.path.join(BBK_folder, x) for x in os.listdir(BBK_folder) if x.endswith(".tif") and not '_fraction_' in x and not x.endswith(temporary_raster_suffixes)]),
+            'mapper': {
+                1: 'building',
+                2: 'road',
+                3: 'rest_impervious',
+                4: 'rail_road',
+                5: 'water',
+                6: 'rest_non_impervious',
+                7: 'crop_land',
+                8: 'gras_shrub',
+                9: 'tree',
+                10: 'gras_shrub_agriculture',
+                11: 'gras_shrub_road',
+                12: 'trees_road',
+                13: 'gras_shrub_water',
+                14: 'trees_water'
+                },
+            'agg':{
+                'green': ['tree', 'rest_non_impervious', 'gras_shrub', 'crop_land', 'gras_shrub_agriculture', 'gras_shrub_road', 
+                                             'gras_shrub_water', 'trees_water', 'trees_road'],
+                'impervious' : ['road', 'rest_impervious', 'rail_road', 'building']
+                },
+            'crs': "EPSG:31370",
+            'fraction_maps': False #if True, the precomputed fraction maps are sampled (see landcover_fraction_maps.py)
             },
-        'crs': 'EPSG:3035'
+        'S2GLC':{
+            'raster_files': os.path.join(lu_lc_folder,'Landuse', 'S2GLC_EUROPE_2017', 'S2GLC_Europe_2017_v1.2.tif'),
+            'mapper':  {
+                0:'clouds',
+                62: 'Artificial_surfaces_and_constructions',
+                73: 'Cultivated areas',
+                75: 'Vineyards',
+                82: 'Broadleaf tree cover',
+                83: 'Coniferious tree cover',
+                102: 'Herbaceous vegetation',
+                103: 'Moors and heathland',
+                104: 'Sclerophyllous vegetation',
+                105: 'Marshes',
+                106: 'Peatbogs',
+                121: 'Natural material surfaces',
+                123: 'Permanent snow covered surfaces',
+                162: 'Water',
+                255: 'No data'
+                },
+            'agg':{
+                'green': ['Cultivated areas', 'Vineyards', 'Broadleaf tree cover', 'Coniferious tree cover',
+                          'Herbaceous vegetation', 'Moors and heathland', 'Sclerophyllous vegetation',
+                          'Marshes', 'Peatbogs', 'Natural material surfaces', 'Permanent snow covered surfaces'],
+                'impervious' : ['Artificial_surfaces_and_constructions'],
+                },
+            'crs': 'EPSG:3035'
+            }
         }
-    }
+    return raster_dict
 
 
 
 
 
-def calculate_landuse(stationdf, bufferlist, raster_dict, lat_identifier, lon_identifier):
+def route_stations(stationdf, bufferlist, raster_dict, lat_identifier, lon_identifier):
+    """ This function decides (once) which map is used for each station and buffer radius: the first map in the 
+        raster_dict (BBK, S2GLC, ...) of which the tiles fully cover the buffer. Only the tile footprints are used, no 
+        map values are read.
+        
+         Keyword arguments: \n
+            stationdf -- pd.DataFrame
+                        a pandas dataframe with at least the lat and lon columns \n
+            bufferlist -- list
+                        a LIST with the buffer radii in meter \n
+        
+        Return
+            used_map -- numpy array (station x buffer radius) with the map to use, None if no map covers the buffer \n
+            routed -- dict map --> (station indices, xs, ys) of the stations that use the map for at least one radius """
+    
+    import gis_functions as gis
+    
+    used_map = np.full((stationdf.shape[0], len(bufferlist)), None, dtype=object)
+    routed = {}
+    for raster in raster_dict:
+        todo_stations = np.nonzero(pd.isnull(used_map).any(axis=1))[0]
+        if len(todo_stations) == 0:
+            break
+        xs, ys = gis.latlon_to_xy(lats = stationdf[lat_identifier].values[todo_stations],
+                                  lons = stationdf[lon_identifier].values[todo_stations],
+                                  crs = raster_dict[raster]['crs'])
+        covered = gis.buffers_covered(xs, ys, bufferlist, raster_dict[raster]['raster_files'])
+        covered &= pd.isnull(used_map[todo_stations])
+        station_used_map = used_map[todo_stations]
+        station_used_map[covered] = raster
+        used_map[todo_stations] = station_used_map
+        
+        map_stations = covered.any(axis=1)
+        if map_stations.any():
+            routed[raster] = (todo_stations[map_stations], xs[map_stations], ys[map_stations])
+    return used_map, routed
+
+
+def calculate_landuse(stationdf, bufferlist, raster_dict, lat_identifier, lon_identifier, wide=False):
      
     """ This functions calculate the landuse as fractions for the stations based on a buffer radius. 
-        As a first attempt, the landuse will be derived from the first key in the rasterdict (BBK). If the station (or the buffer),
-        is outside the domain of the these maps, the next map is used. 
+        For each station and buffer radius, the first map in the rasterdict (BBK) that fully covers the buffer is used 
+        (see route_stations()). The stations are computed in one batch per map and all buffer radii of a station are 
+        computed from one raster read. Buffers that are not covered by any map are reported and get no fractions.
         
          Keyword arguments: \n
             stationdf -- pd.DataFrame
@@ -314,83 +332,102 @@ def calculate_landuse(stationdf, bufferlist, raster_dict, lat_identifier, lon_id
                         lat (latitute of station), lon (lontitude of the station) 
             bufferlist -- list
                         a LIST with the buffer radii in meter \n
+            wide -- bool
+                        if True, one row per station (see landuse_dataframe()) \n
         
         Return
             stationdf with added columns for the landuseclasses as fractions, a column indication for: the used map, the buffer radius. """
         
+    import gis_functions as gis
+    import landcover_fraction_maps
+    
+    used_map, routed = route_stations(stationdf, bufferlist, raster_dict, lat_identifier, lon_identifier)
+    
+    uncovered = pd.isnull(used_map)
+    if uncovered.any(): #if the buffer is not found in the maps
+        print('The buffers of ', int(uncovered.any(axis=1).sum()), ' stations are not (fully) covered by any map, no landuse is computed for:')
+        for i, j in zip(*np.nonzero(uncovered)):
+            print('    lat: ', stationdf[lat_identifier].values[i], ', lon: ', stationdf[lon_identifier].values[i],
+                  ', buffer radius: ', bufferlist[j])
     
+    #landuse class counts (station x buffer radius x class) per map, the window of the largest buffer is read once per station.
+    counts_per_map = {}
+    for raster, (map_stations, xs, ys) in routed.items():
+        print('Landuse of ', len(map_stations), ' stations from ', raster)
+        count_cube = np.full((stationdf.shape[0], len(bufferlist), len(raster_dict[raster]['mapper'])), np.nan)
+        if raster_dict[raster].get('fraction_maps', False): #point sample of the fraction maps instead of zonal counts
+            count_cube[map_stations] = landcover_fraction_maps.sample_fraction_maps(lats = stationdf[lat_identifier].values[map_stations],
+                                                                                    lons = stationdf[lon_identifier].values[map_stations],
+                                                                                    raster_file_list = raster_dict[raster]['raster_files'],
+                                                                                    radii = bufferlist,
+                                                                                    categories = list(raster_dict[raster]['mapper'].keys()))
+        else:
+            count_cube[map_stations] = gis.disk_class_count_cube(xs = xs, ys = ys,
+                                                                 radii = bufferlist,
+                                                                 raster_file_list = raster_dict[raster]['raster_files'],
+                                                                 categories = list(raster_dict[raster]['mapper'].keys()))
+        counts_per_map[raster] = count_cube
     
-    total_geodf = pd.DataFrame() #initiate return df
-    for _idx, row in stationdf.iterrows():
-        raster_iterator = iter(raster_dict) #create a iterable of the rastersets
-        raster = next(raster_iterator) #try with the first raster in the raster dict
-        for buffer_radius in bufferlist:
-            append_row = row.copy()
-            append_row['buffer_radius'] = buffer_radius
-            
-            #create circular buffer in the coordinates of the raster file
-            buffer_geometry = gis.coordinate_to_circular_buffer_geometry(lat_center=append_row[lat_identifier],
-                                                                         lon_center=append_row[lon_identifier],
-                                                                         radius_m=buffer_radius,
-                                                                         crs = raster_dict[raster]['crs'])
-            #get cell value frequency table of the geometry on the raster
-            freq_table = gis.ULTIMATE_read_from_rasterfile(geometry = buffer_geometry,
-                                                           raster_file_list = raster_dict[raster]['raster_files'],
-                                                           return_map_info = False,
-                                                           return_counts=True,
-                                                           none_if_no_overlap=True)
-            if freq_table is None: #geometry not in raster files, try the next raster folder
-                raster = next(raster_iterator)
-                #create circular buffer in the coordinates of the raster file
-                buffer_geometry = gis.coordinate_to_circular_buffer_geometry(lat_center=append_row[lat_identifier],
-                                                                         lon_center=append_row[lon_identifier],
-                                                                         radius_m=buffer_radius,
-                                                                         crs = raster_dict[raster]['crs'])
-               #get cell value frequency table of the geometry on the raster
-                freq_table = gis.ULTIMATE_read_from_rasterfile(geometry = buffer_geometry,
-                                                           raster_file_list = raster_dict[raster]['raster_files'],
-                                                           return_map_info = False,
-                                                           return_counts=True,
-                                                           none_if_no_overlap=True)
-                if freq_table is None: #if the geometry is not found in the two maps
-                    print('geometry not found in any map!!')
-                    sys.exit()
-            #add map info
-            append_row['used_map'] = raster
-            
-            
-            #normalize
-            total_counts = freq_table['counts'].sum()
-            freq_table['fractions'] = [x/total_counts for x in freq_table['counts']]
-            
-            #map apparant classes
-            freq_table['lc'] = freq_table['category'].map(raster_dict[raster]['mapper'])
-            
-            #add unused classes for consistency
-            freq_table = freq_table.merge(pd.Series(raster_dict[raster]['mapper'].values(), name='lc'),how='outer', on='lc')
-            freq_table['fractions'] = freq_table['fractions'].fillna(0.0)
-            freq_table = pd.Series(data=list(freq_table['fractions']), index=freq_table['lc'], name='fraction')
-            
-            #add lu info to the row info
-            append_row = append_row.append(freq_table)
-            #aggregate classes
-            for agg_class in raster_dict[raster]['agg']:
-                append_row[agg_class] = append_row[raster_dict[raster]['agg'][agg_class]].sum()
-            #add row to the df
-            total_geodf = total_geodf.append(append_row, ignore_index=True)
-    return total_geodf
-
-df = calculate_landuse(stationdf = df,
-                       bufferlist = buffer_list,
-                       raster_dict = raster_dict,
-                       lat_identifier=lat_identifier,
-                       lon_identifier=lon_identifier)
-
-
-
-
-
-#%%
+    
+    return landuse_dataframe(stationdf, bufferlist, raster_dict, counts_per_map, used_map, wide=wide)
+
+
+def landuse_dataframe(stationdf, bufferlist, raster_dict, counts_per_map, used_map, wide=False):
+    """ This function builds the landuse dataframe from the class counts. The columns are filled at once from the 
+        (station x buffer radius x class) count arrays.
+        
+         Keyword arguments: \n
+            counts_per_map -- dict
+                        map --> numpy array (station x buffer radius x class) with the class counts \n
+            used_map -- numpy array
+                        (station x buffer radius) the map that is used for each station and buffer radius (None: no fractions) \n
+            wide -- bool
+                        if False, one row per station and buffer radius (with a buffer_radius column). If True, one row
+                        per station with a <column>_<radius>m column for each buffer radius. 
+        
+        Return
+            stationdf with added columns for the landuseclasses as fractions, a column indication for: the used map, the buffer radius. """
+    
+    n_stations, n_radii = used_map.shape
+    flat_used_map = used_map.ravel() #station x buffer radius rows
+    
+    #the classes of the maps in order of first use (as if the rows were appended one by one)
+    used_maps = [raster for raster in pd.unique(flat_used_map) if raster is not None] #None: not covered by any map
+    landuse_columns = {'used_map': flat_used_map}
+    class_columns, agg_columns = {}, {}
+    for raster in used_maps:
+        rows = flat_used_map == raster
+        counts = counts_per_map[raster].reshape(n_stations * n_radii, -1)[rows]
+        with np.errstate(divide='ignore', invalid='ignore'): #normalize
+            fractions = counts / counts.sum(axis=1, keepdims=True)
+        class_names = list(raster_dict[raster]['mapper'].values())
+        for c, class_name in enumerate(class_names):
+            column = class_columns.setdefault(class_name, np.full(n_stations * n_radii, np.nan))
+            column[rows] = fractions[:, c]
+        #aggregate classes
+        for agg_class, agg_members in raster_dict[raster]['agg'].items():
+            column = agg_columns.setdefault(agg_class, np.full(n_stations * n_radii, np.nan))
+            column[rows] = fractions[:, [class_names.index(member) for member in agg_members]].sum(axis=1)
+        if raster == used_maps[0]: #the aggregated columns come after the classes of the first used map
+            landuse_columns.update(class_columns)
+            landuse_columns.update(agg_columns)
+    for column_dict in [class_columns, agg_columns]:
+        for column in column_dict:
+            landuse_columns.setdefault(column, column_dict[column])
+    
+    if wide: #one row per station
+        wide_columns = {}
+        for column, values in landuse_columns.items():
+            values = values.reshape(n_stations, n_radii)
+            for j, buffer_radius in enumerate(bufferlist):
+                wide_columns[column + '_' + str(buffer_radius) + 'm'] = values[:, j]
+        return pd.concat([stationdf.reset_index(drop=True), pd.DataFrame(wide_columns)], axis=1)
+    
+    long_df = stationdf.iloc[np.repeat(np.arange(n_stations), n_radii)].reset_index(drop=True)
+    landuse_df = pd.DataFrame({'buffer_radius': np.tile(np.asarray(bufferlist), n_stations), **landuse_columns})
+    return pd.concat([long_df, landuse_df], axis=1)
+
+#%% LCZ
 
 
 lcz_dict = {
@@ -418,50 +455,606 @@ lcz_dict = {
     }
 
 def get_lcz(stationdf, lcz_dict, station_identifier, lat_identifier, lon_identifier):
-    stationdf['lcz'] = np.nan
-    stations_list = stationdf[station_identifier].unique()
-    for station in stations_list:
-        station_info = stationdf[stationdf[station_identifier] == station].iloc[0]
-        
-        point_geometry = gis.coordinate_to_point_geometry(lat = station_info[lat_identifier],
-                                                          lon = station_info[lon_identifier],
-                                                          crs = lcz_dict['crs']
-                                                          )
-        lcz_number = gis.ULTIMATE_read_from_rasterfile(geometry = point_geometry,
-                                                       raster_file_list=lcz_dict['file'],
-                                                       return_map_info=False,
-                                                       return_counts=False,
-                                                       none_if_no_overlap=True)
-        if lcz_number is None:
+    import gis_functions as gis
+    #sample the LCZ map for all stations at once
+    lcz_numbers = gis.sample_points(lats = stationdf[lat_identifier],
+                                    lons = stationdf[lon_identifier],
+                                    raster_file_list = lcz_dict['file'])
+    lcz_list = []
+    for station, lcz_number in zip(stationdf[station_identifier], lcz_numbers):
+        if np.isnan(lcz_number):
             print('LCZ for station: ', station , ' could not be found on the LCZ map !!!')
             print('LCZ for station: ', station, ' is manually set as water' )
             lcz = 'LCZ-G, water'
         else: 
-            lcz = lcz_dict['mapper'][lcz_number]
+            lcz = lcz_dict['mapper'][int(lcz_number)]
+        lcz_list.append(lcz)
+    
+    stationdf['lcz'] = lcz_list
+    return stationdf
+
+
+
+#%% Meta data API
+
+def default_config():
+    """ This function returns the configuration of compute_metadata() with the settings of this script. """
+    
+    return {
+        'station_identifier': 'station',
+        'lat_identifier': 'lat',
+        'lon_identifier': 'lon',
+        'DEM_folder': os.path.join(path_handler.lu_lc_folder, 'DEM/'),
+        'buffer_list': buffer_list,
+        'svf': {
+            'local_radius': local_radius_meter,
+            'loc_buffer': loc_buffer_meter,
+            'num_directions': num_directions,
+            'use_svf_maps': use_svf_maps
+            },
+        'raster_dict': None, #if None, get_raster_dict() is used (at the first computation)
+        'lcz_dict': lcz_dict,
+        'raster_pool_size': raster_pool_size,
+        'tile_catalog_file': tile_catalog_file,
+        'cache_file': metadata_cache_file,
+        'zonal_cache_file': zonal_cache_file,
+        'zonal_cache_max_mb': zonal_cache_max_mb,
+        'n_processes': n_processes,
+        'partition_size': partition_size
+        }
+
+
+def check_station_df(stationdf, station_identifier, lat_identifier, lon_identifier):
+    """ This function checks if the identifier columns are present and if the station identifiers are unique. """
+    
+    for column in [station_identifier, lat_identifier, lon_identifier]:
+        if not column in stationdf.columns:
+            print('the column ', column, ' is not found in the stations. These columnnames are found instead: ', list(stationdf.columns))
+            sys.exit()
+    
+    if not stationdf[station_identifier].is_unique:
+        print('the column ', station_identifier, ' is not unique!! Stop script.')
+        sys.exit()
+
+
+def _location_keys(stationdf, config, quantity, radius, dataset, checksum, params):
+    #the cache keys of all the rows of the stationdf
+    import metadata_cache
+    return [metadata_cache.metadata_key(lat, lon, quantity, radius, dataset, checksum, params)
+            for lat, lon in zip(stationdf[config['lat_identifier']], stationdf[config['lon_identifier']])]
+
+
+def _missing_locations(keys_per_radius, cached, names_per_radius=None):
+    #positions of the first row of each location that misses a value in the cache (for one of the radii)
+    if names_per_radius is None:
+        names_per_radius = [[] for _keys in keys_per_radius]
+    missing, seen = [], set()
+    for i, keys in enumerate(zip(*keys_per_radius)):
+        if (keys[0] not in seen) & any((key not in cached) or any(name not in cached[key] for name in names)
+                                       for key, names in zip(keys, names_per_radius)):
+            missing.append(i)
+        seen.add(keys[0])
+    return missing
+
+
+def cached_columns(stationdf, config, compute_function, quantity, columns_per_radius, dataset, checksum, params, cache_names=None):
+    """ This function adds the meta data columns to the stationdf. The values are taken from the metadata cache, 
+        compute_function (stationdf --> stationdf with the columns) is only used for the locations that are not
+        in the cache. 
         
-        stationdf.loc[stationdf[station_identifier] == station, 'lcz'] = lcz
+        columns_per_radius is a dictionary radius --> list of columns (radius is 0 for point values). cache_names is
+        a dictionary column --> name of the value in the cache (by default the column itself), so the same cached 
+        value can be used for columns with another name. """
+    
+    import metadata_cache
+    if cache_names is None:
+        cache_names = {}
+    params = metadata_cache.params_key(params)
+    keys_per_radius = [_location_keys(stationdf, config, quantity, radius, dataset, checksum, params) for radius in columns_per_radius]
+    names_per_radius = [[cache_names.get(column, column) for column in columns] for columns in columns_per_radius.values()]
+    cached = metadata_cache.lookup_metadata(config['cache_file'], [key for keys in keys_per_radius for key in keys])
+    
+    missing = _missing_locations(keys_per_radius, cached, names_per_radius)
+    print(quantity, ': ', len(set(keys_per_radius[0])) - len(missing), ' locations from the cache, ', len(missing), ' locations to compute.')
+    if missing:
+        computed = compute_function(stationdf.iloc[missing]).reset_index(drop=True)
+        new_values = {}
+        for keys, columns in zip(keys_per_radius, columns_per_radius.values()):
+            for j, i in enumerate(missing):
+                new_values[keys[i]] = {cache_names.get(column, column): computed[column].iloc[j] for column in columns}
+        metadata_cache.store_metadata(config['cache_file'], new_values)
+        cached.update(new_values)
+    
+    stationdf = stationdf.copy()
+    for keys, columns in zip(keys_per_radius, columns_per_radius.values()):
+        for column in columns:
+            stationdf[column] = [cached[key][cache_names.get(column, column)] for key in keys]
     return stationdf
 
 
+def cached_landuse(stationdf, config):
+    """ This function returns the landuse fractions (as calculate_landuse()), the values are taken from the metadata 
+        cache and calculate_landuse is only used for the locations that are not in the cache. """
+    
+    import metadata_cache
+    raster_dict = config['raster_dict']
+    bufferlist = config['buffer_list']
+    dataset = 'landuse:' + ','.join(raster_dict.keys())
+    checksum = metadata_cache.map_checksum([raster_file for raster in raster_dict.values() for raster_file in 
+                                            ([raster['raster_files']] if isinstance(raster['raster_files'], str) else raster['raster_files'])])
+    params = metadata_cache.params_key({raster: {'mapper': raster_dict[raster]['mapper'], 'agg': raster_dict[raster]['agg'],
+                                                 'fraction_maps': raster_dict[raster].get('fraction_maps', False)} for raster in raster_dict})
+    keys_per_radius = [_location_keys(stationdf, config, 'landuse', radius, dataset, checksum, params) for radius in bufferlist]
+    cached = metadata_cache.lookup_metadata(config['cache_file'], [key for keys in keys_per_radius for key in keys])
+    
+    missing = _missing_locations(keys_per_radius, cached)
+    print('landuse : ', len(set(keys_per_radius[0])) - len(missing), ' locations from the cache, ', len(missing), ' locations to compute.')
+    if missing:
+        computed = calculate_landuse(stationdf = stationdf.iloc[missing],
+                                     bufferlist = bufferlist,
+                                     raster_dict = raster_dict,
+                                     lat_identifier = config['lat_identifier'],
+                                     lon_identifier = config['lon_identifier'])
+        landuse_columns = [column for column in computed.columns if not column in stationdf.columns and column != 'buffer_radius']
+        new_values = {}
+        for row_idx, (_idx, row) in enumerate(computed.iterrows()): #station x buffer radius rows
+            i, j = missing[row_idx // len(bufferlist)], row_idx % len(bufferlist)
+            new_values[keys_per_radius[j][i]] = {column: row[column] for column in landuse_columns if not pd.isnull(row[column])}
+        metadata_cache.store_metadata(config['cache_file'], new_values)
+        cached.update(new_values)
+    
+    #one row per station and buffer radius
+    rows = []
+    for i, (_idx, row) in enumerate(stationdf.iterrows()):
+        for j, buffer_radius in enumerate(bufferlist):
+            rows.append({**row.to_dict(), 'buffer_radius': buffer_radius, **cached[keys_per_radius[j][i]]})
+    return pd.DataFrame(rows)
+
+
+def compute_svf(stationdf, config):
+    #find_SVF with the settings of the config
+    return find_SVF(stationdf = stationdf,
+                    station_identifier = config['station_identifier'],
+                    lat_identifier = config['lat_identifier'],
+                    lon_identifier = config['lon_identifier'],
+                    DEM_folder = config['DEM_folder'],
+                    local_radius = config['svf']['local_radius'],
+                    loc_buffer = config['svf']['loc_buffer'],
+                    num_directions = config['svf']['num_directions'],
+                    use_svf_maps = config['svf']['use_svf_maps'])
+
+
+def compute_lcz(stationdf, config):
+    #get_lcz with the settings of the config
+    return get_lcz(stationdf = stationdf,
+                   lcz_dict = config['lcz_dict'],
+                   station_identifier = config['station_identifier'],
+                   lat_identifier = config['lat_identifier'],
+                   lon_identifier = config['lon_identifier'])
+
+
+def compute_metadata(stations_df, config=None):
+    """ This function computes the meta data (height, SVF, landuse fractions per buffer radius and LCZ) of the stations.
+        
+         Keyword arguments: \n
+            stations_df -- pd.DataFrame
+                        a pandas dataframe with a (unique) station identifier, a lat and a lon column \n
+            config -- dict
+                        the settings, see default_config(). If the raster_dict is None, it is filled in at the first 
+                        call (and reused by the next calls with the same config). If the cache_file is not None, the
+                        meta data of previous calls is reused (see metadata_cache.py). \n
+        
+        Return
+            a dataframe (one row per station and buffer radius) with the original columns followed by the meta data. """
+    
+    import gis_functions as gis
+    
+    if config is None:
+        config = default_config()
+    
+    station_identifier = config['station_identifier']
+    lat_identifier = config['lat_identifier']
+    lon_identifier = config['lon_identifier']
+    check_station_df(stations_df, station_identifier, lat_identifier, lon_identifier)
+    
+    gis.set_raster_pool_size(config['raster_pool_size'])
+    gis.set_tile_catalog_file(config['tile_catalog_file'])
+    gis.set_zonal_cache(config.get('zonal_cache_file'), max_bytes = config.get('zonal_cache_max_mb', zonal_cache_max_mb) * 1024**2)
+    if config['raster_dict'] is None:
+        config['raster_dict'] = get_raster_dict()
+    
+    columnlist = list(stations_df.columns)
+    
+    if config.get('cache_file') is None:
+        df = find_height(stations_df, lat_identifier, lon_identifier, config['DEM_folder'])
+        df = compute_svf(df, config)
+        #the LCZ is sampled once per station, and added to the rows of each buffer radius
+        lcz_df = compute_lcz(df.copy(), config)[[station_identifier, 'lcz']]
+        df = calculate_landuse(stationdf = df,
+                               bufferlist = config['buffer_list'],
+                               raster_dict = config['raster_dict'],
+                               lat_identifier = lat_identifier,
+                               lon_identifier = lon_identifier)
+        df = df.merge(lcz_df, on=station_identifier, how='left')
+    else:
+        import metadata_cache
+        DEM_checksum = metadata_cache.map_checksum(DEM_files(config['DEM_folder']))
+        df = cached_columns(stations_df, config, 
+                            compute_function = lambda subdf: find_height(subdf, lat_identifier, lon_identifier, config['DEM_folder']),
+                            quantity = 'height', columns_per_radius = {0: ['height']}, 
+                            dataset = 'DEM', checksum = DEM_checksum, params = {})
+        
+        local_radius = config['svf']['local_radius']
+        if isinstance(local_radius, (list, tuple)):
+            svf_columns = {radius: ['svf_' + str(int(radius)) + 'm'] for radius in local_radius}
+        else:
+            svf_columns = {local_radius: ['svf']}
+        svf_params = {key: value for key, value in config['svf'].items() if key != 'local_radius'}
+        #the SVF of a radius is cached as svf, for a scalar local_radius (column svf) and for a list (column svf_<radius>m)
+        df = cached_columns(df, config, compute_function = lambda subdf: compute_svf(subdf, config),
+                            quantity = 'svf', columns_per_radius = svf_columns, 
+                            dataset = 'DEM', checksum = DEM_checksum, params = svf_params,
+                            cache_names = {column: 'svf' for columns in svf_columns.values() for column in columns})
+        
+        #the LCZ is sampled once per station, and added to the rows of each buffer radius
+        lcz_df = cached_columns(df, config, compute_function = lambda subdf: compute_lcz(subdf, config),
+                                quantity = 'lcz', columns_per_radius = {0: ['lcz']}, dataset = 'LCZ',
+                                checksum = metadata_cache.map_checksum(config['lcz_dict']['file']), 
+                                params = {'mapper': config['lcz_dict']['mapper']})[[station_identifier, 'lcz']]
+        
+        df = cached_landuse(df, config)
+        df = df.merge(lcz_df, on=station_identifier, how='left')
+    
+    #arrange columns so that the added columns comes after the original columns
+    meta_columns = [column for column in df.columns if not column in columnlist]
+    return df[columnlist + meta_columns]
+
+
+
+
+#%% Parallel engine
 
-df = get_lcz(stationdf = df,
-             lcz_dict = lcz_dict,
-             station_identifier = station_identifier,
-             lat_identifier = lat_identifier,
-             lon_identifier = lon_identifier)
+def partition_stations(stationdf, config, n_partitions):
+    """ This function partitions the stations by spatial tile (a grid of partition_size meter in EPSG:3035), so the
+        stations of a partition use the same raster tiles. Tiles with many stations are split (in stations that are
+        close to each other) so there are at least n_partitions partitions if there are enough stations.
+        
+        Return: list of arrays with the positions (in the stationdf) of the stations of each partition. """
+    
+    import gis_functions as gis
+    
+    xs, ys = gis.latlon_to_xy(lats = stationdf[config['lat_identifier']].values,
+                              lons = stationdf[config['lon_identifier']].values,
+                              crs = "EPSG:3035")
+    tile_x = np.floor(xs / float(config['partition_size'])).astype(np.int64)
+    tile_y = np.floor(ys / float(config['partition_size'])).astype(np.int64)
+    order = np.lexsort((ys, xs, tile_y, tile_x)) #by tile, and by location in the tile
+    max_stations = int(np.ceil(stationdf.shape[0] / float(max(n_partitions, 1))))
+    
+    partitions = []
+    tile_starts = np.nonzero(np.diff(tile_x[order]) | np.diff(tile_y[order]))[0] + 1
+    for tile_positions in np.split(order, tile_starts):
+        for start in range(0, len(tile_positions), max_stations):
+            partitions.append(np.sort(tile_positions[start: start + max_stations]))
+    return partitions
+
+
+def _warm_tile_catalogs(config):
+    #build the tile catalogs of all maps before the worker processes start, they load them from the tile catalog file
+    import gis_functions as gis
+    DEM_folder = config['DEM_folder']
+    DEM_map_files = DEM_files(DEM_folder)
+    for raster_file_list in [DEM_map_files, config['lcz_dict']['file']] + [raster['raster_files'] for raster in config['raster_dict'].values()]:
+        gis.get_tile_catalog(raster_file_list)
+
+
+def _partition_margin(config):
+    #distance (in meter) around the stations that the height, SVF and landuse computations read
+    local_radius = config['svf']['local_radius']
+    radii = list(local_radius) if isinstance(local_radius, (list, tuple)) else [local_radius]
+    return max(list(config['buffer_list']) + radii)
+
+
+def compute_partition(stations_df, config):
+    """ This function computes the meta data of the stations of a partition (see compute_metadata()), the part of each
+        tile around the stations is read once and shared by the height, SVF, landuse and LCZ computations (see 
+        gis_functions.set_shared_region()). """
+    
+    import gis_functions as gis
+    gis.set_shared_region(lats = stations_df[config['lat_identifier']].values,
+                          lons = stations_df[config['lon_identifier']].values,
+                          margin = _partition_margin(config))
+    try:
+        return compute_metadata(stations_df, config)
+    finally:
+        gis.clear_shared_region()
+
+
+def compute_metadata_parallel(stations_df, config=None):
+    """ This function computes the meta data of the stations as compute_metadata(), but the stations are partitioned by
+        spatial tile (see partition_stations()) and the partitions are computed in config['n_processes'] worker 
+        processes (see compute_partition()). Each worker keeps its own raster pool, so the tiles of a partition are 
+        opened once, and the part of the tiles around the stations of a partition is read once and shared by the 
+        computations. The workers are spawned (not forked): a forked worker can deadlock on the thread pool of the
+        numba SVF kernels of this process. 
+        
+        Return
+            the same dataframe as compute_metadata() (the rows are in the order of the stations_df). """
+    
+    if config is None:
+        config = default_config()
+    station_identifier = config['station_identifier']
+    check_station_df(stations_df, station_identifier, config['lat_identifier'], config['lon_identifier'])
+    
+    workers = config.get('n_processes', 1)
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1:
+        return compute_metadata(stations_df, config)
+    
+    import gis_functions as gis
+    gis.set_tile_catalog_file(config['tile_catalog_file'])
+    if config['raster_dict'] is None:
+        config['raster_dict'] = get_raster_dict()
+    _warm_tile_catalogs(config)
+    
+    partitions = partition_stations(stations_df, config, workers)
+    print('The stations are computed in ', len(partitions), ' partitions with ', workers, ' processes.')
+    with ProcessPoolExecutor(max_workers=min(workers, len(partitions)), mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(compute_partition, stations_df.iloc[positions], config) for positions in partitions]
+        results = [future.result() for future in futures]
+    
+    #merge in the order of the stations (and buffer radii), independent of the partitioning
+    df = pd.concat(results, ignore_index=True, sort=False)
+    station_order = pd.Series(np.arange(stations_df.shape[0]), index=stations_df[station_identifier].values)
+    df = df.iloc[np.argsort(station_order[df[station_identifier].values].values, kind='stable')]
+    return df.reset_index(drop=True)
+
+
+
+
+def _write_check_maps(folder, num_stations=25):
+    #random DEM, landuse and LCZ maps (EPSG:3035, 10m) and stations in the center of the maps
+    import rasterio
+    rng = np.random.default_rng(11)
+    transform = rasterio.Affine(10., 0, 3900000., 0, -10., 3100000.)
+    os.makedirs(os.path.join(folder, 'DEM'))
+    maps = {'DEM/dem.tif': (rng.random((300, 300)) * 25.).astype('float32'),
+            'landuse.tif': rng.integers(1, 8, (300, 300)).astype('uint8'),
+            'lcz.tif': rng.integers(1, 18, (300, 300)).astype('uint8')}
+    for name, array in maps.items():
+        with rasterio.open(os.path.join(folder, name), 'w', driver='GTiff', width=300, height=300, count=1, dtype=array.dtype,
+                           crs='EPSG:3035', transform=transform, nodata=0) as dst:
+            dst.write(array, 1)
+    
+    xs = 3900000. + rng.uniform(1000., 2000., num_stations)
+    ys = 3100000. - rng.uniform(1000., 2000., num_stations)
+    import gis_functions as gis
+    lons, lats = gis.get_transformer('EPSG:3035', 'EPSG:4326').transform(xs, ys)
+    stations_df = pd.DataFrame({'station': ['station_' + str(i) for i in range(num_stations)], 'lat': lats, 'lon': lons})
+    
+    config = default_config()
+    config['DEM_folder'] = os.path.join(folder, 'DEM')
+    config['raster_dict'] = {'landuse': {'raster_files': [os.path.join(folder, 'landuse.tif')],
+                                         'mapper': {1: 'building', 2: 'road', 3: 'rest_impervious', 4: 'water', 
+                                                    5: 'tree', 6: 'gras_shrub', 7: 'crop_land'},
+                                         'agg': {'green': ['tree', 'gras_shrub', 'crop_land'],
+                                                 'impervious': ['building', 'road', 'rest_impervious']},
+                                         'crs': 'EPSG:3035'}}
+    config['lcz_dict'] = dict(lcz_dict, file=os.path.join(folder, 'lcz.tif'))
+    config['tile_catalog_file'] = None
+    config['cache_file'] = None
+    config['zonal_cache_file'] = None
+    config['n_processes'] = 3
+    config['partition_size'] = 500
+    return stations_df, config
+
+
+def _serial_then_parallel(folder):
+    #compute_metadata() and then compute_metadata_parallel() in this process, on the maps of _write_check_maps()
+    stations_df, config = _write_check_maps(folder)
+    serial = compute_metadata(stations_df, config)
+    parallel = compute_metadata_parallel(stations_df, config)
+    pd.testing.assert_frame_equal(serial, parallel)
+    print('The parallel meta data is equal to the serial meta data.')
+
+
+def parallel_check(timeout=600):
+    """ Check, on random maps, that compute_metadata() followed by compute_metadata_parallel() in one process gives the
+        same meta data and that the process exits (a forked worker could deadlock on the thread pool of the numba SVF
+        kernels of the serial run). """
+    
+    tmp_folder = tempfile.mkdtemp(prefix='metadata_check_')
+    try:
+        code = 'import get_all_meta_data; get_all_meta_data._serial_then_parallel(' + repr(tmp_folder) + ')'
+        try:
+            result = subprocess.run([sys.executable, '-c', code], cwd=str(file_folder), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print('The serial and parallel meta data run did not exit within ', timeout, ' seconds!!')
+            raise
+        assert result.returncode == 0
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    print('The serial and parallel meta data run exits.')
+
+
+
+
+#%% Streaming
+
+def _file_signature(filename):
+    #size and modification time, to check that the input file did not change since the checkpoint
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_checkpoint(checkpoint_file, run_info):
+    #the checkpoint of a previous (killed) run on the same input, output and chunk size
+    if not os.path.isfile(checkpoint_file):
+        return None
+    try:
+        with open(checkpoint_file, 'r') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        print('The checkpoint file ', checkpoint_file, ' could not be read, the run starts from the beginning.')
+        return None
+    if checkpoint.get('run') != run_info:
+        print('The checkpoint file ', checkpoint_file, ' is of another run (input, output or chunk size), the run starts from the beginning.')
+        return None
+    return checkpoint
+
+
+def _write_checkpoint(checkpoint_file, checkpoint):
+    #write and rename, so a killed run never leaves a half written checkpoint
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def output_columns(chunk_df, raster_dict):
+    """ This function returns the columns of the (streamed) output: the columns of the first chunk, followed by the 
+        landuse classes of the maps that are not used in the first chunk. All chunks are written with these columns. """
+    
+    columns = list(chunk_df.columns)
+    for raster in raster_dict:
+        for column in list(raster_dict[raster]['mapper'].values()) + list(raster_dict[raster]['agg'].keys()):
+            if not column in columns:
+                columns.append(column)
+    return columns
+
+
+def _write_chunk(chunk_df, output_file, chunk_number):
+    #append to the csv file, or write a part file in the parquet folder
+    if output_file.endswith('.parquet'):
+        for column in chunk_df.columns[chunk_df.dtypes == object]: #same (string) type in all the part files
+            chunk_df[column] = chunk_df[column].astype('string')
+        chunk_df.to_parquet(os.path.join(output_file, 'part-' + str(chunk_number).zfill(5) + '.parquet'), index=False)
+    else:
+        chunk_df.to_csv(output_file, mode='a', header=(chunk_number == 0), index=False)
+
+
+def compute_metadata_file(location_file, output_file, config=None, chunk_size=None, checkpoint_file=None):
+    """ This function computes the meta data (see compute_metadata_parallel()) of the locations in a csv file, in chunks
+        of locations. Each chunk is read, computed and written to the output before the next chunk is read, so the memory
+        use does not depend on the size of the file. After each chunk the checkpoint file is updated, a killed run 
+        (with the same input file, output file and chunk size) continues after the last written chunk.
+        
+         Keyword arguments: \n
+            location_file -- str
+                        csv file with a station, lat and lon column \n
+            output_file -- str
+                        the output, a csv file or (if the name ends with .parquet) a folder with a parquet file per 
+                        chunk \n
+            chunk_size -- int
+                        number of locations per chunk, None reads the whole file at once \n
+            checkpoint_file -- str
+                        the checkpoint (json), the default is <output_file>.checkpoint.json. It is removed when all the 
+                        chunks are written. """
+    
+    if config is None:
+        config = default_config()
+    if checkpoint_file is None:
+        checkpoint_file = output_file.rstrip(os.sep) + '.checkpoint.json'
+    if output_file.endswith('.parquet'):
+        try:
+            import pyarrow
+        except ImportError:
+            print('Writing the output as parquet requires pyarrow, install it or use a csv output file.')
+            sys.exit()
+    
+    run_info = {'location_file': os.path.abspath(location_file),
+                'location_file_signature': _file_signature(location_file),
+                'output_file': os.path.abspath(output_file),
+                'chunk_size': chunk_size}
+    checkpoint = _read_checkpoint(checkpoint_file, run_info)
+    
+    if checkpoint is None: #start from the beginning
+        checkpoint = {'run': run_info, 'completed_chunks': 0, 'output_size': 0, 'columns': None}
+        if output_file.endswith('.parquet'):
+            shutil.rmtree(output_file, ignore_errors=True)
+            os.makedirs(output_file)
+        elif os.path.exists(output_file):
+            os.remove(output_file)
+    else:
+        print('Resuming from the checkpoint: ', checkpoint['completed_chunks'], ' chunks are already written to ', output_file)
+        if not output_file.endswith('.parquet'):
+            with open(output_file, 'a') as f: #remove the rows of a chunk that was not completely written
+                f.truncate(checkpoint['output_size'])
+    
+    completed_chunks = checkpoint['completed_chunks']
+    if chunk_size is None:
+        if completed_chunks > 0:
+            print('All the locations are already written to ', output_file)
+            chunks = []
+        else:
+            chunks = [pd.read_csv(location_file, sep=',')]
+    else:
+        chunks = pd.read_csv(location_file, sep=',', chunksize=chunk_size,
+                             skiprows=range(1, completed_chunks * chunk_size + 1)) #skip the locations of the written chunks
+    
+    for chunk_number, chunk_df in enumerate(chunks, start=completed_chunks):
+        print('Computing chunk ', chunk_number, ' (', chunk_df.shape[0], ' locations)')
+        chunk_df = compute_metadata_parallel(chunk_df, config)
+        
+        if checkpoint['columns'] is None:
+            checkpoint['columns'] = output_columns(chunk_df, config['raster_dict'])
+        _write_chunk(chunk_df.reindex(columns=checkpoint['columns']), output_file, chunk_number)
+        
+        checkpoint['completed_chunks'] = chunk_number + 1
+        if not output_file.endswith('.parquet'):
+            checkpoint['output_size'] = os.path.getsize(output_file)
+        _write_checkpoint(checkpoint_file, checkpoint)
+    
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    print('The meta data of all the locations is written to ', output_file)
 
 
 
 
+#%% Command line interface
 
+def ask_identifier(df, default, description):
+    #the default column name, or ask the user
+    if not default in df.columns:
+        print('the column: ', default, ', not found in the input file. These columnnames are found instead: ', list(df.columns))
+        return input('Type the name of the ' + description + ': ')
+    return default
 
-#%% save df
 
-#arrange columns so that the added columns comes after the original columns
-meta_columns = list(set(list(df.columns)) - set(columnlist))
-columnlist.extend(meta_columns)
-df = df[columnlist]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calculate the meta data (height, SVF, landuse and LCZ) of the locations in a coordinates file.')
+    parser.add_argument('location_file', nargs='?', default=location_file, help='csv file with a station, lat and lon column')
+    parser.add_argument('output_file', nargs='?', default=output_file, help='csv file (or a .parquet folder) for the output')
+    parser.add_argument('--chunk-size', type=int, default=chunk_size, help='number of locations that are computed and written at once')
+    parser.add_argument('--checkpoint', default=None, help='checkpoint file to resume a killed run (default: <output_file>.checkpoint.json)')
+    parser.add_argument('--check', action='store_true', help='only check the parallel engine against the serial one on random maps')
+    args = parser.parse_args(argv)
+    
+    if args.check:
+        parallel_check()
+        return
+    
+    print('Meta data will be calculated for file ', args.location_file)
+    header = pd.read_csv(args.location_file, sep=',', nrows=0) #only the column names
+    
+    config = default_config()
+    config['station_identifier'] = ask_identifier(header, 'station', 'unique station identifier')
+    config['lat_identifier'] = ask_identifier(header, 'lat', 'latitude identifier')
+    config['lon_identifier'] = ask_identifier(header, 'lon', 'lon identifier')
+    
+    print('saving data to: ', args.output_file)
+    compute_metadata_file(args.location_file, args.output_file, config, 
+                          chunk_size = args.chunk_size, checkpoint_file = args.checkpoint)
+    
+    import gis_functions as gis
+    import metadata_cache
+    print('zonal statistics cache: ', gis.zonal_cache_stats())
+    gis.close_raster_pool()
+    gis.close_zonal_caches()
+    metadata_cache.close_metadata_caches()
 
-print('saving data to: ', output_file)
-df.to_csv(output_file, index=False)
 
+if __name__ == "__main__":
+    main()
@@ -11,27 +11,1277 @@ Collection of GIS functions
 
 import sys 
 import os
+import threading
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import shutil
+import tempfile
 import pandas as pd
 import math
 import numpy as np
 import geopandas as gpd
+import shapely
+import shapely.wkb
 import rasterio
-import rasterstats
+import rasterio.shutil
 import matplotlib.pyplot as plt
 import matplotlib.colors
-from collections import Counter
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from shapely.geometry import Polygon, Point, box
-from rasterio.merge import merge
-from rasterio.mask import mask
+from shapely.prepared import prep
+from shapely.ops import unary_union
+from rasterio.windows import Window, from_bounds
+from rasterio.warp import transform_bounds
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from rtree import index as rtree_index
+from pyproj import Transformer
 
 
 
 import geo_maps_config
 
+#%% Raster handle pool
+
+# Opening a GeoTIFF (GDAL open + header parsing) is expensive compared to reading a small window out of it. All
+# raster reads in this module go through this process-wide pool of open DatasetReaders. The handles are keyed by
+# the path and the modification time of the file, so a rewritten file is reopened. The handles are leased with 
+# open_raster() (a context manager) and counted: a handle that is in use is never closed, the least recently used
+# handles that are not in use are closed when there are more than max_open_handles.
+raster_pool_settings = {
+    'max_open_handles': 32 #maximum number of raster files that are kept open at the same time (when not in use)
+    }
+
+_raster_pool = OrderedDict() # (path, mtime) --> {'src': rasterio DatasetReader, 'users': number of leases, 'retired': bool}, 
+                             # ordered from least to most recently used
+_raster_pool_lock = threading.Lock()
+
+
+def _retire_raster(entry):
+    #close the handle now, or when the last user releases it
+    entry['retired'] = True
+    if entry['users'] == 0:
+        entry['src'].close()
+
+
+def _evict_raster_pool():
+    excess = len(_raster_pool) - max(int(raster_pool_settings['max_open_handles']), 1)
+    for key in [k for k, entry in _raster_pool.items() if entry['users'] == 0][:max(excess, 0)]: #least recently used
+        _retire_raster(_raster_pool.pop(key))
+
+
+def set_raster_pool_size(max_open_handles):
+    """ Set the maximum number of raster files that are kept open in the raster pool. """
+    
+    with _raster_pool_lock:
+        raster_pool_settings['max_open_handles'] = int(max_open_handles)
+        _evict_raster_pool()
+
+
+def close_raster_pool():
+    """ Close all the raster files in the raster pool. The files that are in use are closed when they are released. """
+    
+    with _raster_pool_lock:
+        while _raster_pool:
+            _key, entry = _raster_pool.popitem()
+            _retire_raster(entry)
+
+
+def _reset_raster_pool_after_fork():
+    #the handles (and the lock) of the parent process can not be used in a forked (worker) process
+    global _raster_pool_lock
+    _raster_pool_lock = threading.Lock()
+    _raster_pool.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_raster_pool_after_fork)
+
+
+def _acquire_raster(raster_file):
+    path = os.path.abspath(raster_file)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError: #not a local file (ex. /vsicurl/ paths), let rasterio handle it
+        path, mtime = raster_file, None
+    key = (path, mtime)
+    
+    with _raster_pool_lock:
+        entry = _raster_pool.get(key)
+        if entry is None:
+            #close handles on older versions of the file
+            for old_key in [k for k in _raster_pool if k[0] == path]:
+                _retire_raster(_raster_pool.pop(old_key))
+            entry = {'src': rasterio.open(path), 'users': 0, 'retired': False}
+            _raster_pool[key] = entry
+        _raster_pool.move_to_end(key)
+        entry['users'] += 1
+        _evict_raster_pool()
+        return entry
+
+
+def _release_raster(entry):
+    with _raster_pool_lock:
+        entry['users'] -= 1
+        if entry['retired']:
+            if entry['users'] == 0:
+                entry['src'].close()
+        else:
+            _evict_raster_pool()
+
+
+@contextmanager
+def open_raster(raster_file):
+    """ This function returns (as a context manager) an open (read mode) rasterio DatasetReader of the raster file, 
+        taken from the raster pool:
+            
+            with open_raster(raster_file) as src:
+                ...
+        
+        The dataset stays open (and is reused by the next calls) after the with block, do NOT close it. Use 
+        close_raster_pool() instead. """
+    
+    entry = _acquire_raster(raster_file)
+    try:
+        yield entry['src']
+    finally:
+        _release_raster(entry)
+
+
+def geometry_window(src, geometry):
+    """ This function returns the window (in the grid of the open raster) that covers the bounds of the geometry, 
+        padded with one cell. """
+    
+    minx, miny, maxx, maxy = geometry.bounds
+    row_start, col_start = rasterio.transform.rowcol(src.transform, minx, maxy)
+    row_stop, col_stop = rasterio.transform.rowcol(src.transform, maxx, miny)
+    return Window(col_off=col_start - 1, row_off=row_start - 1, #pad one cell
+                  width=col_stop - col_start + 3, height=row_stop - row_start + 3)
+
+
+def read_window(src, window, band=1):
+    """ This function reads a window of the band of an open raster. If band is a list of bands, the array is 
+        (bands x rows x columns).
+        
+        Return: the masked array (the nodata cells and the parts of the window that are outside the raster are masked), 
+        the affine transform of the array and the nodata value. """
+    
+    inside = ((window.col_off >= 0) & (window.row_off >= 0) &
+              (window.col_off + window.width <= src.width) & (window.row_off + window.height <= src.height))
+    if inside:
+        array = _read_bands(src, band, window)
+        invalid = np.zeros(array.shape, dtype=bool)
+    else:
+        fill_value = src.nodata if src.nodata is not None else 0
+        array = src.read(band, window=window, boundless=True, fill_value=fill_value)
+        rows = np.arange(window.row_off, window.row_off + array.shape[-2])
+        cols = np.arange(window.col_off, window.col_off + array.shape[-1])
+        outside = ((rows < 0) | (rows >= src.height))[:, None] | ((cols < 0) | (cols >= src.width))[None, :]
+        invalid = np.broadcast_to(outside, array.shape).copy()
+    if src.nodata is not None:
+        invalid |= is_nodata(array, src.nodata)
+    return np.ma.MaskedArray(array, mask=invalid), src.window_transform(window), src.nodata
+
+
+def read_window_around_geometry(src, geometry, band=1):
+    """ This function reads the part of the band of an open raster that covers the bounds of the geometry. 
+        
+        Return: the masked array (see read_window()), the affine transform of the array and the nodata value. """
+    
+    return read_window(src, geometry_window(src, geometry), band=band)
+
+
+def is_nodata(array, nodata):
+    """ This function returns a boolean array that is True where the array equals the nodata value (also for NaN). """
+    
+    if np.isnan(nodata):
+        return np.isnan(array)
+    return array == nodata
+
+
+def read_mosaic_window(raster_file_list, window, band=1):
+    """ This function reads a window (in the grid of the first raster) from one or multiple (adjacent) rasters into 
+        one array. The rasters must have the same grid (crs and resolution). Where the rasters overlap, the first valid
+        value is used. If band is a list of bands, the array is (bands x rows x columns).
+        
+        Return: the masked array (the cells that are not covered by any raster and the nodata cells are masked), the
+        affine transform of the array and the nodata value (of the first raster). """
+    
+    if isinstance(raster_file_list, str): #if there is one tif file
+        raster_file_list = [raster_file_list]
+    
+    #preallocate the array on the grid of the first raster
+    with open_raster(raster_file_list[0]) as src:
+        first, affine, nodata = read_window(src, window, band=band)
+    array = np.ma.getdata(first)
+    filled = ~np.ma.getmaskarray(first) #cells with a valid value
+    
+    for raster_file in raster_file_list[1:]:
+        if filled.all():
+            break
+        with open_raster(raster_file) as src:
+            #position of the mosaic window in the grid of this raster
+            col_off, row_off = ~src.transform * (affine.c, affine.f)
+            col_off, row_off = int(round(col_off)), int(round(row_off))
+            
+            #part of the mosaic window that is covered by this raster
+            col_start, col_stop = max(col_off, 0), min(col_off + array.shape[-1], src.width)
+            row_start, row_stop = max(row_off, 0), min(row_off + array.shape[-2], src.height)
+            if (col_start >= col_stop) or (row_start >= row_stop):
+                continue
+            
+            data = _read_bands(src, band, Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+            part = (Ellipsis, slice(row_start - row_off, row_stop - row_off), slice(col_start - col_off, col_stop - col_off))
+            
+            #only fill the cells that are not yet filled by a previous raster
+            fill_mask = ~filled[part]
+            if src.nodata is not None:
+                fill_mask &= ~is_nodata(data, src.nodata)
+            array[part][fill_mask] = data[fill_mask]
+            filled[part] |= fill_mask
+    
+    return np.ma.MaskedArray(array, mask=~filled), affine, nodata
+
+
+def read_mosaic_around_geometry(geometry, raster_file_list, band=1):
+    """ This function reads the values around the geometry from one or multiple (adjacent) rasters into one array.
+        The rasters must have the same grid (crs and resolution), the grid of the first raster is used. Where the
+        rasters overlap, the first valid value is used. Parts that are not covered by any raster are nodata.
+        
+        Return: the masked array (see read_mosaic_window()), the affine transform of the array and the nodata value. """
+    
+    if isinstance(raster_file_list, str): #if there is one tif file
+        raster_file_list = [raster_file_list]
+    with open_raster(raster_file_list[0]) as src:
+        window = geometry_window(src, geometry)
+    return read_mosaic_window(raster_file_list, window, band=band)
+
+#%% Shared windows
+
+# The stations of a partition (see get_all_meta_data.compute_metadata_parallel()) are close to each other, and the 
+# height, SVF and landuse computations read (overlapping) windows of the same tiles around them. While a shared region 
+# is set, the part of a tile around the locations of the region is read once, at the first read of that tile, and the 
+# window reads that fall in it are sliced from memory. Parts that are larger than max_mb are not kept, these tiles are
+# read window by window.
+shared_window_settings = {
+    'max_mb': 256 #max size of the part of a tile (per band) that is kept in memory
+    }
+
+_shared_region = {'lats': None, 'lons': None, 'margin': 0., 'windows': {}} # windows: (path, band) --> (row, col, array) or None
+
+
+def set_shared_region(lats, lons, margin):
+    """ Set the locations (latlon) of a shared region: the part of each tile within margin (in meter) of the locations
+        is read once and shared by the window reads (see read_window(), read_mosaic_window() and sample_points()). 
+        Use clear_shared_region() to release the memory. """
+    
+    _shared_region['lats'] = np.atleast_1d(np.asarray(lats, dtype=float))
+    _shared_region['lons'] = np.atleast_1d(np.asarray(lons, dtype=float))
+    _shared_region['margin'] = float(margin)
+    _shared_region['windows'] = {}
+
+
+def clear_shared_region():
+    """ Release the windows of the shared region (see set_shared_region()), the next reads go to the files. """
+    
+    _shared_region['lats'] = None
+    _shared_region['lons'] = None
+    _shared_region['windows'] = {}
+
+
+def _shared_window(src, band):
+    #the part of the tile around the shared region (read at the first call), None if it is not kept
+    key = (src.name, band)
+    if key not in _shared_region['windows']:
+        _shared_region['windows'][key] = None
+        if src.crs.is_geographic: #the margin is in meter
+            return None
+        xs, ys = latlon_to_xy(_shared_region['lats'], _shared_region['lons'], src.crs)
+        pad = _shared_region['margin'] + 3 * abs(src.transform.a)
+        row_start, row_stop, col_start, col_stop = bounds_cells((xs.min() - pad, ys.min() - pad, xs.max() + pad, ys.max() + pad),
+                                                                src.transform)
+        row_start, row_stop = max(row_start, 0), min(row_stop, src.height)
+        col_start, col_stop = max(col_start, 0), min(col_stop, src.width)
+        size_mb = (row_stop - row_start) * (col_stop - col_start) * np.dtype(src.dtypes[band - 1]).itemsize / 1024**2
+        if (row_start < row_stop) & (col_start < col_stop) & (size_mb <= shared_window_settings['max_mb']):
+            array = src.read(band, window=Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+            _shared_region['windows'][key] = (row_start, col_start, array)
+    return _shared_region['windows'][key]
+
+
+def _read_bands(src, band, window):
+    #src.read(band, window=window) of a window inside the raster, sliced from the shared windows if they contain it
+    if _shared_region['lats'] is not None:
+        bands = [int(band)] if np.isscalar(band) else [int(b) for b in band]
+        row_start, col_start = int(window.row_off), int(window.col_off)
+        row_stop, col_stop = row_start + int(window.height), col_start + int(window.width)
+        arrays = []
+        for b in bands:
+            shared = _shared_window(src, b)
+            if shared is None:
+                break
+            shared_row, shared_col, shared_array = shared
+            if ((row_start < shared_row) | (col_start < shared_col) | 
+                (row_stop > shared_row + shared_array.shape[0]) | (col_stop > shared_col + shared_array.shape[1])):
+                break
+            arrays.append(shared_array[row_start - shared_row: row_stop - shared_row, col_start - shared_col: col_stop - shared_col])
+        else:
+            return arrays[0].copy() if np.isscalar(band) else np.stack(arrays)
+    return src.read(band, window=window)
+
+
+
+#%% Raster tile catalog
+
+# The tile catalog holds the meta info (bounds, crs, resolution, dtype, nodata) of each raster file in a list of
+# rasters (i.e. the tiles in the DEM or BBK folder), together with an R-tree over the tile footprints. Finding the tiles
+# that touch a geometry is a query on the R-tree, no raster file has to be opened. The tile info can be stored in a
+# json file (see set_tile_catalog_file()) so the raster headers are only read once.
+tile_catalog_settings = {
+    'catalog_file': None #json file to store the tile info, None to keep the catalog in memory only
+    }
+
+_tile_catalogs = {} # tuple of raster files --> catalog
+
+
+def set_tile_catalog_file(catalog_file):
+    """ Set the json file where the tile info of the raster files is stored. """
+    
+    tile_catalog_settings['catalog_file'] = catalog_file
+
+
+def clear_tile_catalogs():
+    """ Remove all the tile catalogs from memory (i.e. when raster files are added or updated). """
+    
+    _tile_catalogs.clear()
+
+
+def _file_signature(raster_file):
+    try:
+        stat = os.stat(raster_file)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError: #not a local file
+        return None, None
+
+
+def _read_tile_info(raster_file):
+    mtime, size = _file_signature(raster_file)
+    with open_raster(raster_file) as src:
+        return {'mtime': mtime,
+                'size': size,
+                'bounds': list(src.bounds),
+                'crs': src.crs.to_wkt() if src.crs is not None else None,
+                'resolution': list(src.res),
+                'dtype': src.dtypes[0],
+                'nodata': src.nodata,
+                'bands': src.count,
+                'layout': raster_layout(src)}
+
+
+def _load_tile_info_file(catalog_file):
+    if (catalog_file is None) or (not os.path.isfile(catalog_file)):
+        return {}
+    try:
+        with open(catalog_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print('The tile catalog file ', catalog_file, ' could not be read, the tile info will be recomputed.')
+        return {}
+
+
+def get_tile_catalog(raster_file_list):
+    """ This function returns the tile catalog of a (list of) raster file(s). The catalog is a dictionary with:
+            * tiles: list of the raster files
+            * info: list of dicts with the bounds, crs, resolution, dtype, nodata, number of bands and storage layout 
+              (see raster_layout()) for each tile
+            * bounds: numpy array (n_tiles x 4) with the bounds (left, bottom, right, top) of the tiles
+            * crs: the rasterio CRS of the first tile
+            * index: R-tree on the bounds of the tiles
+        
+        The catalog is computed only once per list of files (and reused from the catalog file if it is set). """
+    
+    if isinstance(raster_file_list, str): #if there is one tif file
+        raster_file_list = [raster_file_list]
+    key = tuple(raster_file_list)
+    if key in _tile_catalogs:
+        return _tile_catalogs[key]
+    
+    catalog_file = tile_catalog_settings['catalog_file']
+    stored_info = _load_tile_info_file(catalog_file)
+    
+    info_list = []
+    updated = False
+    for raster_file in raster_file_list:
+        info = stored_info.get(os.path.abspath(raster_file))
+        mtime, size = _file_signature(raster_file)
+        if (info is None) or (info['mtime'] != mtime) or (info['size'] != size) or (not 'layout' in info): #new or changed file (or an old catalog)
+            info = _read_tile_info(raster_file)
+            stored_info[os.path.abspath(raster_file)] = info
+            updated = True
+        info_list.append(info)
+    
+    if updated and (catalog_file is not None):
+        #write and rename, so other processes never read a half written file
+        tmp_file = catalog_file + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(stored_info, f, indent=1)
+        os.replace(tmp_file, catalog_file)
+    
+    bounds = np.array([info['bounds'] for info in info_list], dtype=float).reshape(-1, 4)
+    tree = rtree_index.Index()
+    for i, tile_bounds in enumerate(bounds):
+        tree.insert(i, tuple(tile_bounds))
+    
+    catalog = {'tiles': list(raster_file_list),
+               'info': info_list,
+               'bounds': bounds,
+               'crs': CRS.from_wkt(info_list[0]['crs']) if info_list[0]['crs'] is not None else None,
+               'index': tree}
+    _tile_catalogs[key] = catalog
+    return catalog
+
+
+def find_tiles(geometry, raster_file_list):
+    """ This function returns the tiles (raster files) that touch the geometry, using the tile catalog. 
+            * If geometry type is a point, a list of the files that contain the point is returned.
+            * If geometry type is a polygon, a list of (file, 'fully_contained' or 'partially') tuples is returned.
+        """
+    
+    catalog = get_tile_catalog(raster_file_list)
+    hits = sorted(catalog['index'].intersection(geometry.bounds)) #sorted to keep the order of the raster file list
+    
+    if geometry.geom_type == 'Point':
+        found = []
+        for i in hits:
+            left, bottom, right, top = catalog['bounds'][i]
+            if ((geometry.x < right) & (geometry.x > left) & (geometry.y > bottom) & (geometry.y < top)):
+                found.append(catalog['tiles'][i])
+        return found
+    
+    minx, miny, maxx, maxy = geometry.bounds
+    found = []
+    for i in hits:
+        left, bottom, right, top = catalog['bounds'][i]
+        if (left <= minx) & (bottom <= miny) & (right >= maxx) & (top >= maxy): #geometry fully in raster
+            found.append((catalog['tiles'][i], 'fully_contained'))
+        elif box(left, bottom, right, top).intersects(geometry): #part of geometry in raster
+            found.append((catalog['tiles'][i], 'partially'))
+    return found
+
+
+def tile_footprint(raster_file_list):
+    """ This function returns the footprint of the map: the (prepared) union of the bounds of all the tiles. The
+        footprint is computed once and kept in the tile catalog. Nodata cells inside the tiles are not excluded. """
+    
+    catalog = get_tile_catalog(raster_file_list)
+    if 'footprint' not in catalog:
+        catalog['footprint'] = prep(unary_union([box(*tile_bounds) for tile_bounds in catalog['bounds']]))
+    return catalog['footprint']
+
+
+def buffers_covered(xs, ys, radii, raster_file_list):
+    """ This function checks if the circular buffers around the points are fully covered by the tiles of the map.
+    
+        Keyword arguments: \n
+            xs, ys -- coordinates of the points (in the crs of the map) \n
+            radii -- list of buffer radii (in the units of the crs) \n
+            raster_file_list -- the tif file(s) of the map \n
+        
+        Return: boolean array (n_points x n_radii), True if the buffer lies inside the footprint of the map. """
+    
+    catalog = get_tile_catalog(raster_file_list)
+    xs = np.asarray(xs, dtype=float)[:, np.newaxis]
+    ys = np.asarray(ys, dtype=float)[:, np.newaxis]
+    radii = np.asarray(radii, dtype=float)[np.newaxis, :]
+    covered = np.zeros((xs.shape[0], radii.shape[1]), dtype=bool)
+    
+    #fast check: the square around the buffer lies in one tile
+    for left, bottom, right, top in catalog['bounds']:
+        covered |= ((xs - radii >= left) & (xs + radii <= right) & (ys - radii >= bottom) & (ys + radii <= top))
+    
+    #the other buffers are compared with the union of the tiles (buffers over the edge of two or more tiles)
+    footprint = None
+    for i, j in zip(*np.nonzero(~covered)):
+        buffer_square = (xs[i, 0] - radii[0, j], ys[i, 0] - radii[0, j], xs[i, 0] + radii[0, j], ys[i, 0] + radii[0, j])
+        if not list(catalog['index'].intersection(buffer_square)): #no tile near the point
+            continue
+        if footprint is None:
+            footprint = tile_footprint(raster_file_list)
+        covered[i, j] = footprint.contains(Point(xs[i, 0], ys[i, 0]).buffer(radii[0, j]))
+    return covered
+
+#%% Zonal statistics cache
+
+# The same buffers (station x radius x map) are asked by the meta data script, the dashboard and notebooks. The results
+# of ULTIMATE_read_from_rasterfile() for polygons (class counts or the cropped array) are stored in a SQLite file, keyed
+# by the identity (path, size, mtime) of the raster files that are read, a hash of the geometry (WKB) and the options.
+# The least recently used results are removed when the cache is larger than max_bytes.
+zonal_cache_settings = {
+    'cache_file': None, #None: no caching
+    'max_bytes': 1024 * 1024**2
+    }
+
+_zonal_cache_counters = {'hits': 0, 'misses': 0} #of this process
+_zonal_cache_connections = {} # cache file --> sqlite3 connection
+_zonal_cache_lock = threading.Lock()
+
+
+def _reset_zonal_cache_after_fork():
+    #the connections (and the lock) of the parent process can not be used in a forked (worker) process
+    global _zonal_cache_lock
+    _zonal_cache_lock = threading.Lock()
+    _zonal_cache_connections.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_zonal_cache_after_fork)
+
+
+def set_zonal_cache(cache_file, max_bytes=None):
+    """ Set the SQLite file where the zonal statistics are cached (None to disable the cache), and optionally the max 
+        size of the cache in bytes. """
+    
+    zonal_cache_settings['cache_file'] = cache_file
+    if max_bytes is not None:
+        zonal_cache_settings['max_bytes'] = int(max_bytes)
+
+
+def _zonal_cache_connection(cache_file):
+    #open (and create) the cache file once
+    if cache_file not in _zonal_cache_connections:
+        connection = sqlite3.connect(cache_file, timeout=60, check_same_thread=False) #wait for the other processes
+        connection.execute("""CREATE TABLE IF NOT EXISTS zonal_stats (
+                                  key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_access REAL)""")
+        connection.commit()
+        _zonal_cache_connections[cache_file] = connection
+    return _zonal_cache_connections[cache_file]
+
+
+def zonal_cache_key(geometry, raster_file_list, options):
+    """ This function returns the key of a zonal statistic: a hash of the identity of the raster files (path, size and
+        modification time), the geometry (WKB) and the options (dict). """
+    
+    key = hashlib.sha1()
+    for raster_file in raster_file_list:
+        key.update(repr((os.path.abspath(raster_file), _file_signature(raster_file))).encode())
+    key.update(hashlib.sha1(geometry.wkb).digest())
+    key.update(json.dumps(options, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def _zonal_cache_lookup(key):
+    #the cached value, or None
+    cache_file = zonal_cache_settings['cache_file']
+    with _zonal_cache_lock:
+        connection = _zonal_cache_connection(cache_file)
+        row = connection.execute("SELECT value FROM zonal_stats WHERE key=?", (key,)).fetchone()
+        if row is None:
+            _zonal_cache_counters['misses'] += 1
+            return None
+        _zonal_cache_counters['hits'] += 1
+        connection.execute("UPDATE zonal_stats SET last_access=? WHERE key=?", (time.time(), key))
+        connection.commit()
+    return pickle.loads(row[0])
+
+
+def _zonal_cache_store(key, value):
+    #store the value and remove the least recently used values if the cache is too large
+    cache_file = zonal_cache_settings['cache_file']
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    with _zonal_cache_lock:
+        connection = _zonal_cache_connection(cache_file)
+        connection.execute("INSERT OR REPLACE INTO zonal_stats VALUES (?, ?, ?, ?)", (key, sqlite3.Binary(blob), len(blob), time.time()))
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM zonal_stats").fetchone()[0]
+        if total_size > zonal_cache_settings['max_bytes']:
+            evict = []
+            for old_key, size in connection.execute("SELECT key, size FROM zonal_stats ORDER BY last_access"):
+                if total_size <= zonal_cache_settings['max_bytes']:
+                    break
+                evict.append((old_key,))
+                total_size -= size
+            connection.executemany("DELETE FROM zonal_stats WHERE key=?", evict)
+        connection.commit()
+
+
+def zonal_cache_stats():
+    """ This function returns the number of cache hits and misses (of this process) and the number of entries and the
+        size (in bytes) of the zonal statistics cache. """
+    
+    stats = dict(_zonal_cache_counters)
+    stats['entries'], stats['bytes'] = 0, 0
+    cache_file = zonal_cache_settings['cache_file']
+    if cache_file is not None:
+        with _zonal_cache_lock:
+            stats['entries'], stats['bytes'] = _zonal_cache_connection(cache_file).execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM zonal_stats").fetchone()
+    return stats
+
+
+def clear_zonal_cache():
+    """ Remove all the values from the zonal statistics cache and reset the hit and miss counters. """
+    
+    _zonal_cache_counters['hits'], _zonal_cache_counters['misses'] = 0, 0
+    cache_file = zonal_cache_settings['cache_file']
+    if cache_file is not None:
+        with _zonal_cache_lock:
+            connection = _zonal_cache_connection(cache_file)
+            connection.execute("DELETE FROM zonal_stats")
+            connection.commit()
+
+
+def close_zonal_caches():
+    """ Close all the open zonal statistics cache files. """
+    
+    with _zonal_cache_lock:
+        while _zonal_cache_connections:
+            _cache_file, connection = _zonal_cache_connections.popitem()
+            connection.close()
+
+#%% Buffer stencils
+
+# For a circular buffer on a raster, the cells that are touched (all_touched=True) are the same for each buffer with 
+# the same radius and resolution, up to the sub-cell position of the center. A stencil is the (cached) set of cells
+# around the center cell that are always touched, and the ring of cells for which it depends on the sub-cell position.
+# Only the ring cells have to be evaluated for each buffer: they are taken from the rasterization of the buffer polygon 
+# by GDAL on the mini raster of rasterstats, so the edge cases of all_touched (cells that the polygon only just touches)
+# are the same as in rasterstats.
+
+_disk_stencil_cache = {} # (radius, resolution, quad_segs) --> stencil
+
+
+def _disk_stencil(radius, resolution, quad_segs=30):
+    key = (float(radius), float(resolution), int(quad_segs))
+    if key in _disk_stencil_cache:
+        return _disk_stencil_cache[key]
+    
+    half_size = int(math.ceil(float(radius) / resolution)) + 1 #number of cells from the center cell to the edge
+    offsets = np.arange(-half_size, half_size + 1)
+    #smallest and largest distance (in cells) from the center (anywhere in the center cell) to a cell
+    nearest = np.maximum(np.abs(offsets) - 1, 0).astype(float)
+    farthest = np.abs(offsets).astype(float)
+    
+    radius_cells = float(radius) / resolution
+    #the polygon of the buffer (shapely) is inscribed in the circle, so the cells inside the inscribed circle are always in.
+    inner_radius_cells = radius_cells * math.cos(math.pi / (4 * quad_segs))
+    always_in = (farthest[:, None]**2 + farthest[None, :]**2) < inner_radius_cells**2
+    maybe_in = (nearest[:, None]**2 + nearest[None, :]**2) <= radius_cells**2
+    ring_rows, ring_cols = np.nonzero(maybe_in & ~always_in)
+    
+    stencil = {'half_size': half_size,
+               'always_in': always_in,
+               'ring_rows': ring_rows,
+               'ring_cols': ring_cols}
+    _disk_stencil_cache[key] = stencil
+    return stencil
+
+
+def disk_mask(x, y, radius, affine, quad_segs=30):
+    """ This function returns the boolean mask of the cells that are touched by a circular buffer (all_touched=True) of 
+        the given radius around the point (x, y). The mask is a (2n+1 x 2n+1) square around the cell that contains 
+        the point; the row and column of the upper left cell of the mask (in the grid of the affine) are returned as well. 
+        The buffer is the same polygon as buffer(radius, resolution=quad_segs) in shapely and the cells on the edge of
+        the polygon are rasterized on the same cells as rasterstats, so the mask is identical to the cells rasterstats 
+        uses with all_touched=True. """
+    
+    resolution = affine.a
+    stencil = _disk_stencil(radius, resolution, quad_segs)
+    n = stencil['half_size']
+    col_f, row_f = ~affine * (x, y)
+    center_row, center_col = int(math.floor(row_f)), int(math.floor(col_f))
+    
+    #the ring cells: rasterize the buffer polygon on the mini raster of rasterstats
+    buffer_polygon = Point(x, y).buffer(float(radius), resolution=quad_segs)
+    row_start, row_stop, col_start, col_stop = bounds_cells(buffer_polygon.bounds, affine)
+    touched = geometry_mask([buffer_polygon], out_shape=(row_stop - row_start, col_stop - col_start), 
+                            transform=affine * rasterio.Affine.translation(col_start, row_start), all_touched=True, invert=True)
+    rows = center_row - n + stencil['ring_rows'] - row_start
+    cols = center_col - n + stencil['ring_cols'] - col_start
+    in_bounds = (rows >= 0) & (rows < touched.shape[0]) & (cols >= 0) & (cols < touched.shape[1])
+    
+    mask = stencil['always_in'].copy()
+    mask[stencil['ring_rows'][in_bounds], stencil['ring_cols'][in_bounds]] = touched[rows[in_bounds], cols[in_bounds]]
+    return mask, center_row - n, center_col - n
+
+
+def read_disk_window(x, y, radius, raster_file_list, band=1):
+    """ This function reads the window (from all the tiles that touch it) around a circular buffer with the given radius 
+        around the point (x, y). All the buffers with a smaller radius around the same point are in this window.
+        If band is a list of bands, all the bands are read at once (array of bands x rows x columns).
+        
+        Return: (array, affine transform, nodata) or None if no raster touches the buffer. """
+    
+    search_box = box(x - radius, y - radius, x + radius, y + radius)
+    maps_to_use = [raster_file for raster_file, _info in find_tiles(search_box, raster_file_list)]
+    if not bool(maps_to_use):
+        return None
+    resolution = get_tile_catalog(raster_file_list)['info'][0]['resolution'][0]
+    pad = 2 * resolution
+    return read_mosaic_around_geometry(box(x - radius - pad, y - radius - pad, x + radius + pad, y + radius + pad),
+                                       maps_to_use, band=band)
+
+
+def disk_values(local_window, x, y, radius):
+    """ This function returns the valid (no nodata) raster values of the cells in the window (see read_disk_window)
+        that are touched by the circular buffer with the given radius around the point (x, y). """
+    
+    local_array, local_affine, local_nodata = local_window
+    mask, row_off, col_off = disk_mask(x, y, radius, local_affine)
+    cells = (slice(row_off, row_off + mask.shape[0]), slice(col_off, col_off + mask.shape[1]))
+    values = np.ma.getdata(local_array)[cells][mask]
+    values = values[~np.ma.getmaskarray(local_array)[cells][mask]] #not covered by the rasters
+    if local_nodata is not None:
+        values = values[~is_nodata(values, local_nodata)]
+    return values
+
+
+def disk_band_sums(local_window, x, y, radius):
+    """ This function returns the sum of the valid (no nodata) values of each band in the window (see read_disk_window 
+        with a list of bands) of the cells that are touched by the circular buffer with the given radius around the 
+        point (x, y).
+        
+        Return: numpy array with a sum for each band. """
+    
+    local_array, local_affine, local_nodata = local_window
+    mask, row_off, col_off = disk_mask(x, y, radius, local_affine)
+    cells = (Ellipsis, slice(row_off, row_off + mask.shape[0]), slice(col_off, col_off + mask.shape[1]))
+    values = np.ma.getdata(local_array)[cells][..., mask]
+    values = values.reshape(-1, values.shape[-1]).astype(np.float64) #bands x cells
+    values[np.ma.getmaskarray(local_array)[cells][..., mask].reshape(values.shape)] = 0.0 #not covered by the rasters
+    if local_nodata is not None:
+        values[is_nodata(values, local_nodata)] = 0.0
+    return values.sum(axis=1)
+
+
+def _is_integer_codes(values):
+    return (values.dtype.kind in 'ui') and ((values.size == 0) or (values.min() >= 0))
+
+
+def disk_class_counts(x, y, radius, raster_file_list, none_if_no_overlap=False):
+    """ This function returns the frequency table of the (categorical) raster values in a circular buffer around the
+        point (x, y) (in the crs of the rasters), using a stencil. The result is the same as 
+        ULTIMATE_read_from_rasterfile(circular buffer, raster_file_list, return_counts=True) but only one window is read
+        and no polygon has to be rasterized. 
+        
+        Return: a dataframe with the columns 'counts' and 'category'. """
+    
+    local_window = read_disk_window(x, y, radius, raster_file_list)
+    if local_window is None:
+        print('The buffer around x: ', x, '  y: ', y, ' is not contained in these maps: ', raster_file_list)
+        if none_if_no_overlap:
+            return None
+        else:
+            sys.exit()
+    
+    values = disk_values(local_window, x, y, radius)
+    if _is_integer_codes(values):
+        counts = np.bincount(values.astype(np.int64))
+        categories = np.nonzero(counts)[0]
+        counts = counts[categories]
+    else:
+        categories, counts = np.unique(values, return_counts=True)
+    
+    return pd.DataFrame({'counts': counts, 'category': categories})
+
+
+def disk_class_count_cube(xs, ys, radii, raster_file_list, categories):
+    """ This function returns the cell counts of the categories in circular buffers with multiple radii around many 
+        points (in the crs of the rasters). For each point the window of the largest buffer is read once, all the 
+        smaller buffers are taken from that same window.
+        
+        Return: numpy array (points x radii x categories) with the counts. The counts of values that are not in 
+        categories are ignored. NaN for the buffers that do not touch any of the rasters. """
+    
+    xs, ys = np.atleast_1d(np.asarray(xs, dtype=float)), np.atleast_1d(np.asarray(ys, dtype=float))
+    categories = np.asarray(categories)
+    cube = np.full((len(xs), len(radii), len(categories)), np.nan)
+    max_radius = max(radii)
+    
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        local_window = read_disk_window(x, y, max_radius, raster_file_list)
+        if local_window is None:
+            continue
+        for j, radius in enumerate(radii):
+            if (radius < max_radius) and (not bool(find_tiles(box(x - radius, y - radius, x + radius, y + radius),
+                                                              raster_file_list))):
+                continue
+            cube[i, j, :] = aligned_class_counts(disk_values(local_window, x, y, radius), categories)
+    return cube
+
+
+def disk_band_sum_cube(xs, ys, radii, raster_file_list, bands):
+    """ This function returns the sums of the values of multiple bands (i.e. the class layers of a stacked raster, see
+        stack_raster_bands()) in circular buffers with multiple radii around many points (in the crs of the rasters). 
+        For each point all the bands of the window of the largest buffer are read at once, all the smaller buffers are
+        taken from that same window.
+        
+        Return: numpy array (points x radii x bands) with the sums. NaN for the buffers that do not touch any of the 
+        rasters. """
+    
+    xs, ys = np.atleast_1d(np.asarray(xs, dtype=float)), np.atleast_1d(np.asarray(ys, dtype=float))
+    bands = list(bands)
+    cube = np.full((len(xs), len(radii), len(bands)), np.nan)
+    max_radius = max(radii)
+    
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        local_window = read_disk_window(x, y, max_radius, raster_file_list, band=bands)
+        if local_window is None:
+            continue
+        for j, radius in enumerate(radii):
+            if (radius < max_radius) and (not bool(find_tiles(box(x - radius, y - radius, x + radius, y + radius),
+                                                              raster_file_list))):
+                continue
+            cube[i, j, :] = disk_band_sums(local_window, x, y, radius)
+    return cube
+
+
+#%% Zonal statistics
+
+# Native zonal statistics of a polygon on a window read (instead of rasterstats with raster_out=True): the polygon is
+# rasterized with rasterio.features.geometry_mask on the same cells as rasterstats (the window that covers the bounds
+# of the polygon) and the classes are counted with np.bincount.
+
+def aligned_class_counts(values, categories):
+    """ This function returns the counts of the categories in the values (numpy array, in the order of categories). The
+        values that are not in categories are ignored. """
+    
+    categories = np.asarray(categories)
+    if _is_integer_codes(values) and _is_integer_codes(categories):
+        counts = np.bincount(values.astype(np.int64), minlength=int(categories.max()) + 1)
+        return counts[categories.astype(np.int64)]
+    uniques, counts = np.unique(values, return_counts=True)
+    count_map = dict(zip(uniques, counts))
+    return np.array([count_map.get(category, 0) for category in categories], dtype=np.int64)
+
+
+def bounds_cells(bounds, affine):
+    """ This function returns the rows and columns (row_start, row_stop, col_start, col_stop) of the cells in the grid 
+        of the affine that cover the bounds (west, south, east, north), as the mini raster of rasterstats. """
+    
+    west, south, east, north = bounds
+    row_start = int(math.floor((north - affine.f) / affine.e))
+    col_start = int(math.floor((west - affine.c) / affine.a))
+    row_stop = int(math.ceil((south - affine.f) / affine.e))
+    col_stop = int(math.ceil((east - affine.c) / affine.a))
+    return row_start, row_stop, col_start, col_stop
+
+
+def zonal_values(geometry, local_window, all_touched=True):
+    """ This function returns the values of the cells of the window (array, affine transform, nodata, see 
+        read_mosaic_around_geometry()) that are touched by the polygon.
+        
+        Return: a masked array on the cells that cover the bounds of the polygon (as the mini raster of rasterstats), 
+        the cells outside the polygon and the nodata cells are masked. For a window of multiple bands the masked array
+        is (bands x rows x columns). """
+    
+    local_array, local_affine, local_nodata = local_window
+    row_start, row_stop, col_start, col_stop = bounds_cells(geometry.bounds, local_affine)
+    
+    #cells of the bounds that are outside the window (or not covered by the rasters) are masked
+    fill_value = local_nodata if local_nodata is not None else 0
+    array = np.full(local_array.shape[:-2] + (row_stop - row_start, col_stop - col_start), fill_value, dtype=local_array.dtype)
+    rows = slice(max(row_start, 0), min(row_stop, local_array.shape[-2]))
+    cols = slice(max(col_start, 0), min(col_stop, local_array.shape[-1]))
+    part = (Ellipsis, slice(rows.start - row_start, rows.stop - row_start), slice(cols.start - col_start, cols.stop - col_start))
+    array[part] = np.ma.getdata(local_array)[..., rows, cols]
+    outside = np.ones(array.shape, dtype=bool)
+    outside[part] = np.ma.getmaskarray(local_array)[..., rows, cols]
+    
+    affine = local_affine * rasterio.Affine.translation(col_start, row_start)
+    inside = geometry_mask([geometry], out_shape=array.shape[-2:], transform=affine, all_touched=all_touched, invert=True)
+    nodata = outside if local_nodata is None else (outside | is_nodata(array, local_nodata))
+    if array.dtype.kind == 'f':
+        nodata |= np.isnan(array)
+    return np.ma.MaskedArray(array, mask=(nodata | ~inside))
+
+
+def zonal_class_counts(geometry, raster_file_list, categories, all_touched=True):
+    """ This function returns the counts of the categories (i.e. the keys of the mapper of a map in the raster_dict) 
+        in the cells that are touched by the polygon, as one window read of the tiles that touch it.
+        
+        Return: numpy array with the counts, in the order of categories. None if the polygon is outside all the 
+        rasters. """
+    
+    maps_to_use = [raster_file for raster_file, _info in find_tiles(geometry, raster_file_list)]
+    if not bool(maps_to_use):
+        return None
+    values = zonal_values(geometry, read_mosaic_around_geometry(geometry, maps_to_use), all_touched=all_touched)
+    return aligned_class_counts(values.compressed(), categories)
+
+
+#%% Coordinate transformations and geometries
+
+# Creating a pyproj Transformer (CRS parsing and the search of the transformation) takes much longer than transforming
+# thousands of coordinates, so the transformers are created once per (source, target) crs and thread (the pyproj
+# transformers are not thread safe).
+_transformers = threading.local()
+
+
+def _reset_transformers_after_fork():
+    global _transformers
+    _transformers = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_transformers_after_fork)
+
+
+def _crs_key(crs):
+    #a hashable key of a crs (string, rasterio or pyproj CRS)
+    if isinstance(crs, str):
+        return crs.upper()
+    return crs.to_wkt()
+
+
+def get_transformer(src_crs, dst_crs):
+    """ This function returns a (cached) pyproj Transformer from src_crs to dst_crs, with x/lon as the first 
+        coordinate. """
+    
+    if not hasattr(_transformers, 'cache'):
+        _transformers.cache = {}
+    key = (_crs_key(src_crs), _crs_key(dst_crs))
+    if key not in _transformers.cache:
+        _transformers.cache[key] = Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+    return _transformers.cache[key]
+
+
+def latlon_to_xy(lats, lons, crs):
+    """ This function reprojects arrays of latlon coordinates to the given crs (all at once). 
+        
+        Return: two numpy arrays with the x and y coordinates. """
+    
+    xs, ys = get_transformer('EPSG:4326', crs).transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    return np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+
+
+def _geometry_array(geometries, shape):
+    #object array of shapely geometries, filled one by one (numpy would unpack the coordinates of shapely 1.x geometries)
+    array = np.empty(int(np.prod(shape)), dtype=object)
+    for i, geometry in enumerate(geometries):
+        array[i] = geometry
+    return array.reshape(shape)
+
+
+def point_geometries(lats, lons, crs):
+    """ This function returns a numpy array of shapely points (in the given crs) of arrays of latlon coordinates. """
+    
+    xs, ys = latlon_to_xy(np.atleast_1d(lats), np.atleast_1d(lons), crs)
+    if hasattr(shapely, 'points'): #shapely >= 2.0, vectorized
+        return shapely.points(xs, ys)
+    return _geometry_array((Point(x, y) for x, y in zip(xs, ys)), len(xs))
+
+
+def buffer_geometries(lats, lons, radii, crs, shape='circle', resolution=30):
+    """ This function returns the buffer geometries of all the locations and buffer radii at once.
+        
+        Keyword arguments: \n
+            lats, lons -- arrays of latlon coordinates \n
+            radii -- list of buffer radii (in the units of the crs, meter) \n
+            crs -- the crs of the geometries \n
+            shape -- 'circle' (as coordinate_to_circular_buffer_geometry()) or 'square' (a box of 2 x radius) \n
+            resolution -- number of segments of a quarter circle \n
+        
+        Return: numpy array (n_locations x n_radii) of shapely polygons. """
+    
+    xs, ys = latlon_to_xy(np.atleast_1d(lats), np.atleast_1d(lons), crs)
+    xs, ys = xs[:, np.newaxis], ys[:, np.newaxis]
+    radii = np.asarray(radii, dtype=float)[np.newaxis, :]
+    
+    if shape == 'square':
+        if hasattr(shapely, 'box'): #shapely >= 2.0, vectorized
+            return shapely.box(xs - radii, ys - radii, xs + radii, ys + radii)
+        return _geometry_array((box(x - r, y - r, x + r, y + r) for x, y in zip(xs[:, 0], ys[:, 0]) for r in radii[0]),
+                               (xs.shape[0], radii.shape[1]))
+    if shape != 'circle':
+        print('Buffer shape ', shape, ' is not known, use circle or square.')
+        sys.exit()
+    if hasattr(shapely, 'buffer'): #shapely >= 2.0, vectorized
+        return shapely.buffer(shapely.points(xs, ys), radii, quad_segs=resolution)
+    return _geometry_array((Point(x, y).buffer(r, resolution) for x, y in zip(xs[:, 0], ys[:, 0]) for r in radii[0]),
+                           (xs.shape[0], radii.shape[1]))
+
+
+def rectangle_geometries(lats_1, lats_2, lons_1, lons_2, crs):
+    """ This function returns a numpy array of shapely rectangles (in the given crs) from arrays of two latlon corners,
+        as coordinates_to_rectangel_geometry() for many rectangles at once. """
+    
+    xs_1, ys_1 = latlon_to_xy(np.atleast_1d(lats_1), np.atleast_1d(lons_1), crs)
+    xs_2, ys_2 = latlon_to_xy(np.atleast_1d(lats_2), np.atleast_1d(lons_2), crs)
+    bounds = (np.minimum(xs_1, xs_2), np.minimum(ys_1, ys_2), np.maximum(xs_1, xs_2), np.maximum(ys_1, ys_2))
+    if hasattr(shapely, 'box'): #shapely >= 2.0, vectorized
+        return shapely.box(*bounds)
+    return _geometry_array((box(*rectangle) for rectangle in zip(*bounds)), len(bounds[0]))
+
+#%% Integral images (summed-area tables)
+
+# For a categorical raster, a summed-area table per class holds for each cell the number of cells of that class above
+# and left of it. The class counts in any rectangle of cells are then 4 lookups, independent of the rectangle size.
+# The tables are computed in chunks of rows and stored as memory-mapped .npy files (one per class) in a folder,
+# together with a json file with the grid info.
+
+_integral_images = {} # (raster file, folder) --> loaded integral images
+
+
+def _integral_image_names(raster_file, out_folder):
+    name = os.path.splitext(os.path.basename(raster_file))[0]
+    return (os.path.join(out_folder, name + '_integral.json'),
+            lambda category: os.path.join(out_folder, name + '_integral_class_' + str(category) + '.npy'))
+
+
+def build_class_integral_images(raster_file, out_folder, categories, chunk_rows=1024):
+    """ This function computes the summed-area table of each category (class code) of a categorical raster file and 
+        stores them in the out_folder. The nodata cells are not counted (also if the nodata value is one of the 
+        categories). The raster is processed in chunks of chunk_rows rows, so the raster is never completely loaded 
+        in memory.
+        
+        Return: the integral images (see load_class_integral_images). """
+    
+    if not os.path.isdir(out_folder):
+        os.makedirs(out_folder)
+    info_file, table_file = _integral_image_names(raster_file, out_folder)
+    with open_raster(raster_file) as src:
+    
+        print('Computing the integral images of ', raster_file, ' ...')
+        tables = {category: np.lib.format.open_memmap(table_file(category), mode='w+', dtype=np.uint32,
+                                                      shape=(src.height + 1, src.width + 1))
+                  for category in categories}
+        for category in categories: #first row and column are zero
+            tables[category][0, :] = 0
+            tables[category][:, 0] = 0
+    
+        for row_start in range(0, src.height, chunk_rows):
+            n_rows = min(chunk_rows, src.height - row_start)
+            block = src.read(1, window=Window(0, row_start, src.width, n_rows))
+            valid = np.ones(block.shape, dtype=bool) if src.nodata is None else ~is_nodata(block, src.nodata)
+            for category in categories:
+                block_table = np.cumsum(np.cumsum((block == category) & valid, axis=1, dtype=np.uint32), axis=0, dtype=np.uint32)
+                tables[category][row_start + 1: row_start + n_rows + 1, 1:] = block_table + tables[category][row_start, 1:]
+    
+        for category in categories:
+            tables[category].flush()
+    
+        mtime, size = _file_signature(raster_file)
+        with open(info_file, 'w') as f:
+            json.dump({'raster_file': os.path.abspath(raster_file),
+                       'mtime': mtime,
+                       'size': size,
+                       'transform': list(src.transform)[:6],
+                       'shape': [src.height, src.width],
+                       'nodata': src.nodata,
+                       'categories': [int(category) for category in categories]}, f, indent=1)
+    
+    _integral_images.pop((raster_file, out_folder), None)
+    return load_class_integral_images(raster_file, out_folder)
+
+
+def load_class_integral_images(raster_file, out_folder):
+    """ This function returns the (memory-mapped) integral images of a raster file, as a dictionary with the 
+        transform, shape, categories and tables (category --> summed-area table). None if the integral images are not 
+        computed or if the raster file is changed after computing them. """
+    
+    key = (raster_file, out_folder)
+    if key in _integral_images:
+        return _integral_images[key]
+    
+    info_file, table_file = _integral_image_names(raster_file, out_folder)
+    if not os.path.isfile(info_file):
+        return None
+    with open(info_file, 'r') as f:
+        info = json.load(f)
+    if ((info['mtime'], info['size']) != _file_signature(raster_file)) or ('nodata' not in info): #older tables count the nodata cells
+        print('The integral images of ', raster_file, ' are outdated.')
+        return None
+    
+    integral = {'transform': rasterio.Affine(*info['transform']),
+                'shape': tuple(info['shape']),
+                'categories': info['categories'],
+                'tables': {category: np.load(table_file(category), mmap_mode='r') for category in info['categories']}}
+    _integral_images[key] = integral
+    return integral
+
+
+def rectangle_class_counts(integral, row_start, row_stop, col_start, col_stop):
+    """ This function returns the class counts in rectangles of cells (rows row_start to row_stop (excluded), 
+        columns col_start to col_stop (excluded)) using the integral images. All the arguments can be arrays (many 
+        rectangles at once), the rectangles are clipped to the raster.
+        
+        Return: numpy array (rectangles x categories) with the counts. """
+    
+    height, width = integral['shape']
+    row_start, row_stop = np.clip(row_start, 0, height), np.clip(row_stop, 0, height)
+    col_start, col_stop = np.clip(col_start, 0, width), np.clip(col_stop, 0, width)
+    row_stop, col_stop = np.maximum(row_stop, row_start), np.maximum(col_stop, col_start)
+    
+    counts = []
+    for category in integral['categories']:
+        table = integral['tables'][category]
+        category_counts = (table[row_stop, col_stop].astype(np.int64) - table[row_start, col_stop].astype(np.int64)
+                           - table[row_stop, col_start].astype(np.int64) + table[row_start, col_start].astype(np.int64))
+        counts.append(np.mod(category_counts, 2**32)) #the tables are uint32 and can overflow on very large rasters
+    return np.stack(counts, axis=-1)
+
+
+def box_class_counts(integral, minx, miny, maxx, maxy):
+    """ This function returns the class counts of the cells that are touched by the axis-aligned rectangles with the 
+        given bounds (in the crs of the raster), with 4 lookups per class. The bounds can be arrays.
+        
+        Return: numpy array (rectangles x categories) with the counts. """
+    
+    inverse = ~integral['transform']
+    col_min, row_min = inverse * (np.asarray(minx, dtype=float), np.asarray(maxy, dtype=float))
+    col_max, row_max = inverse * (np.asarray(maxx, dtype=float), np.asarray(miny, dtype=float))
+    return rectangle_class_counts(integral,
+                                  np.floor(row_min).astype(np.int64), np.ceil(row_max).astype(np.int64),
+                                  np.floor(col_min).astype(np.int64), np.ceil(col_max).astype(np.int64))
+
+
+def square_class_counts(integral, xs, ys, half_size):
+    """ This function returns the class counts of the cells that are touched by the squares (with sides of 
+        2 x half_size) around the points (xs, ys) in the crs of the raster (as point_to_square in find_SVF).
+        
+        Return: numpy array (points x categories) with the counts. """
+    
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    return box_class_counts(integral, xs - half_size, ys - half_size, xs + half_size, ys + half_size)
+
+
+def stacked_disk_class_counts(integral, xs, ys, radius, strip_rows=1):
+    """ This function approximates the class counts in circular buffers around the points (xs, ys) by a stack of 
+        rectangles (horizontal strips of strip_rows rows). With strip_rows=1 the strips contain the cells that are 
+        touched by the (exact) circle; with more rows per strip the widest row of the strip is used (less lookups, 
+        more cells). This is an approximation of disk_class_counts(), which counts the cells touched by the buffer 
+        polygon (inscribed in the circle): at the ends of the rows the counts can differ by a cell.
+        
+        Return: numpy array (points x categories) with the counts. """
+    
+    resolution = integral['transform'].a
+    col_f, row_f = ~integral['transform'] * (np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    center_row = np.floor(row_f).astype(np.int64)
+    frac_row = row_f - center_row
+    radius_cells = float(radius) / resolution
+    n = int(math.ceil(radius_cells)) + 1
+    
+    counts = np.zeros((len(col_f), len(integral['categories'])), dtype=np.int64)
+    for strip_start in range(-n, n + 1, strip_rows):
+        strip_stop = min(strip_start + strip_rows, n + 1)
+        #distance (in cells) from the center to the nearest row of the strip
+        d_row = np.maximum.reduce([strip_start - frac_row, frac_row - strip_stop, np.zeros(len(frac_row))])
+        inside = d_row < radius_cells
+        half_width = np.sqrt(np.maximum(radius_cells**2 - d_row**2, 0.))
+        col_start = np.floor(col_f - half_width).astype(np.int64)
+        col_stop = np.ceil(col_f + half_width).astype(np.int64)
+        strip_counts = rectangle_class_counts(integral, center_row + strip_start, center_row + strip_stop, col_start, col_stop)
+        counts += np.where(inside[:, None], strip_counts, 0)
+    return counts
+
+#%% Cloud optimized GeoTIFF
+
+def overview_levels(width, height, blocksize=512):
+    """ This function returns the overview levels (2, 4, 8, ...) for a raster, until the overview fits in one block. """
+    
+    levels = []
+    level = 2
+    while (max(width, height) / level) >= (blocksize / 2):
+        levels.append(level)
+        level *= 2
+    return levels
+
+
+def raster_layout(src):
+    """ This function returns the storage layout of an (open) raster: the size, if it is internally tiled (or striped), 
+        the block shape (rows, columns), the compression and the overview levels. """
+    
+    block_rows, block_cols = src.block_shapes[0]
+    return {'width': src.width,
+            'height': src.height,
+            'tiled': bool(src.profile.get('tiled', block_cols < src.width)),
+            'block_shape': [block_rows, block_cols],
+            'compress': src.compression.value if src.compression is not None else None,
+            'overviews': src.overviews(1)}
+
+
+def needs_cog(layout, blocksize=512):
+    """ This function returns True if a raster with this layout (see raster_layout()) should be rewritten as a cloud 
+        optimized GeoTIFF: if it is striped (a window read decodes full rows of the raster), uncompressed or 
+        without overviews. Rasters that fit in one block are never rewritten. """
+    
+    if max(layout['width'], layout['height']) <= blocksize:
+        return False
+    if not layout['tiled']:
+        return True
+    if layout['compress'] is None:
+        return True
+    return (len(layout['overviews']) == 0) and (len(overview_levels(layout['width'], layout['height'], blocksize)) > 0)
+
+
+def write_cog(src_file, dst_file, blocksize=512, compress='deflate', resampling='nearest', tmp_folder=None):
+    """ This function writes a copy of a raster as a cloud optimized GeoTIFF: internally tiled (blocksize x blocksize), 
+        compressed and with overviews. Use resampling='nearest' or 'mode' for categorical rasters and 'average' for 
+        continuous rasters. The intermediate files are written in a temporary folder (in tmp_folder, by default the 
+        temporary folder of the system) that is removed afterwards, also if the conversion fails. The dst_file is only
+        replaced when the new file is completely written, so dst_file can be the src_file. """
+    
+    creation_options = {'tiled': True, 'blockxsize': blocksize, 'blockysize': blocksize,
+                        'compress': compress, 'BIGTIFF': 'IF_SAFER'}
+    work_folder = tempfile.mkdtemp(prefix='cog_', dir=tmp_folder)
+    try:
+        tmp_file = os.path.join(work_folder, 'overviews.tif')
+        rasterio.shutil.copy(src_file, tmp_file, driver='GTiff', **creation_options)
+        with rasterio.open(tmp_file, 'r+') as tmp:
+            tmp.build_overviews(overview_levels(tmp.width, tmp.height, blocksize), Resampling[resampling])
+        #copy again, so the overviews are in front of the data (COG layout)
+        cog_file = os.path.join(work_folder, 'cog.tif')
+        rasterio.shutil.copy(tmp_file, cog_file, driver='GTiff', copy_src_overviews=True, **creation_options)
+        try:
+            os.replace(cog_file, dst_file)
+        except OSError: #the temporary folder is on another file system
+            shutil.copyfile(cog_file, dst_file)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+def stack_raster_bands(src_files, dst_file, band_names=None, blocksize=512, compress='deflate', resampling='nearest',
+                       tmp_folder=None):
+    """ This function stacks single band rasters on the same grid (i.e. the class layers of a map) into one multi-band
+        cloud optimized GeoTIFF (see write_cog()), band i+1 is src_files[i]. The bands are stored pixel interleaved, so
+        one window read decodes the same blocks for all the bands. The band_names are stored as band descriptions.
+        The rasters are copied block by block, so they are never completely in memory. """
+
+    srcs = [rasterio.open(src_file) for src_file in src_files]
+    first = srcs[0]
+    for src_file, src in zip(src_files, srcs):
+        if (src.count != 1) or (src.shape != first.shape) or (src.transform != first.transform) or (src.crs != first.crs):
+            print('The raster ', src_file, ' is not a single band raster on the grid of ', src_files[0], '. The rasters can not be stacked.')
+            for open_src in srcs:
+                open_src.close()
+            sys.exit()
+
+    profile = first.profile.copy()
+    profile.update(driver='GTiff', count=len(srcs), dtype=np.result_type(*[src.dtypes[0] for src in srcs]).name,
+                   tiled=True, blockxsize=blocksize, blockysize=blocksize, compress=compress, interleave='pixel',
+                   BIGTIFF='IF_SAFER')
+    work_folder = tempfile.mkdtemp(prefix='stack_', dir=tmp_folder)
+    try:
+        tmp_file = os.path.join(work_folder, 'stack.tif')
+        with rasterio.open(tmp_file, 'w', **profile) as dst:
+            for row_off in range(0, first.height, blocksize):
+                window = Window(0, row_off, first.width, min(blocksize, first.height - row_off))
+                dst.write(np.stack([src.read(1, window=window) for src in srcs]).astype(profile['dtype']), window=window)
+            if band_names is not None:
+                for band, band_name in enumerate(band_names, start=1):
+                    dst.set_band_description(band, str(band_name))
+        write_cog(tmp_file, dst_file, blocksize=blocksize, compress=compress, resampling=resampling, tmp_folder=work_folder)
+    finally:
+        for src in srcs:
+            src.close()
+        shutil.rmtree(work_folder, ignore_errors=True)
+
 #%% Get information functions
 
-def geo_map_info(src):
-    """ This functions prints out some basic info of a geo object """
+def geo_map_info(src, bounds=None, max_size=None):
+    """ This functions prints out some basic info of a geo object. The plot is a preview (see read_preview()), 
+        optionally of a region (i.e. geo_maps_config.gent_region). """
     
     print('MAP INFO')
     print('map mode: ', src.mode)
@@ -51,8 +1301,10 @@ def geo_map_info(src):
     
     y = input('Plot the raster band 1? (y/n): ')
     if y == 'y':
-        plt.imshow(src.read(1), cmap='pink')
-        plt.show()
+        preview, extent = read_preview(src, band=1, bounds=bounds, max_size=max_size)
+        if preview is not None:
+            plt.imshow(preview, cmap='pink', extent=extent)
+            plt.show()
 
 
 def geo_in_domain_of(raster, small_geo):
@@ -85,8 +1337,48 @@ def plot_polygon(geo_map):
         print('format is not a polygon')
 
 
-def plot_raster(raster, raster_info, band = 1):
-    """ This function plots a Georaster using the colormap defined in the config file. """
+def read_preview(raster, band=1, bounds=None, max_size=None, resampling='nearest'):
+    """ This function reads a decimated version of a raster band for plotting, so the memory use and read time do not 
+        depend on the size of the map. The decimated read uses the internal overviews of the raster if it has them.
+        
+        Keyword arguments: \n
+            raster -- an open rasterio DatasetReader \n
+            bounds -- dict
+                        the region to read (xmin, xmax, ymin, ymax in latlon, i.e. geo_maps_config.gent_region), None
+                        for the full raster \n
+            max_size -- int
+                        the max number of cells of the preview along each axis, by default the size (in pixels) of a
+                        matplotlib figure \n
+            resampling -- str
+                        'nearest' for categorical rasters, 'average' for continuous rasters \n
+        
+        Return: the preview array and its extent (left, right, bottom, top) in the crs of the raster. None, None if the
+        region is outside the raster. """
+    
+    if max_size is None: #the pixels of the figure
+        max_size = int(max(plt.rcParams['figure.figsize']) * plt.rcParams['figure.dpi'])
+    
+    window = Window(0, 0, raster.width, raster.height)
+    if bounds is not None:
+        left, bottom, right, top = transform_bounds('EPSG:4326', raster.crs, bounds['xmin'], bounds['ymin'],
+                                                    bounds['xmax'], bounds['ymax'])
+        region_window = from_bounds(left, bottom, right, top, transform=raster.transform).round_offsets().round_lengths()
+        if not rasterio.windows.intersect([region_window, window]):
+            print('The region ', bounds, ' is not in the domain of the raster.')
+            return None, None
+        window = region_window.intersection(window)
+    
+    decimation = max(1, int(math.ceil(max(window.width, window.height) / float(max_size))))
+    out_shape = (int(math.ceil(window.height / decimation)), int(math.ceil(window.width / decimation)))
+    preview = raster.read(band, window=window, out_shape=out_shape, resampling=Resampling[resampling])
+    
+    left, bottom, right, top = rasterio.windows.bounds(window, raster.transform)
+    return preview, (left, right, bottom, top)
+
+
+def plot_raster(raster, raster_info, band = 1, bounds = None, max_size = None):
+    """ This function plots a Georaster using the colormap defined in the config file. A decimated preview is plotted 
+        (see read_preview()), optionally of a region (i.e. geo_maps_config.gent_region). """
     
     if not isinstance(raster, rasterio.io.DatasetReader):
          print('format of the raster is not a DatasetReader!')
@@ -99,7 +1391,10 @@ def plot_raster(raster, raster_info, band = 1):
     norm = matplotlib.colors.BoundaryNorm(boundaries, cmap.N, clip=True)
     
     #plot object
-    plt.imshow(raster.read(band), cmap=cmap, norm = norm, interpolation = None)
+    preview, extent = read_preview(raster, band = band, bounds = bounds, max_size = max_size)
+    if preview is None:
+        return None
+    plt.imshow(preview, cmap=cmap, norm = norm, interpolation = None, extent = extent)
     
     # getting current axes
     a = plt.gca()
@@ -120,15 +1415,88 @@ def plot_raster(raster, raster_info, band = 1):
 
 #%% Create polygon functions
         
+# The country borders shapefile is large (all countries at 10m), so the boundary of a country is extracted once and
+# stored as a small WKB file per (country, crs, simplify tolerance) in the sidecar folder. The sidecar is rebuilt when
+# the shapefile is newer.
+country_boundary_settings = {
+    'shapefile': '/home/thoverga/Documents/github/maps/country_borders/WB_countries_Admin0_10m/WB_countries_Admin0_10m.shp',
+    'sidecar_folder': None #None: a 'boundary_cache' folder next to the shapefile
+    }
+
+_country_boundaries = {} # (country, crs, tolerance) --> (geometry, prepared geometry)
+
+
+def _country_sidecar_file(countryname, crs, tolerance):
+    folder = country_boundary_settings['sidecar_folder']
+    if folder is None:
+        folder = os.path.join(os.path.dirname(country_boundary_settings['shapefile']), 'boundary_cache')
+    crs_name = crs.upper().replace(':', '_') if isinstance(crs, str) else hashlib.sha1(_crs_key(crs).encode()).hexdigest()[:12]
+    tolerance_name = 'full' if tolerance is None else str(tolerance)
+    return os.path.join(folder, countryname.replace(' ', '_') + '_' + crs_name + '_' + tolerance_name + '.wkb')
+
+
+def country_boundary(countryname = 'Belgium', crs = 'EPSG:4326', tolerance = None, prepared = True):
+    """ This function returns the boundary of a country as a shapely (multi) polygon. The boundary is taken from memory,
+        the sidecar file (see country_boundary_settings) or, the first time, extracted from the shapefile.
+        
+        Keyword arguments: \n
+            countryname -- the name of the country in English \n
+            crs -- the crs of the boundary \n
+            tolerance -- if not None, the boundary is simplified with this tolerance (in the units of the crs) \n
+            prepared -- if True, a prepared geometry is returned (fast for many contains/intersects tests) \n """
+    
+    key = (countryname, _crs_key(crs), tolerance)
+    if key not in _country_boundaries:
+        shapefile = country_boundary_settings['shapefile']
+        sidecar_file = _country_sidecar_file(countryname, crs, tolerance)
+        if os.path.isfile(sidecar_file) and (os.path.getmtime(sidecar_file) >= os.path.getmtime(shapefile)):
+            with open(sidecar_file, 'rb') as f:
+                geometry = shapely.wkb.loads(f.read())
+        else:
+            print('Extracting the boundary of ', countryname, ' from ', shapefile)
+            countries = gpd.read_file(shapefile)
+            country = countries.loc[countries['NAME_EN'] == countryname]
+            if country.empty:
+                print('The country ', countryname, ' is not found in ', shapefile)
+                sys.exit()
+            geometry = country.to_crs(crs)['geometry'].iloc[0] #only this country is reprojected
+            if tolerance is not None:
+                geometry = geometry.simplify(tolerance, preserve_topology=True)
+            try: #write and rename, so other processes never read a half written file
+                os.makedirs(os.path.dirname(sidecar_file), exist_ok=True)
+                tmp_file = sidecar_file + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp_file, 'wb') as f:
+                    f.write(geometry.wkb)
+                os.replace(tmp_file, sidecar_file)
+            except OSError:
+                print('The boundary could not be stored in ', sidecar_file, ', it is only kept in memory.')
+        _country_boundaries[key] = (geometry, prep(geometry))
+    
+    geometry, prepared_geometry = _country_boundaries[key]
+    return prepared_geometry if prepared else geometry
+
+
+def points_in_country(lats, lons, countryname = 'Belgium', tolerance = None):
+    """ This function returns a boolean array: True for the latlon coordinates inside the (optionally simplified, 
+        tolerance in degrees) boundary of the country. """
+    
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    geometry = country_boundary(countryname, 'EPSG:4326', tolerance, prepared=False)
+    if hasattr(shapely, 'contains_xy'): #shapely >= 2.0, vectorized (on the prepared geometry)
+        shapely.prepare(geometry)
+        return shapely.contains_xy(geometry, lons, lats)
+    prepared_geometry = country_boundary(countryname, 'EPSG:4326', tolerance, prepared=True)
+    return np.array([prepared_geometry.contains(Point(lon, lat)) for lat, lon in zip(lats, lons)], dtype=bool)
+
+
 def get_country_geometry(countryname = 'Belgium', crs = 'EPSG:4326'):
     """ This function returns a (multi) polygon that represents the bounaries of a given country. 
         The coordinate reference system of the polygon can be set with the crs argument.
-        Make shure the countryname is writen in English. """
+        Make shure the countryname is writen in English. The boundary is cached, see country_boundary(). """
     
-    file = '/home/thoverga/Documents/github/maps/country_borders/WB_countries_Admin0_10m/WB_countries_Admin0_10m.shp'
-    shapefile = gpd.read_file(file)
-    shapefile = shapefile.to_crs(crs)
-    return shapefile.loc[shapefile['NAME_EN'] == countryname, 'geometry'].iloc[0], shapefile.crs
+    geometry = country_boundary(countryname, crs, prepared=False)
+    return geometry, gpd.GeoSeries([geometry], crs=crs).crs
 
 def create_box_polygon(bound, crs = 'epsg:4326'):
     """ This function returns a rectangular polygon based on the max. and min. latlon coordinates in the bound dictionary. 
@@ -136,15 +1504,12 @@ def create_box_polygon(bound, crs = 'epsg:4326'):
         
         The bound dictionary has following keys: xmin, xmax, ymin, ymax with values in latlon coordinates. """
         
-    p1 = [bound['xmin'], bound['ymax']]
-    p2 = [bound['xmax'], bound['ymax']]
-    p3 = [bound['xmax'], bound['ymin']]
-    p4 = [bound['xmin'], bound['ymin']]
+    lons = [bound['xmin'], bound['xmax'], bound['xmax'], bound['xmin']]
+    lats = [bound['ymax'], bound['ymax'], bound['ymin'], bound['ymin']]
+    xs, ys = latlon_to_xy(lats, lons, crs)
     
-    polygon_geom = Polygon([p1,p2,p3,p4])
-    init_crs = 'epsg:4326'
-    polygon = gpd.GeoDataFrame(index=[0], crs=init_crs, geometry=[polygon_geom])
-    polygon = polygon.to_crs(crs)
+    polygon_geom = Polygon(list(zip(xs, ys)))
+    polygon = gpd.GeoDataFrame(index=[0], crs=crs, geometry=[polygon_geom])
     return polygon.iloc[0]
 
         
@@ -155,90 +1520,134 @@ def create_box_polygon(bound, crs = 'epsg:4326'):
 def df_to_geodf(df, crs, lat_identifier, lon_identifier):
     """ This function returns a geopandas dataframe with a geometry column in the given crs coordinates. """
 
-    geo_df = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df[lon_identifier], df[lat_identifier]))
-    geo_df = geo_df.set_crs(epsg = 4326) #inpunt are gps coordinates
-    geo_df = geo_df.to_crs(crs)
+    xs, ys = latlon_to_xy(df[lat_identifier].values, df[lon_identifier].values, crs) #inpunt are gps coordinates
+    geo_df = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(xs, ys), crs=crs)
     return geo_df
 
 
 def coordinate_to_point_geometry(lat, lon, crs):
     """ This function returns a shapely point object in the given coordinate referece frame. """
     
-    point_geo = gpd.GeoDataFrame(pd.DataFrame(data={'lat': [lat], 'lon': [lon]}), geometry=gpd.points_from_xy([lon], [lat]))
-    point_geo = point_geo.set_crs(epsg = 4326) #inpunt are gps coordinates
-    point_geo = point_geo.to_crs(crs)
-    
-    return point_geo.iloc[0]['geometry']
+    return point_geometries([lat], [lon], crs)[0]
 
 def coordinate_to_circular_buffer_geometry(lat_center, lon_center, radius_m, crs):
     """ This function returns a shapely (circular) polygon object with a given radius in meter, in the given coordinate referece frame. """
 
-    
-    circ_geo = gpd.GeoDataFrame(pd.DataFrame(data={'lat': [lat_center], 'lon': [lon_center]}), geometry=gpd.points_from_xy([lon_center], [lat_center]))
-    circ_geo = circ_geo.set_crs(epsg = 4326) #inpunt are gps coordinates
-    circ_geo = circ_geo.to_crs(crs)
-  
-    circ_geo['polygon'] = circ_geo['geometry'].buffer(float(radius_m), resolution=30)
-    
-    return circ_geo.iloc[0]['polygon']
+    return buffer_geometries([lat_center], [lon_center], [float(radius_m)], crs, shape='circle', resolution=30)[0, 0]
 
 def coordinates_to_rectangel_geometry(lat_1, lat_2, lon_1, lon_2, crs):
     """ This function returns a shapely (rectangular) polygon object, in the given coordinate reference frame. """
+    
+    return rectangle_geometries([float(lat_1)], [float(lat_2)], [float(lon_1)], [float(lon_2)], crs)[0]
 
 
-    data = pd.DataFrame(data={'lat': [float(lat_1), float(lat_2)], 'lon': [float(lon_1), float(lon_2)]})
-    geodf = gpd.GeoDataFrame(data, geometry=gpd.points_from_xy(data['lon'], data['lat']))
-    geodf = geodf.set_crs(epsg = 4326) #inpunt are gps coordinates
-    geodf = geodf.to_crs(crs)
-    
-    x_values = [geom.x for geom in geodf['geometry']]
-    y_values = [geom.y for geom in geodf['geometry']]
-    
-    return box(min(x_values), min(y_values), max(x_values), max(y_values))
 
 
+def sample_points(lats, lons, raster_file_list, band=1, block_size=2048):
+    """ This function returns the raster values at many locations at once (vectorized).
+        The latlon coordinates are reprojected all at once to the crs of the rasters, the points are grouped by the tile
+        that contains them and each tile is read with one window around its points (points that are far apart in a 
+        tile are split in blocks of block_size x block_size cells to limit the memory use). 
+        
+        Return: numpy array (float) aligned with the input coordinates. NaN for points that are outside all rasters or
+        on a nodata cell. If band is a list of bands, the array has a column for each band. """
+    
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    catalog = get_tile_catalog(raster_file_list)
+    
+    xs, ys = latlon_to_xy(lats, lons, catalog['crs'])
+    
+    bands = [int(b) for b in np.atleast_1d(band)]
+    values = np.full((len(lats), len(bands)), np.nan)
+    todo = np.isfinite(xs) & np.isfinite(ys)
+    for tile, (left, bottom, right, top) in zip(catalog['tiles'], catalog['bounds']):
+        in_tile = todo & (xs > left) & (xs < right) & (ys > bottom) & (ys < top)
+        if not in_tile.any():
+            continue
+        todo &= ~in_tile #the first tile that contains the point is used
+        
+        with open_raster(tile) as src:
+            idx = np.nonzero(in_tile)[0]
+            cols, rows = ~src.transform * (xs[idx], ys[idx])
+            cols = np.clip(np.floor(cols).astype(int), 0, src.width - 1)
+            rows = np.clip(np.floor(rows).astype(int), 0, src.height - 1)
+        
+            #one window read per block of points
+            block_ids = (rows // block_size) * (src.width // block_size + 1) + (cols // block_size)
+            for block_id in np.unique(block_ids):
+                in_block = (block_ids == block_id)
+                row_min, row_max = rows[in_block].min(), rows[in_block].max()
+                col_min, col_max = cols[in_block].min(), cols[in_block].max()
+                window = Window(col_min, row_min, col_max - col_min + 1, row_max - row_min + 1)
+                data = _read_bands(src, bands, window)
+                block_values = data[:, rows[in_block] - row_min, cols[in_block] - col_min].T.astype(float)
+                if src.nodata is not None:
+                    block_values[is_nodata(block_values, src.nodata)] = np.nan
+                values[idx[in_block]] = block_values
+    
+    if np.ndim(band) == 0:
+        return values[:, 0]
+    return values
 
 
-def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info = False, return_counts = False, none_if_no_overlap = False):
+def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info = False, return_counts = False, none_if_no_overlap = False,
+                                  integral_folder = None, categories = None, band = 1):
     """ The ultimate GIS-application function takes as arguments an geometry and a (list of) geotiff file(s).
         This function can handle multiple rasters and merges them if nesecary. 
         
         The return depends on the geometry type:
             * If geometry type is a point, the corresponding raster value is returned. 
             * if geometry type is a polygon, the return is an array of corresponding raster values inside the geometry.
+        
+        If integral_folder is given (see build_class_integral_images) and the counts of a rectangular geometry (i.e. 
+        point_to_square) inside one raster are asked, the counts are looked up in the integral images of that raster.
+        
+        If the counts of a categorical raster are asked and categories is given (i.e. the keys of the mapper of the map), 
+        the counts are returned as a numpy array in the order of categories instead of a dataframe.
+        
+        If a zonal cache file is set (see set_zonal_cache()), the results for polygons are cached on disk.
+        
+        Multi-band rasters (i.e. stacked class layers, see stack_raster_bands()) are read with band a list of bands (or
+        None for all the bands): a point returns an array with a value for each band, a polygon returns a masked array
+        (bands x rows x columns). The counts are only computed for one band.
         """
     
     # --------------------------------------------------------------------------------------------------------------------------------------
     #--------------------------------------------HELP functions ----------------------------------------------------------------------------
     # --------------------------------------------------------------------------------------------------------------------------------------
     
-    def validate_raster(raster_file_list):
+    def validate_raster(raster_file_list, bands):
         print('validate raster maps ...')
         categorical_bool = False
-        #check raster meta info
+        #check raster meta info (from the tile catalog)
+        catalog = get_tile_catalog(raster_file_list)
         raster_file_dict = {file: {} for file in raster_file_list}
-        for raster in raster_file_dict:
-            with rasterio.open(raster) as src:
-                res_x_y = src.res
-                if (not res_x_y[0] == res_x_y[1]) & (abs(float(res_x_y[0]) - float(res_x_y[1]))/float(res_x_y[0]) > 0.05): #if x and y resolution differs more than 5%
-                    print('raster map(' + raster + ') has different x and y resolution. This functionality is not included!')
-                    sys.exit()
-                if not src.crs.linear_units_factor[0] == 'metre':
-                    print('raster map unit is not meter but ', str(src.crs.linear_units_factor[0]), ' this functionality is not included!')
-                    sys.exit()
-                if not src.count == 1:
-                    print('There are ', str(src.count) , ' raster bands detected. This functionality is not implemented.')
-                    sys.exit()
-                
-                if not src.dtypes[0] == 'float32':
-                    print('The data type of the grid cells in the raster are no floats. The raster will be considered to be categorical!')
-                    categorical_bool = True
-                    
-                #TODO: check if dtypes of all rasters are the same
-                
+        for raster, info in zip(catalog['tiles'], catalog['info']):
+            res_x_y = info['resolution']
+            crs = CRS.from_wkt(info['crs'])
+            if (not res_x_y[0] == res_x_y[1]) & (abs(float(res_x_y[0]) - float(res_x_y[1]))/float(res_x_y[0]) > 0.05): #if x and y resolution differs more than 5%
+                print('raster map(' + raster + ') has different x and y resolution. This functionality is not included!')
+                sys.exit()
+            if not crs.linear_units_factor[0] == 'metre':
+                print('raster map unit is not meter but ', str(crs.linear_units_factor[0]), ' this functionality is not included!')
+                sys.exit()
+            if not info['bands'] == catalog['info'][0]['bands']:
+                print('The raster maps have a different number of bands. This functionality is not included!')
+                sys.exit()
+            if not all(1 <= b <= info['bands'] for b in bands):
+                print('The bands ', str(bands), ' are not in the raster map (' + raster + ') with ', str(info['bands']), ' bands.')
+                sys.exit()
+            
+            if not info['dtype'] == 'float32':
+                print('The data type of the grid cells in the raster are no floats. The raster will be considered to be categorical!')
+                categorical_bool = True
                 
-                raster_file_dict[raster]['resolution'] = src.res[0]
-                raster_file_dict[raster]['crs'] = src.crs
+            #TODO: check if dtypes of all rasters are the same
+            
+            
+            raster_file_dict[raster]['resolution'] = res_x_y[0]
+            raster_file_dict[raster]['crs'] = info['crs']
        
         
         res_list = [float(raster_file_dict[x]['resolution']) for x in raster_file_dict.keys()]
@@ -255,27 +1664,6 @@ def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info =
         return categorical_bool
     
     
-    def geometry_in_map(geometry, raster_file):
-        
-        if geometry.geom_type == 'Point':
-            with rasterio.open(raster_file) as src:
-                bounds = src.bounds
-                if ((geometry.x < bounds.right) & (geometry.x > bounds.left) & (geometry.y > bounds.bottom) & (geometry.y < bounds.top)):
-                    return True
-                else:
-                    return False
-                
-        if geometry.geom_type == 'Polygon':
-        #first check if a part of the geometry is contained in the raster 
-            with rasterio.open(raster_file) as src:
-                raster_bounds_polygon = box(src.bounds.left, src.bounds.bottom, src.bounds.right, src.bounds.top)
-                if raster_bounds_polygon.contains(geometry): #geometry fully in raster
-                    return True, 'fully_contained'
-                elif raster_bounds_polygon.intersects(geometry): #part of geometry in raster
-                    return True, 'partially'
-                else:
-                        return False, 'none'
-    
     #---------------------------------------------------------------------------------------------------------------------------------------------------
     #---------------------------------------------------------------------------------------------------------------------------------------------------
     
@@ -286,6 +1674,13 @@ def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info =
     if isinstance(raster_file_list, str): #if there is one tif file
         raster_file_list = [raster_file_list]
     
+    if band is None: #all the bands
+        band = list(range(1, get_tile_catalog(raster_file_list)['info'][0]['bands'] + 1))
+    bands = [int(band)] if np.isscalar(band) else [int(b) for b in band]
+    band = bands[0] if np.isscalar(band) else bands #python ints (also for the zonal cache key)
+    if (not np.isscalar(band)) & bool(return_counts):
+        print('The counts are only computed for one band, the values of the bands ', str(bands), ' will be returned.')
+        return_counts = False
     
     if geometry.geom_type == 'Point':
         print('geometry is Point type, raster value will be returned!')
@@ -295,17 +1690,16 @@ def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info =
     elif geometry.geom_type == 'Polygon':
         print('geometry is Polygon type, cropped array will be returned!')
         geom_type = 'Polygon'
-        categorical_bool = validate_raster(raster_file_list = raster_file_list)
+        categorical_bool = validate_raster(raster_file_list = raster_file_list, bands = bands)
     
     else:
         print('geometry type of geometry not supported. Only Point and Polygon are supported.')
     
-    with rasterio.open(raster_file_list[0]) as src:
-        
-        raster_CRS = src.crs
-        raster_RES = src.res[0]
-        raster_spatial_UNIT = src.crs.linear_units_factor[0]
-        raster_BANDS = src.count
+    catalog = get_tile_catalog(raster_file_list)
+    raster_CRS = catalog['crs']
+    raster_RES = catalog['info'][0]['resolution'][0]
+    raster_spatial_UNIT = raster_CRS.linear_units_factor[0]
+    raster_BANDS = catalog['info'][0]['bands']
     raster_info = {
         'crs': raster_CRS,
         'resolution': raster_RES,
@@ -318,10 +1712,9 @@ def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info =
     if geom_type == 'Point':
         #get map to use
         map_to_use = "None"
-        for raster_file in raster_file_list:
-            if geometry_in_map(geometry, raster_file):
-                map_to_use = raster_file
-                break
+        found_maps = find_tiles(geometry, raster_file_list)
+        if bool(found_maps):
+            map_to_use = found_maps[0]
         
         if map_to_use == 'None':
             print('The point with coordinats:')
@@ -336,20 +1729,18 @@ def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info =
         
         
         #get raster value
-        with rasterio.open(map_to_use) as src:
-            band_values = [val for val in src.sample([(geometry.x, geometry.y)])]
+        with open_raster(map_to_use) as src:
+            band_values = [val for val in src.sample([(geometry.x, geometry.y)], indexes=bands)]
             
-        value = band_values[0][0]
+        value = band_values[0][0] if np.isscalar(band) else band_values[0]
     
     # -----------------------------------------------------get POLYGON cropped array -----------------------------------------------------
     # find the maps to use
     if geom_type == 'Polygon':
         maps_to_use = []
-        for raster_file in raster_file_list:
-            intersect_bool, intersect_info = geometry_in_map(geometry, raster_file)
-            if intersect_bool:
-                maps_to_use.append(raster_file)
-                print('geometry is ', intersect_info, ' contained in ', raster_file)
+        for raster_file, intersect_info in find_tiles(geometry, raster_file_list):
+            maps_to_use.append(raster_file)
+            print('geometry is ', intersect_info, ' contained in ', raster_file)
                 
         #return None if no raster is found that overlaps
         if not bool(maps_to_use): 
@@ -366,87 +1757,44 @@ def ULTIMATE_read_from_rasterfile(geometry, raster_file_list, return_map_info =
         
         # if geometry is encompassed in one raster 
         
-        if len(maps_to_use) == 1: #geometry fully contained in raster
-            zs = rasterstats.zonal_stats(vectors = geometry,
-                                         raster = maps_to_use[0],
-                                         band_num=1, 
-                                         all_touched= True, #if true, inclueds the cells at the boundaries of the polygon
-                                         categorical = categorical_bool,
-                                         raster_out= True,
-                                         # prefix=str(layer)+'_'
-                                              )
-            if return_counts & categorical_bool: #return frequency table 
-                category_counts = pd.Series(zs[0]).drop(['mini_raster_affine', 'mini_raster_array', 'mini_raster_nodata'])
-                category_counts.name = 'counts'
-                category_counts = category_counts.to_frame()
-                category_counts['category'] = category_counts.index
-                category_counts.reset_index(drop=True, inplace=True)
-                return category_counts
-            else:   
-                value = zs[0]['mini_raster_array']
+        # fast path: class counts of a rectangle from the integral images 
+        value = None
+        if (integral_folder is not None) & return_counts & categorical_bool & (len(maps_to_use) == 1) & (bands == [1]):
+            integral = load_class_integral_images(maps_to_use[0], integral_folder)
+            is_rectangle = abs(box(*geometry.bounds).area - geometry.area) <= 1e-9 * geometry.area
+            if (integral is not None) and is_rectangle:
+                counts = box_class_counts(integral, *geometry.bounds)
+                if categories is not None:
+                    count_map = dict(zip(integral['categories'], counts))
+                    value = np.array([count_map.get(category, 0) for category in categories], dtype=np.int64)
+                else:
+                    category_counts = pd.DataFrame({'counts': counts, 'category': integral['categories']})
+                    value = category_counts[category_counts['counts'] > 0].reset_index(drop=True)
         
-        else: # if geometry overlaps with multiple maps
-            print('Cropping and temporary saving rasters...')
-            cropped_raster_file_list = []
-            i = 0
-            
-            #create rectangle around geometry to crop and clip the rasters to. 
-            geometry_box = box(geometry.bounds[0], geometry.bounds[1],
-                               geometry.bounds[2], geometry.bounds[3])
-            
-            #create a cropped version for each map that encompasses the geometry bounderies
-            for raster in maps_to_use:
-                with rasterio.open(raster) as src:
-                    out_image, out_transform = rasterio.mask.mask(src, [geometry_box], crop=True)
-                    out_meta = src.meta
-                    
-                out_meta.update({"driver": "GTiff",
-                                 "height": out_image.shape[1],
-                                 "width": out_image.shape[2],
-                                 "transform": out_transform})
-                
-                #temporaly save the tif map in the script folder location
-                cropped_file = os.path.join(path_handler.folders['meta_data_folder'], 'cropped_raster_' + str(i) + '.tif')
-                cropped_raster_file_list.append(cropped_file)
-                with rasterio.open(cropped_file, "w", **out_meta) as dest:
-                    dest.write(out_image)
-                i += 1
-                
-          
-            #merge the cropped rasters and temporaly save in the script folder location
-            merged_array, merged_affine = rasterio.merge.merge([rasterio.open(x) for x in cropped_raster_file_list])
-            merged_meta = src.meta 
-            merged_meta.update({"driver": "GTiff",
-                                 "height": merged_array.shape[1],
-                                 "width": merged_array.shape[2],
-                                 "transform": merged_affine})
-            
-            merged_location = os.path.join(path_handler.folders['meta_data_folder'], 'merged_raster.tif')
-            with rasterio.open(merged_location, "w", **merged_meta) as dest:
-                    dest.write(merged_array)
-            
-            #get local array from the merged raster
-            zs = rasterstats.zonal_stats(vectors = geometry,
-                                         raster = merged_location,
-                                         band_num=1, 
-                                         all_touched= True, #if true, inclueds the cells at the boundaries of the polygon
-                                         categorical = categorical_bool,
-                                         raster_out= True,
-                                         # prefix=str(layer)+'_'
-                                              )
-            if return_counts & categorical_bool: #return frequency table 
-                category_counts = pd.Series(zs[0]).drop(['mini_raster_affine', 'mini_raster_array', 'mini_raster_nodata'])
-                category_counts.name = 'counts'
-                category_counts = category_counts.to_frame()
-                category_counts['category'] = category_counts.index
-                category_counts.reset_index(drop=True, inplace=True)
-                value = category_counts
-            else:
-                value = zs[0]['mini_raster_array']
+        # look up the result in the zonal statistics cache
+        if (value is None) & (zonal_cache_settings['cache_file'] is not None):
+            cache_key = zonal_cache_key(geometry, maps_to_use, {'all_touched': True, 'categorical': categorical_bool,
+                                                                'return_counts': bool(return_counts & categorical_bool),
+                                                                'categories': None if categories is None else [str(c) for c in categories],
+                                                                'band': band})
+            value = _zonal_cache_lookup(cache_key)
+        
+        # read the (mosaicked) raster values around the geometry in memory 
+        if value is None:
+            if len(maps_to_use) > 1: # if geometry overlaps with multiple maps
+                print('Mosaicking rasters in memory...')
+            values = zonal_values(geometry, read_mosaic_around_geometry(geometry, maps_to_use, band=band),
+                                  all_touched = True) #if true, inclueds the cells at the boundaries of the polygon
+            if return_counts & categorical_bool & (categories is not None): #counts in the order of the categories
+                value = aligned_class_counts(values.compressed(), categories)
+            elif return_counts & categorical_bool: #return frequency table 
+                category, counts = np.unique(values.compressed(), return_counts=True)
+                value = pd.DataFrame({'counts': counts, 'category': category})
+            else:   
+                value = values
             
-            #Delete the create raster tif files
-            for crop_tif in cropped_raster_file_list: os.remove(crop_tif)
-            os.remove(merged_location)
+            if zonal_cache_settings['cache_file'] is not None:
+                _zonal_cache_store(cache_key, value)
     if return_map_info:    
         return value, raster_info
     else:
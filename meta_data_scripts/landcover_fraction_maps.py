@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+This script turns a categorical landcover map (BBK2015, ESM, S2GLC, ...) into continuous fraction maps. For each buffer
+radius a (cloud optimized) GeoTIFF is written with one band per landcover class; the value of a cell is the fraction of
+that class in a circular buffer around the cell.
+
+After this one-off computation the landcover fractions of any location are a point sample of these maps instead of a
+zonal statistic on a buffer polygon (see sample_fraction_maps()). The maps can also be plotted directly (i.e. the
+impervious fraction within 250m for the dashboard).
+
+The convolution with the disk kernel is done with FFTs, tile by tile with a halo of the buffer radius, so the complete
+map is never loaded in memory. The output files are written next to the source map: <mapname>_fraction_<radius>m.tif
+
+Created on Sun Oct 18 2026
+"""
+
+import sys
+import os
+import math
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
+from shapely.geometry import box
+from scipy import fft
+from pathlib import Path
+
+
+#%import path file
+file_folder = (Path(__file__).resolve().parent)
+sys.path.append(str(file_folder))
+import gis_functions as gis
+
+
+#%% functions
+
+def disk_kernel(radius, resolution):
+    """ This function returns a (float) kernel of the cells whose center is within the radius (in meter) of the center cell. """
+
+    n = int(math.floor(float(radius) / resolution))
+    offsets = np.arange(-n, n + 1) * float(resolution)
+    return ((offsets[:, None]**2 + offsets[None, :]**2) <= float(radius)**2).astype(np.float32)
+
+
+def _disk_convolution(block, kernel):
+    #FFT convolution of the block with the kernel ('valid' part), the spectrum of the kernel is computed once
+    shape = [fft.next_fast_len(block.shape[0] + kernel.shape[0] - 1, real=True),
+             fft.next_fast_len(block.shape[1] + kernel.shape[1] - 1, real=True)]
+    kernel_spectrum = fft.rfft2(kernel, shape)
+    valid_slice = (slice(kernel.shape[0] - 1, block.shape[0]), slice(kernel.shape[1] - 1, block.shape[1]))
+    
+    def convolve(array):
+        return fft.irfft2(fft.rfft2(array, shape) * kernel_spectrum, shape)[valid_slice]
+    return convolve
+
+
+def fraction_map_file(raster_file, radius, out_folder=None):
+    """ This function returns the path of the fraction map of a raster file for a buffer radius. """
+
+    if out_folder is None: #next to the source map
+        out_folder = os.path.dirname(os.path.abspath(raster_file))
+    name = os.path.splitext(os.path.basename(raster_file))[0]
+    return os.path.join(out_folder, name + '_fraction_' + str(int(radius)) + 'm.tif')
+
+
+def create_fraction_maps(raster_file, radii, categories, out_folder=None, tile_size=2048, raster_file_list=None):
+    """ This function creates the fraction maps of a categorical raster for each buffer radius.
+
+         Keyword arguments: \n
+            raster_file -- string
+                        path to the categorical raster \n
+            radii -- list
+                        the buffer radii in meter \n
+            categories -- list
+                        the class codes (one band per class in the output, in this order) \n
+            out_folder -- string
+                        folder of the output, by default the folder of the raster file \n
+            tile_size -- int
+                        the raster is processed in tiles of tile_size x tile_size cells (plus the halo) \n
+            raster_file_list -- list
+                        all the tiles of the map (i.e. all BBK files), the halo of the buffers at the edges of the 
+                        raster is read from the neighbouring tiles. If None, outside the raster is nodata.
+
+        Return
+            a dictionary: radius --> path to the fraction map. """
+
+    with gis.open_raster(raster_file) as src:
+        grid = src.profile
+    resolution = grid['transform'].a
+    output_files = {}
+
+    for radius in radii:
+        print('Computing the fraction maps of ', raster_file, ' for a buffer radius of ', radius, 'm ...')
+        kernel = disk_kernel(radius, resolution)
+        halo = kernel.shape[0] // 2
+
+        out_file = fraction_map_file(raster_file, radius, out_folder)
+        tmp_file = out_file + '.raw.tif'
+        profile = {'driver': 'GTiff', 'width': grid['width'], 'height': grid['height'], 'count': len(categories),
+                   'dtype': 'float32', 'crs': grid['crs'], 'transform': grid['transform'], 'nodata': np.nan,
+                   'tiled': True, 'blockxsize': 512, 'blockysize': 512, 'BIGTIFF': 'IF_SAFER'}
+
+        with rasterio.open(tmp_file, 'w', **profile) as dst:
+            for i, category in enumerate(categories):
+                dst.set_band_description(i + 1, 'class_' + str(category))
+
+            for row_start in range(0, grid['height'], tile_size):
+                for col_start in range(0, grid['width'], tile_size):
+                    n_rows = min(tile_size, grid['height'] - row_start)
+                    n_cols = min(tile_size, grid['width'] - col_start)
+                    #tile with a halo of the buffer radius (from the neighbouring tiles, else nodata)
+                    halo_window = Window(col_start - halo, row_start - halo, n_cols + 2 * halo, n_rows + 2 * halo)
+                    halo_files = [raster_file]
+                    if raster_file_list is not None:
+                        halo_box = box(*rasterio.windows.bounds(halo_window, grid['transform']))
+                        halo_files += [tile for tile, _info in gis.find_tiles(halo_box, raster_file_list) if tile != raster_file]
+                    block, _affine, _nodata = gis.read_mosaic_window(halo_files, halo_window)
+
+                    #the nodata cells and the cells that are not covered by the rasters are not counted
+                    is_valid = ~np.ma.getmaskarray(block)
+                    block = np.ma.getdata(block)
+                    valid = is_valid.astype(np.float32)
+                    convolve = _disk_convolution(block, kernel)
+                    valid_count = convolve(valid)
+                    has_data = valid_count > 0.5
+
+                    for i, category in enumerate(categories):
+                        class_count = convolve(((block == category) & is_valid).astype(np.float32))
+                        fraction = np.full(class_count.shape, np.nan, dtype=np.float32)
+                        fraction[has_data] = np.clip(class_count[has_data] / valid_count[has_data], 0., 1.) #FFT rounding errors
+                        dst.write(fraction, i + 1, window=Window(col_start, row_start, n_cols, n_rows))
+
+        gis.write_cog(tmp_file, out_file, resampling='average')
+        rasterio.shutil.delete(tmp_file)
+        output_files[radius] = out_file
+
+    return output_files
+
+
+def sample_fraction_maps(lats, lons, raster_file_list, radii, categories, out_folder=None):
+    """ This function returns the landcover fractions at the locations, sampled from the fraction maps (see
+        create_fraction_maps()) of the raster files.
+
+        Return: numpy array (locations x radii x categories) with the fractions, NaN if a location is not covered. """
+
+    if isinstance(raster_file_list, str): #if there is one tif file
+        raster_file_list = [raster_file_list]
+
+    fractions = np.full((len(lats), len(radii), len(categories)), np.nan)
+    for j, radius in enumerate(radii):
+        fraction_files = [fraction_map_file(raster_file, radius, out_folder) for raster_file in raster_file_list]
+        fractions[:, j, :] = gis.sample_points(lats, lons, fraction_files, band=list(range(1, len(categories) + 1)))
+    return fractions
+
+
+
+#%% Create the fraction maps of the BBK map
+
+if __name__ == "__main__":
+    main_repo_folder = (Path(__file__).resolve().parent.parent)
+    sys.path.append(str(main_repo_folder))
+    import path_handler
+
+    buffer_list = [50,100,150,250]
+    BBK_folder = os.path.join(path_handler.lu_lc_folder,'Landuse', 'BBK2015')
+    BBK_categories = list(range(1, 15))
+
+    BBK_files = sorted([os.path.join(BBK_folder, x) for x in os.listdir(BBK_folder) if x.endswith(".tif") and not '_fraction_' in x])
+    for BBK_file in BBK_files:
+        create_fraction_maps(BBK_file, buffer_list, BBK_categories, raster_file_list=BBK_files)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+A persistent store (SQLite file) of computed meta data (height, SVF, landuse fractions, LCZ, ...) of locations.
+
+Each value is stored under a key of:
+    (rounded lat, rounded lon, quantity, buffer radius, map dataset, map checksum, algorithm parameters)
+
+The map checksum is computed from the path, size and modification time of the map files (as for the raster tile
+catalog), so a new version of a map invalidates its values without reading the (large) files. The values are stored as
+json.
+
+Created on Sun Oct 18 2026
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+
+#%% Settings
+
+metadata_cache_settings = {
+    'coordinate_decimals': 6 #lat and lon are rounded to this number of decimals in the key (~0.1m)
+    }
+
+_cache_connections = {} # cache file --> sqlite3 connection
+_cache_lock = threading.Lock()
+
+
+def _reset_connections_after_fork():
+    #the connections (and the lock) of the parent process can not be used in a forked (worker) process
+    global _cache_lock
+    _cache_lock = threading.Lock()
+    _cache_connections.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_connections_after_fork)
+
+
+#%% Keys
+
+def map_checksum(raster_file_list):
+    """ This function returns a checksum of the map files, based on the path, size and modification time. """
+
+    if isinstance(raster_file_list, str): #if there is one tif file
+        raster_file_list = [raster_file_list]
+
+    checksum = hashlib.sha1()
+    for raster_file in sorted(raster_file_list):
+        try:
+            stat = os.stat(raster_file)
+            signature = (os.path.abspath(raster_file), stat.st_size, stat.st_mtime_ns)
+        except OSError: #not a local file
+            signature = (raster_file, None, None)
+        checksum.update(repr(signature).encode())
+    return checksum.hexdigest()
+
+
+def params_key(params):
+    """ This function returns the algorithm parameters (a dict) as a string for the key. """
+
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def metadata_key(lat, lon, quantity, radius, dataset, checksum, params):
+    """ This function returns the key of a value in the metadata cache. Use 0 as radius for point values and
+        params_key() for the params. """
+
+    factor = 10**metadata_cache_settings['coordinate_decimals']
+    return (int(round(float(lat) * factor)), int(round(float(lon) * factor)), quantity, float(radius), dataset,
+            checksum, params)
+
+
+#%% Store
+
+def _to_json(value):
+    #numpy scalars to python
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def _connection(cache_file):
+    #open (and create) the cache file once
+    if cache_file not in _cache_connections:
+        connection = sqlite3.connect(cache_file, timeout=60, check_same_thread=False) #wait for the other processes
+        connection.execute("""CREATE TABLE IF NOT EXISTS metadata (
+                                  lat INTEGER, lon INTEGER, quantity TEXT, radius REAL, dataset TEXT,
+                                  checksum TEXT, params TEXT, value TEXT,
+                                  PRIMARY KEY (lat, lon, quantity, radius, dataset, checksum, params))""")
+        connection.commit()
+        _cache_connections[cache_file] = connection
+    return _cache_connections[cache_file]
+
+
+def lookup_metadata(cache_file, keys):
+    """ This function returns the cached values of the keys (see metadata_key()).
+
+        Return: a dictionary key --> value, missing keys are not in the dictionary. """
+
+    found = {}
+    with _cache_lock:
+        connection = _connection(cache_file)
+        for key in set(keys):
+            row = connection.execute("""SELECT value FROM metadata WHERE lat=? AND lon=? AND quantity=? AND radius=?
+                                        AND dataset=? AND checksum=? AND params=?""", key).fetchone()
+            if row is not None:
+                found[key] = json.loads(row[0])
+    return found
+
+
+def store_metadata(cache_file, values, remove_stale=True):
+    """ This function stores the values (a dictionary key --> value) in the cache. If remove_stale is True, the values of
+        the same quantity and dataset with another map checksum (an old version of the map) are removed. """
+
+    if len(values) == 0:
+        return
+    with _cache_lock:
+        connection = _connection(cache_file)
+        connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               [key + (json.dumps(value, default=_to_json),) for key, value in values.items()])
+        if remove_stale:
+            for quantity, dataset, checksum in set((key[2], key[4], key[5]) for key in values):
+                connection.execute("DELETE FROM metadata WHERE quantity=? AND dataset=? AND checksum!=?",
+                                   (quantity, dataset, checksum))
+        connection.commit()
+
+
+def clear_metadata_cache(cache_file):
+    """ Remove all the values from the cache file. """
+
+    with _cache_lock:
+        connection = _connection(cache_file)
+        connection.execute("DELETE FROM metadata")
+        connection.commit()
+
+
+def close_metadata_caches():
+    """ Close all the open cache files. """
+
+    with _cache_lock:
+        while _cache_connections:
+            _cache_file, connection = _cache_connections.popitem()
+            connection.close()
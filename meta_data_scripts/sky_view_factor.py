@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Functions to estimate the sky view factor (SVF) of a location from a (square) local DEM array around the location.
+
+For each direction, the DEM is scanned along a ray from the center of the array to the edge. The maximum elevation
+angle (phi) of the terrain relative to the reference height (the lowest point in the loc_buffer around the center) is
+the horizon angle in that direction. The cells within the loc_buffer around the center are not used (to avoid the
+effect of the trotoir, walls near the station, ...).
+
+Created on Sun Oct 18 2026
+"""
+
+import sys
+import os
+import math
+import argparse
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
+from shapely.geometry import box
+from scipy.ndimage import minimum_filter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    import numba
+except ImportError: #numba is optional, the numpy engine is used instead
+    numba = None
+
+
+#%import path file
+file_folder = (Path(__file__).resolve().parent)
+sys.path.append(str(file_folder))
+import gis_functions as gis
+
+
+#%% Settings
+
+svf_settings={'engine': 'numba' if numba is not None else 'numpy'} #engine of the horizon scanning: 'numba' or 'numpy'
+
+
+def set_svf_engine(engine):
+    """ Set the engine of the horizon scanning: 'numba' (JIT compiled, parallel) or 'numpy'. If numba is not
+        installed, the numpy engine is used. """
+
+    if engine not in ['numba', 'numpy']:
+        print('The SVF engine ', engine, ' is unknown, use numba or numpy.')
+        sys.exit('Unknown SVF engine')
+    if (engine == 'numba') & (numba is None):
+        print('Numba is not installed, the numpy engine is used for the SVF.')
+        engine = 'numpy'
+    svf_settings['engine'] = engine
+
+
+#%% Reference implementation
+
+def get_SVF_from_local_DEM_reference(local_array, local_radius, raster_info, loc_buffer=2, num_directions=8):
+    """ The original (pure python) implementation of the SVF estimate, one direction and one cell at a time.
+        Use get_SVF_from_local_DEM, this function is kept as reference. """
+
+    alpha = 360.0/(num_directions)
+    array_resolution = raster_info["resolution"]
+
+    ref_index = int(local_array.shape[0]/2)
+
+    buffer_index = math.ceil(loc_buffer/array_resolution)
+
+
+    # find lowes point in buffer of radius 2 (map units = meter)
+    ref_height = local_array[ref_index - buffer_index: ref_index + buffer_index,
+                             ref_index - buffer_index: ref_index + buffer_index].min()
+
+
+    svf_df = pd.DataFrame()
+    svf_df['direction'] = list(range(num_directions))
+    svf_df['alpha'] = [x*alpha for x in svf_df['direction']]
+
+    def max_phi_for_direction(row, local_array, ref_index, buffer_index, resolution):
+        dir_alpha = row['alpha']
+        phi_list = []
+        for i in range(math.floor(local_array.shape[0]/2)): #scan along a line
+            col_idx = round(i * math.sin(dir_alpha * (math.pi / 180.))) + ref_index
+            row_idx = ref_index - round(i * math.cos(dir_alpha * (math.pi / 180.)))
+
+            #not to close to ref to avoid effect of the trotoir.
+            if ((ref_index - buffer_index <= col_idx) & (col_idx <= ref_index + buffer_index)) & \
+                ((ref_index - buffer_index <= row_idx) & (row_idx <= ref_index + buffer_index)):
+                continue
+
+
+            center_index = float(local_array.shape[0]/2.0) #can be different than ref_index if array shape is uneven
+            dist_gridspace = math.sqrt((abs(col_idx - center_index))**2 + (abs(row_idx - center_index))**2)
+            dist = float(dist_gridspace) * float(resolution)
+
+            relative_height = local_array[row_idx, col_idx] - ref_height
+
+            if relative_height < 0 :
+                relative_height = 0.
+
+
+            phi = math.atan(relative_height/dist) * (180. / math.pi)
+            phi_list.append(phi)
+        return max(phi_list)
+
+    svf_df['phi_max'] = svf_df.apply(max_phi_for_direction, axis=1,
+                                     local_array=local_array,
+                                     ref_index = ref_index,
+                                     buffer_index = buffer_index,
+                                     resolution = array_resolution)
+
+    svf = 1 - ((svf_df['phi_max'].sum())/(90 * 360))
+    return svf
+
+
+#%% Vectorized implementation
+
+@lru_cache(maxsize=32)
+def ray_samples(array_size, num_directions, buffer_index):
+    """ This function returns the cells that are scanned along the rays (one ray per direction) from the center of a
+        square array of array_size x array_size cells.
+
+        Return: (rows, cols, dist_gridspace, used) arrays of shape (num_directions x steps). dist_gridspace is the
+        distance to the center in cells, used is False for the cells in the buffer around the center. The arrays are
+        cached, do not modify them. """
+
+    alpha = 360.0/(num_directions)
+    ref_index = int(array_size/2)
+    center_index = float(array_size/2.0) #can be different than ref_index if array shape is uneven
+
+    radians = [(direction * alpha) * (math.pi / 180.) for direction in range(num_directions)]
+    sin_alpha = np.array([math.sin(rad) for rad in radians])[:, None]
+    cos_alpha = np.array([math.cos(rad) for rad in radians])[:, None]
+    steps = np.arange(math.floor(array_size/2))[None, :]
+
+    cols = (np.round(steps * sin_alpha) + ref_index).astype(np.int64)
+    rows = (ref_index - np.round(steps * cos_alpha)).astype(np.int64)
+
+    #not to close to ref to avoid effect of the trotoir.
+    in_buffer = ((ref_index - buffer_index <= cols) & (cols <= ref_index + buffer_index) &
+                 (ref_index - buffer_index <= rows) & (rows <= ref_index + buffer_index))
+    dist_gridspace = np.sqrt((cols - center_index)**2 + (rows - center_index)**2)
+    return rows, cols, dist_gridspace, ~in_buffer
+
+
+def ray_angles(local_array, resolution, loc_buffer=2, num_directions=8):
+    """ This function returns the elevation angle (in degrees) of all the cells along the rays, computed for all
+        directions at once (one gather of all the ray cells from the local DEM).
+
+        Return: numpy array (num_directions x steps), -inf for the cells that are not used. """
+
+    data = np.ma.getdata(local_array)
+    invalid = np.ma.getmaskarray(local_array)
+    ref_index = int(data.shape[0]/2)
+    buffer_index = math.ceil(loc_buffer/resolution)
+
+    # find lowes point in buffer of radius loc_buffer (map units = meter)
+    ref_height = local_array[ref_index - buffer_index: ref_index + buffer_index,
+                             ref_index - buffer_index: ref_index + buffer_index].min()
+
+    rows, cols, dist_gridspace, used = ray_samples(data.shape[0], num_directions, buffer_index)
+    used = used & ~invalid[rows, cols]
+
+    relative_height = (data[rows, cols] - ref_height).astype(np.float64)
+    relative_height[relative_height < 0] = 0.
+    dist = dist_gridspace * float(resolution)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi = np.arctan(relative_height / dist) * (180. / math.pi)
+    phi[~used] = -np.inf
+    return phi
+
+
+def horizon_angles(local_array, resolution, loc_buffer=2, num_directions=8):
+    """ This function returns the horizon angle (max elevation angle in degrees) for each direction.
+
+        Return: numpy array with num_directions horizon angles. """
+
+    if svf_settings['engine'] == 'numba':
+        return _numba_horizon_angles(local_array, resolution, loc_buffer=loc_buffer, num_directions=num_directions)
+    return ray_angles(local_array, resolution, loc_buffer=loc_buffer, num_directions=num_directions).max(axis=1)
+
+
+def local_array_windows(local_array, resolution, radii):
+    """ This function returns the windows (row_start, row_stop, col_start, col_stop) in the local DEM array of the 
+        local arrays of the radii, assuming that the local array is read for the largest radius and the smaller local
+        arrays are centered in it. Exact if the radii are multiples of the resolution. """
+
+    max_radius = max(radii)
+    windows = []
+    for radius in radii:
+        n = int(round((max_radius - float(radius)) / resolution))
+        windows.append((n, local_array.shape[0] - n, n, local_array.shape[1] - n))
+    return windows
+
+
+def horizon_angles_per_radius(local_array, resolution, radii, loc_buffer=2, num_directions=8, array_sizes=None):
+    """ This function returns the horizon angles for multiple local radii from one scan of the rays. The local array
+        must be read for the largest radius. The horizon angle for a radius is the running maximum along the ray up to
+        the last step that a scan of the local array of that radius would use (floor(size / 2) - 1), so the result is 
+        the same as a separate run for each radius if the local arrays have the same center. array_sizes are the 
+        sizes of the local arrays of the radii (see local_array_windows() if None).
+
+        Return: numpy array (radii x num_directions) with the horizon angles. """
+
+    if array_sizes is None:
+        array_sizes = [row_stop - row_start for row_start, row_stop, _col_start, _col_stop in
+                       local_array_windows(local_array, resolution, radii)]
+    running_max = np.maximum.accumulate(ray_angles(local_array, resolution, loc_buffer=loc_buffer,
+                                                   num_directions=num_directions), axis=1)
+    last_step = running_max.shape[1] - 1
+    cutoffs = [min(int(math.floor(size / 2)) - 1, last_step) for size in array_sizes]
+    return running_max[:, cutoffs].T
+
+
+def svf_from_horizon_angles(phi_max, axis=None):
+    """ This function returns the SVF estimate from the horizon angles (in degrees), summed over the axis of the
+        directions (all if None).
+        Note: the sum of the angles is normalized by 90 x 360, this is the mean horizon angle / 90 when 360
+        directions are used. """
+
+    return 1 - ((np.sum(phi_max, axis=axis))/(90 * 360))
+
+
+def get_SVF_from_local_DEM(local_array, local_radius, raster_info, loc_buffer=2, num_directions=8):
+    """ This function returns the SVF estimate of the location at the center of the local DEM array. It gives the
+        same result as the reference implementation, but all the directions are scanned at once. """
+
+    phi_max = horizon_angles(local_array, raster_info["resolution"], loc_buffer=loc_buffer, num_directions=num_directions)
+    return svf_from_horizon_angles(phi_max)
+
+
+def get_SVF_per_radius(local_array, radii, raster_info, loc_buffer=2, num_directions=8, array_windows=None):
+    """ This function returns the SVF estimate of the location at the center of the local DEM array for each of the
+        radii (list). The local array must be read for the largest radius, array_windows are the windows in the local
+        array of the local arrays that would be read for the radii (see local_array_windows() if None). The result is
+        the same as a separate run for each radius: the radii with a local array around the same center are taken 
+        from one scan of the rays, the others (radii that are no multiple of the resolution) are scanned separately.
+
+        Return: list with the SVF for each radius. """
+
+    if array_windows is None:
+        array_windows = local_array_windows(local_array, raster_info["resolution"], radii)
+    size = local_array.shape[0]
+    same_center = [(2 * row_start + (row_stop - row_start) == size) & (2 * col_start + (row_stop - row_start) == size)
+                   for row_start, row_stop, col_start, col_stop in array_windows]
+
+    svf = [None] * len(radii)
+    scanned = [i for i in range(len(radii)) if same_center[i]]
+    if bool(scanned):
+        phi_max = horizon_angles_per_radius(local_array, raster_info["resolution"], [radii[i] for i in scanned],
+                                            loc_buffer=loc_buffer, num_directions=num_directions,
+                                            array_sizes=[array_windows[i][1] - array_windows[i][0] for i in scanned])
+        for i, phi_radius in zip(scanned, phi_max):
+            svf[i] = svf_from_horizon_angles(phi_radius)
+    for i in range(len(radii)):
+        if not same_center[i]:
+            row_start, row_stop, col_start, col_stop = array_windows[i]
+            svf[i] = get_SVF_from_local_DEM(local_array[row_start: row_stop, col_start: col_stop], radii[i], raster_info,
+                                            loc_buffer=loc_buffer, num_directions=num_directions)
+    return svf
+
+
+
+#%% Numba engine (JIT compiled kernels, the numpy functions above are the reference)
+
+if numba is not None:
+    _jit = numba.njit(nogil=True, parallel=True, cache=True)
+    _prange = numba.prange
+else:
+    _jit = lambda function: function
+    _prange = range
+
+
+@_jit
+def _point_horizon_kernel(data, invalid, ref_height, resolution, rows, cols, dist_gridspace, used, phi_max):
+    #max elevation angle along the rays of one location (writes in phi_max)
+    for direction in _prange(rows.shape[0]):
+        best = -np.inf
+        for step in range(rows.shape[1]):
+            row_idx = rows[direction, step]
+            col_idx = cols[direction, step]
+            if (not used[direction, step]) or invalid[row_idx, col_idx]:
+                continue
+            relative_height = data[row_idx, col_idx] - ref_height
+            if relative_height < 0:
+                relative_height = 0.
+            phi = math.atan(relative_height / (dist_gridspace[direction, step] * resolution)) * (180. / math.pi)
+            if phi > best:
+                best = phi
+        phi_max[direction] = best
+
+
+@_jit
+def _grid_svf_kernel(block, ref_height, halo, row_offsets, col_offsets, dist, used, total, max_slope, svf):
+    #svf of all the cells of a block (without the halo), NaN in the block is nodata (writes in svf). total and 
+    #max_slope are scratch arrays of the shape of svf, so nothing is allocated in the loops
+    n_rows, n_cols = svf.shape
+    for row in _prange(n_rows):
+        #each iteration uses its own row of the scratch arrays, the inner loop runs along the (contiguous) columns
+        for col in range(n_cols):
+            total[row, col] = 0.
+        for direction in range(row_offsets.shape[0]):
+            for col in range(n_cols):
+                max_slope[row, col] = -np.inf
+            for step in range(row_offsets.shape[1]):
+                if not used[direction, step]:
+                    continue
+                block_row = halo + row + row_offsets[direction, step]
+                block_col = halo + col_offsets[direction, step]
+                for col in range(n_cols):
+                    #NaN (nodata) is never larger
+                    slope = (block[block_row, block_col + col] - ref_height[row, col]) / dist[direction, step]
+                    if slope > max_slope[row, col]:
+                        max_slope[row, col] = slope
+            for col in range(n_cols):
+                #relative heights below 0 are 0
+                if (max_slope[row, col] > -np.inf) and (max_slope[row, col] < 0.):
+                    max_slope[row, col] = 0.
+                total[row, col] += math.atan(max_slope[row, col]) * (180. / math.pi)
+        for col in range(n_cols):
+            if math.isnan(block[halo + row, halo + col]) or math.isinf(ref_height[row, col]):
+                svf[row, col] = np.nan
+            else:
+                svf[row, col] = 1 - (total[row, col] / (90 * 360))
+
+
+def _numba_horizon_angles(local_array, resolution, loc_buffer=2, num_directions=8):
+    #numba version of horizon_angles()
+    data = np.ma.getdata(local_array)
+    invalid = np.ma.getmaskarray(local_array)
+    ref_index = int(data.shape[0]/2)
+    buffer_index = math.ceil(loc_buffer/resolution)
+    ref_height = local_array[ref_index - buffer_index: ref_index + buffer_index,
+                             ref_index - buffer_index: ref_index + buffer_index].min()
+
+    rows, cols, dist_gridspace, used = ray_samples(data.shape[0], num_directions, buffer_index)
+    phi_max = np.empty(num_directions)
+    _point_horizon_kernel(data, invalid, data.dtype.type(ref_height), float(resolution), rows, cols, dist_gridspace, used, phi_max)
+    return phi_max
+
+
+
+#%% SVF maps (whole DEM grid)
+
+def svf_map_file(dem_file, local_radius, out_folder=None):
+    """ This function returns the path of the SVF map of a DEM file for a local radius. """
+
+    if out_folder is None: #next to the DEM
+        out_folder = os.path.dirname(os.path.abspath(dem_file))
+    name = os.path.splitext(os.path.basename(dem_file))[0]
+    return os.path.join(out_folder, name + '_svf_' + str(int(local_radius)) + 'm.tif')
+
+
+def grid_ray_samples(local_radius, resolution, loc_buffer=2, num_directions=8):
+    """ This function returns the cells scanned along the rays of each direction for the SVF maps. The rays, the number
+        of steps and the distances are those of the scan of the local DEM that find_SVF reads around a location in the
+        center of a cell (see ray_samples()), so the SVF map of a cell is the SVF of a location in that cell. Note that,
+        as in the scan of the local DEM, the distance is measured to the corner of the cells (not to the center).
+
+        Return: (row_offsets, col_offsets, dist, used) arrays of shape (num_directions x steps), the offsets relative
+        to the cell, the distance in meter and used is False for the cells in the buffer around the cell. """
+
+    #the local DEM of a location in the center of a cell is the square of the cells that touch the square buffer
+    array_size = 2 * int(math.ceil(float(local_radius) / resolution - 0.5)) + 1
+    ref_index = int(array_size/2)
+    rows, cols, dist_gridspace, used = ray_samples(array_size, num_directions, math.ceil(loc_buffer/resolution))
+    return rows - ref_index, cols - ref_index, dist_gridspace * float(resolution), used
+
+
+def svf_map_halo(local_radius, resolution, loc_buffer=2, num_directions=8):
+    """ This function returns the number of cells around a block of the DEM that are needed to compute the SVF map of 
+        the block (the rays of grid_ray_samples() and the buffer of the reference height). """
+
+    row_offsets, col_offsets, _dist, _used = grid_ray_samples(local_radius, resolution, loc_buffer, num_directions)
+    return max(int(np.abs(row_offsets).max()), int(np.abs(col_offsets).max()), math.ceil(loc_buffer/resolution))
+
+
+def _reference_height_map(block, halo, resolution, loc_buffer):
+    #lowest point in the buffer around each cell (same cells as in horizon_angles()), inf if there is no data
+    buffer_index = math.ceil(loc_buffer/resolution)
+    rows, cols = block.shape[0] - 2 * halo, block.shape[1] - 2 * halo
+    ref_height = minimum_filter(np.where(np.isnan(block), np.inf, block), size=max(2 * buffer_index, 1), mode='nearest')
+    return ref_height[halo: halo + rows, halo: halo + cols]
+
+
+def grid_horizon_angles(block, halo, local_radius, resolution, loc_buffer=2, num_directions=8):
+    """ This function returns the horizon angles of all the cells of a DEM block (without the halo of halo cells at
+        each side, see svf_map_halo()). The block is a float array with NaN for nodata.
+
+        Return: numpy array (num_directions x rows x cols), NaN for nodata cells. """
+
+    rows, cols = block.shape[0] - 2 * halo, block.shape[1] - 2 * halo
+    ref_height = _reference_height_map(block, halo, resolution, loc_buffer)
+
+    phi_max = np.full((num_directions, rows, cols), np.nan)
+    row_offsets, col_offsets, dist, used = grid_ray_samples(local_radius, resolution, loc_buffer, num_directions)
+    for direction in range(num_directions):
+        max_slope = np.full((rows, cols), -np.inf)
+        #not to close to ref to avoid effect of the trotoir.
+        for row_off, col_off, cell_dist in set(zip(row_offsets[direction][used[direction]], col_offsets[direction][used[direction]],
+                                                   dist[direction][used[direction]])):
+            relative_height = block[halo + row_off: halo + row_off + rows, halo + col_off: halo + col_off + cols] - ref_height
+            np.fmax(max_slope, np.maximum(relative_height, 0.) / cell_dist, out=max_slope) #NaN (nodata) is ignored
+        #arctan is monotonic, so the max angle is the angle of the max slope
+        phi_max[direction] = np.arctan(max_slope) * (180. / math.pi)
+
+    phi_max[:, np.isnan(block[halo: halo + rows, halo: halo + cols]) | np.isinf(ref_height)] = np.nan
+    return phi_max
+
+
+def grid_svf(block, halo, local_radius, resolution, loc_buffer=2, num_directions=8):
+    """ This function returns the SVF of all the cells of a DEM block (without the halo of halo cells at each side,
+        see svf_map_halo()). The block is a float array with NaN for nodata.
+
+        Return: float32 numpy array, NaN for nodata cells. """
+
+    if svf_settings['engine'] == 'numba':
+        row_offsets, col_offsets, dist, used = grid_ray_samples(local_radius, resolution, loc_buffer, num_directions)
+        svf = np.empty((block.shape[0] - 2 * halo, block.shape[1] - 2 * halo), dtype=np.float32)
+        _grid_svf_kernel(block, _reference_height_map(block, halo, resolution, loc_buffer), halo,
+                         row_offsets, col_offsets, dist, used, np.empty(svf.shape), np.empty(svf.shape), svf)
+        return svf
+
+    phi_max = grid_horizon_angles(block, halo, local_radius, resolution, loc_buffer=loc_buffer, num_directions=num_directions)
+    return svf_from_horizon_angles(phi_max, axis=0).astype(np.float32)
+
+
+def _svf_tile(dem_file, raster_file_list, window, halo, local_radius, resolution, loc_buffer, num_directions):
+    #compute the SVF of one tile of the DEM (in a worker process)
+    halo_window = Window(window.col_off - halo, window.row_off - halo, window.width + 2 * halo, window.height + 2 * halo)
+    halo_files = [dem_file]
+    if raster_file_list is not None:
+        with gis.open_raster(dem_file) as src:
+            halo_box = box(*rasterio.windows.bounds(halo_window, src.transform))
+        halo_files += [tile for tile, _info in gis.find_tiles(halo_box, raster_file_list) if tile != dem_file]
+    block, _affine, _nodata = gis.read_mosaic_window(halo_files, halo_window)
+
+    block = np.ma.filled(block.astype(np.float64), np.nan) #nodata and not covered by the DEM
+    return window, grid_svf(block, halo, local_radius, resolution, loc_buffer=loc_buffer, num_directions=num_directions)
+
+
+def create_svf_map(dem_file, local_radius=200, loc_buffer=2, num_directions=8, out_folder=None, tile_size=1024,
+                   raster_file_list=None, n_processes=None):
+    """ This function creates a map of the SVF of each cell of a DEM file. The SVF of a cell is the SVF that find_SVF
+        gives for a location in the center of the cell (see grid_ray_samples()).
+
+         Keyword arguments: \n
+            dem_file -- string
+                        path to the DEM (resolution in meter!!) \n
+            local_radius -- float
+                        the max distance of the surroundings to what the SVF is calculated (in meter) \n
+            loc_buffer -- float
+                        the cells within this distance of the cell (in meter) are not used \n
+            num_directions -- int
+                        the number of directions to be considerd \n
+            out_folder -- string
+                        folder of the output, by default the folder of the DEM file \n
+            tile_size -- int
+                        the DEM is processed in tiles of tile_size x tile_size cells (plus a halo, see svf_map_halo()) \n
+            raster_file_list -- list
+                        all the tiles of the DEM, the halo at the edges of the DEM file is read from the neighbouring
+                        tiles. If None, outside the DEM file is nodata. \n
+            n_processes -- int
+                        number of worker processes, by default the number of cpus. With the numba engine the tiles
+                        are computed in this process (the kernel itself runs on all cpus).
+
+        Return
+            path to the SVF map. """
+
+    with gis.open_raster(dem_file) as src:
+        grid = src.profile
+    resolution = grid['transform'].a
+    halo = svf_map_halo(local_radius, resolution, loc_buffer, num_directions)
+    print('Computing the SVF map of ', dem_file, ' for a local radius of ', local_radius, 'm ...')
+
+    out_file = svf_map_file(dem_file, local_radius, out_folder)
+    tmp_file = out_file + '.raw.tif'
+    profile = {'driver': 'GTiff', 'width': grid['width'], 'height': grid['height'], 'count': 1,
+               'dtype': 'float32', 'crs': grid['crs'], 'transform': grid['transform'], 'nodata': np.nan,
+               'tiled': True, 'blockxsize': 512, 'blockysize': 512, 'BIGTIFF': 'IF_SAFER'}
+
+    windows = [Window(col_start, row_start, min(tile_size, grid['width'] - col_start), min(tile_size, grid['height'] - row_start))
+               for row_start in range(0, grid['height'], tile_size) for col_start in range(0, grid['width'], tile_size)]
+
+    with rasterio.open(tmp_file, 'w', **profile) as dst:
+        dst.update_tags(local_radius=local_radius, loc_buffer=loc_buffer, num_directions=num_directions)
+        if svf_settings['engine'] == 'numba':
+            for window in windows:
+                window, svf = _svf_tile(dem_file, raster_file_list, window, halo, local_radius, resolution, loc_buffer, num_directions)
+                dst.write(svf, 1, window=window)
+        else:
+            #spawn (not fork): a forked worker can deadlock on the thread pool of the numba kernels of this process
+            with ProcessPoolExecutor(max_workers=n_processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [executor.submit(_svf_tile, dem_file, raster_file_list, window, halo, local_radius, resolution,
+                                           loc_buffer, num_directions) for window in windows]
+                for future in futures:
+                    window, svf = future.result()
+                    dst.write(svf, 1, window=window)
+
+    gis.write_cog(tmp_file, out_file, resampling='average')
+    rasterio.shutil.delete(tmp_file)
+    return out_file
+
+
+def sample_svf_maps(lats, lons, dem_file_list, local_radius, out_folder=None):
+    """ This function returns the SVF at the locations, sampled from the SVF maps (see create_svf_map()) of the DEM files.
+
+        Return: numpy array with the SVF, NaN if a location is not covered. """
+
+    if isinstance(dem_file_list, str): #if there is one tif file
+        dem_file_list = [dem_file_list]
+
+    svf_files = [svf_map_file(dem_file, local_radius, out_folder) for dem_file in dem_file_list]
+    return gis.sample_points(lats, lons, svf_files)
+
+
+
+#%% Regression check of the vectorized implementation against the reference implementation
+
+def regression_check():
+    """ Compare the SVF of each engine (numpy, and numba if it is installed) with the reference implementation on 
+        random DEMs. """
+
+    engines = ['numpy'] if numba is None else ['numpy', 'numba']
+    active_engine = svf_settings['engine']
+    try:
+        for engine in engines:
+            print('Checking the ', engine, ' engine of the SVF ...')
+            set_svf_engine(engine)
+            engine_check()
+    finally:
+        set_svf_engine(active_engine)
+    print('The SVF of the engines ', engines, ' is equal to the reference SVF.')
+
+
+def engine_check():
+    """ Compare the SVF of the active engine (see set_svf_engine()) with the reference implementation on random DEMs. """
+
+    rng = np.random.default_rng(42)
+    for resolution, size in [(10., 41), (10., 40), (1., 401), (5., 81)]:
+        local_array = (rng.random((size, size)) * 25.).astype('float32')
+        raster_info = {'resolution': resolution}
+        for loc_buffer in [2, 20]:
+            reference = get_SVF_from_local_DEM_reference(local_array, 200, raster_info, loc_buffer=loc_buffer, num_directions=8)
+            vectorized = get_SVF_from_local_DEM(local_array, 200, raster_info, loc_buffer=loc_buffer, num_directions=8)
+            print('resolution: ', resolution, ' loc_buffer: ', loc_buffer, ' reference: ', reference, ' vectorized: ', vectorized)
+            assert abs(reference - vectorized) < 1e-9
+    print('The vectorized SVF is equal to the reference SVF.')
+
+    #the SVF for multiple radii from one scan equals a separate run on the (smaller) local array of each radius
+    radii = [50, 100, 150, 200]
+    for resolution, size in [(10., 41), (10., 40), (5., 81)]:
+        local_array = (rng.random((size, size)) * 25.).astype('float32')
+        local_array[int(size/2) - int(100 / resolution), :] = 60. #a wall at exactly 100m to the north
+        raster_info = {'resolution': resolution}
+        per_radius = get_SVF_per_radius(local_array, radii, raster_info, loc_buffer=2, num_directions=8)
+        for radius, svf_radius, window in zip(radii, per_radius, local_array_windows(local_array, resolution, radii)):
+            radius_array = local_array[window[0]: window[1], window[2]: window[3]]
+            single = get_SVF_from_local_DEM(radius_array, radius, raster_info, loc_buffer=2, num_directions=8)
+            print('resolution: ', resolution, ' radius: ', radius, ' single radius: ', single, ' multiple radii: ', svf_radius)
+            assert abs(single - svf_radius) < 1e-9
+    print('The SVF for multiple radii is equal to the SVF of separate runs.')
+
+    svf_map_check()
+
+
+def svf_map_check(num_stations=20):
+    """ Compare the SVF maps (see create_svf_map()) sampled at random stations with the SVF of find_SVF at these
+        stations, on a random DEM. The local radii are multiples of the resolution: for other radii the local DEM 
+        of find_SVF depends on the position of the station in its cell, the SVF map is that of the center of the cell. """
+
+    sys.path.append(str(file_folder.parent))
+    import get_all_meta_data
+
+    rng = np.random.default_rng(7)
+    resolution, size = 10., 200
+    dem = (rng.random((size, size)) * 25.).astype('float32')
+    dem[90: 110, 50: 150] += 40. #a building block
+    xs = 3900000. + rng.uniform(600., 1400., num_stations)
+    ys = 3100000. - rng.uniform(600., 1400., num_stations)
+    lons, lats = gis.get_transformer('EPSG:3035', 'EPSG:4326').transform(xs, ys)
+    stationdf = pd.DataFrame({'id': range(num_stations), 'lat': lats, 'lon': lons})
+
+    tmp_folder = tempfile.mkdtemp(prefix='svf_check_')
+    try:
+        dem_file = os.path.join(tmp_folder, 'dem.tif')
+        with rasterio.open(dem_file, 'w', driver='GTiff', width=size, height=size, count=1, dtype='float32', crs='EPSG:3035',
+                           transform=rasterio.Affine(resolution, 0, 3900000., 0, -resolution, 3100000.), nodata=-9999.) as dst:
+            dst.write(dem, 1)
+        for local_radius in [100, 200]:
+            create_svf_map(dem_file, local_radius=local_radius, loc_buffer=20, num_directions=8)
+            svf = [get_all_meta_data.find_SVF(stationdf, 'id', 'lat', 'lon', tmp_folder, local_radius=local_radius, loc_buffer=20,
+                                              num_directions=8, use_svf_maps=use_svf_maps)['svf'].values for use_svf_maps in [False, True]]
+            print('local radius: ', local_radius, ' max difference of the SVF map with find_SVF: ', np.abs(svf[0] - svf[1]).max())
+            assert np.abs(svf[0] - svf[1]).max() < 1e-6
+    finally:
+        gis.close_raster_pool()
+        gis.clear_tile_catalogs()
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    print('The SVF maps are equal to the SVF of find_SVF at the stations.')
+
+
+
+#%% Create the SVF maps of the DEM
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create the SVF maps of the DEM files.')
+    parser.add_argument('--check', action='store_true', help='only compare the SVF engines with the reference implementation (no maps are created)')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        regression_check()
+        return
+
+    main_repo_folder = (Path(__file__).resolve().parent.parent)
+    sys.path.append(str(main_repo_folder))
+    import path_handler
+    import get_all_meta_data
+
+    local_radius_meter = 200
+    loc_buffer_meter = 20
+    num_directions = 8
+    DEM_folder = os.path.join(path_handler.lu_lc_folder, 'DEM')
+
+    DEM_files = get_all_meta_data.DEM_files(DEM_folder)
+    for DEM_file in DEM_files:
+        create_svf_map(DEM_file, local_radius=local_radius_meter, loc_buffer=loc_buffer_meter,
+                       num_directions=num_directions, raster_file_list=DEM_files)
+
+
+if __name__ == "__main__":
+    main()